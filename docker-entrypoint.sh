@@ -7,12 +7,30 @@ case "$1" in
   wikidata)
     python3 src/main.py --pipeline wikidata
     ;;
+  wikidata-incremental)
+    python3 src/main.py --pipeline wikidata --incremental
+    ;;
+  wikidata-shard)
+    python3 src/main.py --pipeline wikidata --shard "${SHARD}"
+    ;;
+  wikidata-merge-shards)
+    python3 src/main.py --pipeline wikidata --merge-shards "${NUM_SHARDS}"
+    ;;
+  reparse)
+    python3 src/main.py --pipeline reparse
+    ;;
   galleries)
     python3 src/main.py --pipeline galleries
     ;;
+  all)
+    python3 src/main.py --pipeline wikidata,galleries
+    ;;
   deploy)
     python3 src/main.py --pipeline deploy
     ;;
+  search-service)
+    python3 src/search_service.py
+    ;;
   *)
     exec "$@"
 esac
\ No newline at end of file
@@ -0,0 +1,147 @@
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
+
+class IVFIndex:
+    """
+    Approximate nearest neighbours for L2-normalised sparse rows (TF-IDF), cosine similarity == dot product.
+
+    Rows are clustered with spherical k-means into `n_lists` inverted lists and stored reordered by list.
+    A query is scored only against the rows of its `n_probe` closest lists, term at a time over the
+    CSC postings of the query terms, so the cost follows the postings of the query, not the row lengths.
+
+    index = IVFIndex(n_probe=8).fit(corpus_numpy)
+    rec_ids, scores = index.search(query_embed, k=10)
+    """
+    def __init__(self, n_lists: Optional[int] = None, n_probe: int = 8, n_iter: int = 10, seed: int = 0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.seed = seed
+        self.centroids = None  # type: Optional[np.ndarray]
+        self.list_offsets = None  # type: Optional[np.ndarray]
+        self.row_ids = None  # type: Optional[np.ndarray]
+        self.centroids_t = None  # type: Optional[np.ndarray]
+        self.row_lists = None  # type: Optional[np.ndarray]
+        self.sorted_cols = None  # type: Optional[sparse.csc_matrix]
+
+    @staticmethod
+    def _normalize(centroids: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return centroids / norms
+
+    def fit(self, corpus: sparse.csr_matrix) -> 'IVFIndex':
+        corpus = sparse.csr_matrix(corpus, dtype=np.float32)
+        num_rows = corpus.shape[0]
+        n_lists = min(self.n_lists or max(1, int(np.sqrt(num_rows))), num_rows)
+        rng = np.random.default_rng(self.seed)
+        centroids = corpus[rng.choice(num_rows, n_lists, replace=False)].toarray()
+        for _ in range(self.n_iter):
+            assignment = np.asarray((corpus @ centroids.T).argmax(axis=1)).ravel()
+            membership = sparse.csr_matrix(
+                (np.ones(num_rows, dtype=np.float32), (assignment, np.arange(num_rows))), shape=(n_lists, num_rows)
+            )
+            centroids = np.asarray((membership @ corpus).todense())
+            empty_lists = np.flatnonzero(np.asarray(membership.sum(axis=1)).ravel() == 0)
+            if empty_lists.size > 0:
+                centroids[empty_lists] = corpus[rng.choice(num_rows, empty_lists.size, replace=False)].toarray()
+            centroids = self._normalize(centroids)
+        assignment = np.asarray((corpus @ centroids.T).argmax(axis=1)).ravel()
+        self.centroids = centroids.astype(np.float32)
+        self.row_ids = np.argsort(assignment, kind='stable').astype(np.int32)
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))]).astype(np.int64)
+        self._prepare(corpus)
+        return self
+
+    def _prepare(self, corpus: sparse.csr_matrix):
+        """Search-time layout: term-major centroids, list id of every sorted row, CSC of the sorted rows"""
+        self.centroids_t = np.ascontiguousarray(self.centroids.T)
+        self.row_lists = np.repeat(np.arange(self.list_offsets.size - 1), np.diff(self.list_offsets))
+        self.sorted_cols = sparse.csc_matrix(corpus[self.row_ids], dtype=np.float32)
+        self.sorted_cols.sort_indices()
+
+    def search(self, query_embed: sparse.spmatrix, k: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k (row ids, scores) of one query, best first"""
+        query_embed = sparse.csr_matrix(query_embed)
+        list_scores = self.centroids_t[query_embed.indices].T @ query_embed.data
+        n_probe = min(self.n_probe, list_scores.size)
+        probed_lists = np.argpartition(-list_scores, n_probe - 1)[:n_probe]
+        # candidates are the rows of the probed lists, laid out list after list
+        list_sizes = self.list_offsets[probed_lists + 1] - self.list_offsets[probed_lists]
+        candidate_offsets = np.full(self.list_offsets.size - 1, -1, dtype=np.int64)
+        candidate_offsets[probed_lists] = np.concatenate([[0], np.cumsum(list_sizes)[:-1]])
+        # term-at-a-time over the postings (CSC columns) of the query terms, only rows of probed lists are scored
+        positions, weights = [], []
+        indptr, indices, data = self.sorted_cols.indptr, self.sorted_cols.indices, self.sorted_cols.data
+        for term, term_weight in zip(query_embed.indices, query_embed.data):
+            rows = indices[indptr[term]:indptr[term + 1]]
+            row_lists = self.row_lists[rows]
+            probed = candidate_offsets[row_lists] >= 0
+            positions.append(rows[probed] - self.list_offsets[row_lists[probed]] + candidate_offsets[row_lists[probed]])
+            weights.append(data[indptr[term]:indptr[term + 1]][probed] * term_weight)
+        num_candidates = int(list_sizes.sum())
+        if len(positions) > 0:
+            scores = np.bincount(np.concatenate(positions), np.concatenate(weights), minlength=num_candidates)
+        else:
+            scores = np.zeros(num_candidates)
+        k = min(k, num_candidates)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        # candidate position -> position in the list-sorted rows -> original row id
+        top_lists = np.searchsorted(np.cumsum(list_sizes), top, side='right')
+        sorted_positions = self.list_offsets[probed_lists[top_lists]] + top - candidate_offsets[probed_lists[top_lists]]
+        return self.row_ids[sorted_positions], scores[top]
+
+    def save(self, path: str):
+        np.savez(path, centroids=self.centroids, list_offsets=self.list_offsets, row_ids=self.row_ids)
+
+    @classmethod
+    def load(cls, path: str, corpus: sparse.csr_matrix, n_probe: int = 8) -> 'IVFIndex':
+        """Only the clustering is stored, rows come from the corpus matrix the index was built on"""
+        index = cls(n_probe=n_probe)
+        with np.load(path) as data:
+            index.centroids = data['centroids']
+            index.list_offsets = data['list_offsets']
+            index.row_ids = data['row_ids']
+        index.n_lists = index.centroids.shape[0]
+        index._prepare(sparse.csr_matrix(corpus, dtype=np.float32))
+        return index
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-row top-k of a (num_queries, num_docs) score matrix: argpartition, then only k values are sorted"""
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def exact_search(query_embed: sparse.spmatrix, corpus: sparse.csr_matrix, k: int = 10) -> np.ndarray:
+    scores = (corpus @ query_embed.T).T.toarray()
+    return top_k_rows(scores, k)[0][0]
+
+
+def evaluate(index: IVFIndex, corpus: sparse.csr_matrix, queries: sparse.csr_matrix, k: int = 10) -> dict:
+    """recall@k of the index against exact search, with per-query latency percentiles of both paths"""
+    recalls, ann_ms, exact_ms = [], [], []
+    for i in range(queries.shape[0]):
+        query_embed = queries[i]
+        if query_embed.nnz == 0:  # out of vocabulary query, any ranking is as good as another
+            continue
+        start = time.perf_counter()
+        exact_ids = exact_search(query_embed, corpus, k)
+        exact_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        ann_ids, _ = index.search(query_embed, k)
+        ann_ms.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(set(exact_ids) & set(ann_ids)) / max(1, len(exact_ids)))
+    return {
+        f'recall@{k}': float(np.mean(recalls)),
+        'ann_p50_ms': float(np.percentile(ann_ms, 50)), 'ann_p99_ms': float(np.percentile(ann_ms, 99)),
+        'exact_p50_ms': float(np.percentile(exact_ms, 50)), 'exact_p99_ms': float(np.percentile(exact_ms, 99)),
+    }
@@ -0,0 +1,43 @@
+"""
+recall@k and query latency of the IVF index against exact cosine search over the artists corpus
+
+cd src && python -m benchmarks.ann_recall --k 10 --n-probe 8
+
+Queries are artist names plus the first words of sampled wiki texts, encoded with the index vectorizer.
+"""
+import argparse
+import json
+
+import numpy as np
+
+from ann_index import IVFIndex, evaluate
+from prepare_search_index import ContentDB, SOURCE_ARTIFACT
+from utils import artifact_path, read_artifact
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--n-lists', type=int, default=None)
+    parser.add_argument('--n-probe', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--num-queries', type=int, default=1000)
+    args = parser.parse_args()
+
+    content_db = ContentDB()
+    content_db.init_db()
+    rng = np.random.default_rng(0)
+    texts_df = read_artifact(artifact_path(SOURCE_ARTIFACT), columns=['artist_name', 'wiki_text'])
+    sample = texts_df.sample(min(args.num_queries, texts_df.shape[0]), random_state=0)
+    queries = list(sample['artist_name'].astype(str))
+    queries += [' '.join(str(text).split(' ')[:rng.integers(3, 20)]) for text in sample['wiki_text']]
+    query_embeds = content_db.embedder.transform(queries).tocsr()
+    index = IVFIndex(n_lists=args.n_lists).fit(content_db.corpus_numpy)
+    for n_probe in args.n_probe:
+        index.n_probe = n_probe
+        report = evaluate(index, content_db.corpus_numpy, query_embeds, args.k)
+        report.update({'n_lists': int(index.centroids.shape[0]), 'n_probe': n_probe, 'num_queries': len(queries)})
+        print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Load time and peak memory of csv.gz artifacts vs their Parquet twins
+
+cd src && python -m benchmarks.artifact_formats --artifact content_db.csv.gz --columns artist_name,artworks
+
+Every load runs in a fresh process, so peak RSS of one load does not leak into the next.
+"""
+import argparse
+import multiprocessing
+import resource
+import time
+
+import pandas as pd
+
+from utils import artifact_path, parquet_path
+
+
+def load(method: str, csv_path: str, columns):
+    import pyarrow.parquet  # noqa: F401, library import is not part of the measured load
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if method == 'csv':
+        df = pd.read_csv(csv_path)
+    elif method == 'csv_usecols':
+        df = pd.read_csv(csv_path, usecols=columns)
+    elif method == 'parquet':
+        df = pd.read_parquet(parquet_path(csv_path))
+    else:
+        df = pd.read_parquet(parquet_path(csv_path), columns=columns)
+    elapsed = time.perf_counter() - start
+    peak_rss_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024
+    return elapsed, peak_rss_mb, df.memory_usage(deep=True).sum() / 2 ** 20, df.shape
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--artifact', type=str, default='content_db.csv.gz')
+    parser.add_argument('--columns', type=str, default=None, help='comma separated projection')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    csv_path = artifact_path(args.artifact)
+    columns = args.columns.split(',') if args.columns else None
+    methods = ['csv', 'parquet'] + (['csv_usecols', 'parquet_columns'] if columns else [])
+    ctx = multiprocessing.get_context('spawn')
+    print('%-16s %10s %14s %12s %14s' % ('method', 'load_s', 'peak_rss_mb', 'df_mb', 'shape'))
+    for method in methods:
+        runs = []
+        for _ in range(args.repeats):
+            with ctx.Pool(1) as pool:
+                runs.append(pool.apply(load, (method, csv_path, columns)))
+        elapsed, peak_rss_mb, df_mb, shape = min(runs)
+        print('%-16s %10.3f %14.1f %12.1f %14s' % (method, elapsed, peak_rss_mb, df_mb, shape))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Collecting artworks batch files: former frame grown with pd.concat per file vs one concatenation (collect_batches)
+
+cd src && python -m benchmarks.bulk_ingest --num-files 250,500,1000,2000,4000 --batch-size 30
+
+Time per file stays flat for collect_batches while it grows with the number of files for the per-file concat.
+Both must collect identical rows.
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils import logger
+from wikiart import ARTWORKS_COLUMNS, collect_batches, save_batch
+
+
+def collect_batches_reference(batches_dir_name: str) -> pd.DataFrame:
+    """Accumulation pattern before concat_frames, kept as the reference"""
+    res_df = pd.DataFrame([], columns=ARTWORKS_COLUMNS)
+    for batch_file in sorted(f for f in os.listdir(batches_dir_name) if f.endswith('.csv')):
+        res_df = pd.concat([res_df, pd.read_csv(os.path.join(batches_dir_name, batch_file))])
+    return res_df
+
+
+def write_batches(batches_dir_name: str, num_files: int, batch_size: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    for batch_num in range(num_files):
+        save_batch([
+            (
+                ind, f'artist {ind}', f'https://www.wikiart.org/en/artist-{ind}/all-works/text-list',
+                json.dumps([f'https://uploads.wikiart.org/{ind}/{i}.jpg' for i in range(rng.integers(1, 20))])
+            )
+            for ind in range(batch_num * batch_size, (batch_num + 1) * batch_size)
+        ], 'artists_artworks.csv', batches_dir_name)
+
+
+def timed(collect, batches_dir_name: str):
+    start = time.perf_counter()
+    res = collect(batches_dir_name)
+    return time.perf_counter() - start, res
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-files', type=str, default='250,500,1000,2000,4000')
+    parser.add_argument('--batch-size', type=int, default=30)
+    parser.add_argument('--reference-max-files', type=int, default=4000, help='skip the slow reference above it')
+    args = parser.parse_args()
+    logger.setLevel('WARNING')  # one line per saved batch otherwise
+
+    print(f'{"files":>6} {"rows":>8} {"concat loop, s":>15} {"per file, ms":>13} {"collect, s":>11} {"per file, ms":>13}')
+    for num_files in [int(n) for n in args.num_files.split(',')]:
+        batches_dir_name = tempfile.mkdtemp(prefix='batches_')
+        try:
+            write_batches(batches_dir_name, num_files, args.batch_size)
+            collect_time, res = timed(collect_batches, batches_dir_name)
+            if num_files <= args.reference_max_files:
+                reference_time, reference_res = timed(collect_batches_reference, batches_dir_name)
+                assert res.reset_index(drop=True).equals(reference_res.reset_index(drop=True).astype(res.dtypes)), \
+                    'collected rows differ'
+                reference = f'{reference_time:>15.2f} {reference_time / num_files * 1000:>13.2f}'
+            else:
+                reference = f'{"-":>15} {"-":>13}'
+            print(f'{num_files:>6} {res.shape[0]:>8} {reference} {collect_time:>11.2f} {collect_time / num_files * 1000:>13.2f}')
+        finally:
+            shutil.rmtree(batches_dir_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+"""
+Offline end-to-end run of the pipelines against the mock site (benchmarks.mock_site), saved for comparison across commits
+
+cd src && python -m benchmarks.mock_site synthetic --num-artists 2000 --output /tmp/fixtures.jsonl.gz
+cd src && python -m benchmarks.e2e run --fixtures /tmp/fixtures.jsonl.gz --latency-ms 50 --error-rate 0.01
+cd src && python -m benchmarks.e2e compare /srv/data/06_benchmark_runs/<old>.json /srv/data/06_benchmark_runs/<new>.json
+
+Every step is a fresh process over a scratch data dir: full wikidata and galleries scrapes, reparse from the
+HTML cache, incremental wikidata refresh (304 answers of the mock), search index build, then query latency
+of the built index. Per step: wall and CPU time, peak RSS (largest process, pool workers included), pages
+parsed per second and requests per second from the run report of the step.
+
+The run is saved as <runs dir>/<time>_<commit>.json (default: the benchmark_runs artifact dir) and compared
+with the last saved run over the same fixtures and settings; slowdowns above `--threshold` are flagged.
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Dict, List
+
+import yaml
+
+from utils import config, artifact_path, file_digest
+from benchmarks.mock_site import read_fixtures
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STEPS = {
+    'wikidata': ['main.py', '--pipeline', 'wikidata'],
+    'galleries': ['main.py', '--pipeline', 'galleries'],
+    'reparse': ['main.py', '--pipeline', 'reparse'],
+    'wikidata_incremental': ['main.py', '--pipeline', 'wikidata', '--incremental'],
+    'search_index': ['prepare_search_index.py'],
+    'query': ['-m', 'benchmarks.e2e', 'query'],
+}
+# (metric, True when higher is better)
+COMPARED = [
+    ('wall_seconds', False), ('cpu_seconds', False), ('peak_rss_mb', False), ('pages_per_second', True),
+    ('query_p50_ms', False), ('query_p99_ms', False), ('queries_per_second', True),
+]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def git_commit() -> Dict[str, object]:
+    def git(*args) -> str:
+        return subprocess.run(['git', *args], cwd=SRC_DIR, capture_output=True, text=True).stdout.strip()
+
+    return {'commit': git('rev-parse', '--short', 'HEAD') or 'unknown', 'dirty': len(git('status', '--porcelain', '-uno')) > 0}
+
+
+def start_mock_site(args, port: int) -> subprocess.Popen:
+    process = subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.mock_site', 'serve', '--fixtures', args.fixtures, '--port', str(port),
+        '--latency-ms', str(args.latency_ms), '--jitter-ms', str(args.jitter_ms), '--error-rate', str(args.error_rate)
+    ], cwd=SRC_DIR)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Mock site exited with {process.returncode}')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/_stats', timeout=1).read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('Mock site did not start')
+
+
+def mock_stats(port: int) -> dict:
+    with urllib.request.urlopen(f'http://127.0.0.1:{port}/_stats', timeout=5) as response:
+        return json.load(response)
+
+
+def write_config(work_dir: str, base_url: str, city_paths: List[str], overrides: List[str]) -> str:
+    """config.yml of the checkout pointed at the mock site and the scratch dir; `overrides` are dotted key=yaml value"""
+    run_config = json.loads(json.dumps(config))
+    run_config['root_data_dir'] = os.path.join(work_dir, 'data')
+    run_config['wikiart_base_url'] = f'{base_url}/wikiart'
+    run_config['galleries_pages'] = [f'{base_url}/galleriesnow{path}' for path in city_paths]
+    run_config['metrics'] = dict(run_config.get('metrics') or {}, report_dir=os.path.join(work_dir, 'reports'), prometheus_port=None)
+    for override in overrides:
+        key, value = override.split('=', 1)
+        section = run_config
+        *parents, name = key.split('.')
+        for parent in parents:
+            section = section.setdefault(parent, {})
+        section[name] = yaml.safe_load(value)
+    os.makedirs(run_config['root_data_dir'], exist_ok=True)
+    config_path = os.path.join(work_dir, 'config.yml')
+    with open(config_path, 'w') as f:
+        yaml.safe_dump(run_config, f)
+    return config_path
+
+
+def report_totals(report_path: str) -> dict:
+    with open(report_path) as f:
+        report = json.load(f)
+    counters, histograms = report.get('counters', []), report.get('histograms', [])
+    return {
+        'requests': sum(c['value'] for c in counters if c['name'] == 'http_requests_total'),
+        'retries': sum(c['value'] for c in counters if c['name'] == 'http_retries_total'),
+        'pages_parsed': sum(h['count'] for h in histograms if h['name'] == 'parse_seconds'),
+        'stages': report.get('stages'),
+    }
+
+
+def run_step(name: str, env: dict, work_dir: str) -> dict:
+    reports_dir = os.path.join(work_dir, 'reports')
+    reports_before = set(glob.glob(os.path.join(reports_dir, '*.json')))
+    log_path = os.path.join(work_dir, f'{name}.log')
+    start = time.perf_counter()
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen([sys.executable, *STEPS[name]], cwd=SRC_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+        # rusage of wait4 covers the waited descendants (process pool workers) too, maxrss is the largest process
+        _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    result = {
+        'returncode': process.returncode,
+        'wall_seconds': wall,
+        'cpu_seconds': usage.ru_utime + usage.ru_stime,
+        'peak_rss_mb': usage.ru_maxrss / 1024,
+        'log': log_path,
+    }
+    new_reports = sorted(set(glob.glob(os.path.join(reports_dir, '*.json'))) - reports_before)
+    if len(new_reports) > 0:
+        result.update(report_totals(new_reports[-1]))
+        if result['pages_parsed'] > 0:
+            result['pages_per_second'] = result['pages_parsed'] / wall
+        if result['requests'] > 0:
+            result['requests_per_second'] = result['requests'] / wall
+    if name == 'query' and process.returncode == 0:
+        with open(log_path) as log:
+            result.update(json.loads(log.read().strip().splitlines()[-1]))
+    return result
+
+
+def query_latency(num_queries: int, k: int = 10, seed: int = 0):
+    """Per-query latency of `recommend_many` on the built index and batch throughput; prints one JSON line"""
+    import numpy as np
+
+    from prepare_search_index import ContentDB
+    from utils import logger
+
+    logger.setLevel('WARNING')
+    start = time.perf_counter()
+    content_db = ContentDB()
+    content_db.init_db()
+    load_seconds = time.perf_counter() - start
+    rng = np.random.default_rng(seed)
+    names = content_db.df['artist_name'].astype(str).values
+    queries = [' '.join(rng.choice(names, 2)) for _ in range(num_queries)]
+    latencies = []
+    for query in queries:
+        query_start = time.perf_counter()
+        content_db.recommend_many([query], k)
+        latencies.append(time.perf_counter() - query_start)
+    batch_start = time.perf_counter()
+    content_db.recommend_many(queries, k)
+    batch_seconds = time.perf_counter() - batch_start
+    latencies_ms = np.array(latencies) * 1000
+    print(json.dumps({
+        'index_load_seconds': load_seconds,
+        'query_p50_ms': float(np.percentile(latencies_ms, 50)),
+        'query_p99_ms': float(np.percentile(latencies_ms, 99)),
+        'query_mean_ms': float(latencies_ms.mean()),
+        'queries_per_second': num_queries / batch_seconds,
+    }))
+
+
+def comparable_runs(runs_dir: str, run: dict) -> List[str]:
+    paths = []
+    for path in sorted(glob.glob(os.path.join(runs_dir, '*.json'))):
+        with open(path) as f:
+            saved = json.load(f)
+        if saved['fixtures_digest'] == run['fixtures_digest'] and saved['settings'] == run['settings']:
+            paths.append(path)
+    return paths
+
+
+def compare(old: dict, new: dict, threshold: float) -> List[str]:
+    """Prints metric changes per step, returns the regressions"""
+    regressions = []
+    print(f'{old["commit"]} -> {new["commit"]}{" (dirty)" if new.get("dirty") else ""}')
+    print(f'{"step":>22} {"metric":>18} {"before":>10} {"after":>10} {"change":>8}')
+    for step, result in new['steps'].items():
+        before = old['steps'].get(step, {})
+        for metric, higher_is_better in COMPARED:
+            if metric not in result or metric not in before or before[metric] == 0:
+                continue
+            change = result[metric] / before[metric] - 1
+            worse = -change if higher_is_better else change
+            flag = ''
+            if worse > threshold:
+                flag = '  <- regression'
+                regressions.append(f'{step} {metric} {change:+.0%}')
+            print(f'{step:>22} {metric:>18} {before[metric]:>10.2f} {result[metric]:>10.2f} {change:>+8.0%}{flag}')
+    return regressions
+
+
+def run(args):
+    steps = args.steps.split(',')
+    unknown = set(steps) - set(STEPS)
+    if len(unknown) > 0:
+        raise SystemExit(f'Unknown steps: {sorted(unknown)}')
+    city_paths = sorted({
+        page['path'] for page in read_fixtures(args.fixtures)
+        if page['site'] == 'galleriesnow' and re.fullmatch(r'/exhibitions/[^/]+', page['path'])
+    })
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='e2e_')
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    config_path = write_config(work_dir, base_url, city_paths, args.set)
+    env = dict(
+        os.environ, CONFIG_PATH=config_path, ROOT_DATA_DIR=os.path.join(work_dir, 'data'),
+        WIKIART_BASE_URL=f'{base_url}/wikiart', E2E_NUM_QUERIES=str(args.num_queries)
+    )
+    run_record = dict(
+        git_commit(),
+        started=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        fixtures=os.path.abspath(args.fixtures),
+        fixtures_digest=file_digest(args.fixtures),
+        settings={
+            'latency_ms': args.latency_ms, 'jitter_ms': args.jitter_ms, 'error_rate': args.error_rate,
+            'set': sorted(args.set), 'num_queries': args.num_queries
+        },
+        steps={},
+    )
+    mock_site = start_mock_site(args, port)
+    try:
+        for step in steps:
+            result = run_step(step, env, work_dir)
+            run_record['steps'][step] = result
+            print(f'{step}: exit {result["returncode"]}, {result["wall_seconds"]:.1f} s, {result["peak_rss_mb"]:.0f} MB'
+                  + (f', {result["pages_per_second"]:.1f} pages/s' if 'pages_per_second' in result else '')
+                  + (f', p50 {result["query_p50_ms"]:.2f} ms' if 'query_p50_ms' in result else ''), flush=True)
+        run_record['mock_site'] = mock_stats(port)
+    finally:
+        mock_site.terminate()
+        mock_site.wait()
+
+    runs_dir = args.runs_dir or artifact_path('benchmark_runs')
+    os.makedirs(runs_dir, exist_ok=True)
+    previous = comparable_runs(runs_dir, run_record)
+    run_path = os.path.join(runs_dir, f'{time.strftime("%Y%m%d_%H%M%S")}_{run_record["commit"]}.json')
+    with open(run_path, 'w') as f:
+        json.dump(run_record, f, indent=2)
+    print(f'Run saved to {run_path}')
+    if not args.keep_work_dir and args.work_dir is None:
+        shutil.rmtree(work_dir)
+    failed = [step for step, result in run_record['steps'].items() if result['returncode'] != 0]
+    if len(previous) > 0:
+        with open(previous[-1]) as f:
+            regressions = compare(json.load(f), run_record, args.threshold)
+        if len(regressions) > 0:
+            print('Regressions: ' + ', '.join(regressions))
+    if len(failed) > 0:
+        raise SystemExit(f'Failed steps: {failed}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('--fixtures', type=str, required=True)
+    run_parser.add_argument('--steps', type=str, default=','.join(STEPS))
+    run_parser.add_argument('--latency-ms', type=float, default=50)
+    run_parser.add_argument('--jitter-ms', type=float, default=10)
+    run_parser.add_argument('--error-rate', type=float, default=0)
+    run_parser.add_argument('--set', type=str, action='append', default=[], help='config override, e.g. http.concurrency=32')
+    run_parser.add_argument('--num-queries', type=int, default=500)
+    run_parser.add_argument('--runs-dir', type=str, default=None)
+    run_parser.add_argument('--work-dir', type=str, default=None, help='kept after the run, a temporary dir otherwise')
+    run_parser.add_argument('--keep-work-dir', action='store_true')
+    run_parser.add_argument('--threshold', type=float, default=0.1, help='relative slowdown reported as a regression')
+    commands.add_parser('query')
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('old', type=str)
+    compare_parser.add_argument('new', type=str)
+    compare_parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'query':
+        query_latency(int(os.getenv('E2E_NUM_QUERIES', '500')))
+    else:
+        with open(args.old) as f_old, open(args.new) as f_new:
+            compare(json.load(f_old), json.load(f_new), args.threshold)
+
+
+if __name__ == '__main__':
+    main()
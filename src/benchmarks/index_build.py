@@ -0,0 +1,55 @@
+"""
+Build time and peak memory of the search index: in-memory TfidfVectorizer fit vs streaming hashing build
+
+cd src && python -m benchmarks.index_build --chunksize 5000 --build-workers 1 4
+
+Every build runs in a fresh process and writes to a scratch directory next to the real index.
+"""
+import argparse
+import multiprocessing
+import resource
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from utils import artifact_path, config
+
+
+def build(vectorizer: str, chunksize: int, build_workers: int):
+    from prepare_search_index import ContentDB, source_fingerprint, SOURCE_ARTIFACT
+
+    config['search_index'] = dict(config.get('search_index', {}), vectorizer=vectorizer,
+                                  chunksize=chunksize, build_workers=build_workers)
+    index_dir = artifact_path('search_index_benchmark')
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    ContentDB().build_index(index_dir, source_fingerprint(SOURCE_ARTIFACT))
+    elapsed = time.perf_counter() - start
+    peak_rss_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024
+    # peak of the largest finished hashing worker
+    worker_rss_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    shutil.rmtree(index_dir)
+    return elapsed, peak_rss_mb, worker_rss_mb
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunksize', type=int, default=5000)
+    parser.add_argument('--build-workers', type=int, nargs='+', default=[1])
+    args = parser.parse_args()
+
+    # executor processes are not daemonic, so the build can start its own hashing pool;
+    # fork, because a spawned process makes its pool spawn too and worker imports would dominate the timing
+    ctx = multiprocessing.get_context('fork')
+    runs = [('tfidf', 1)] + [('hashing', build_workers) for build_workers in args.build_workers]
+    print('%-10s %8s %10s %14s %16s' % ('vectorizer', 'workers', 'build_s', 'peak_rss_mb', 'worker_rss_mb'))
+    for vectorizer, build_workers in runs:
+        with ProcessPoolExecutor(1, mp_context=ctx) as executor:
+            elapsed, peak_rss_mb, worker_rss_mb = executor.submit(
+                build, vectorizer, args.chunksize, build_workers
+            ).result()
+        print('%-10s %8d %10.2f %14.1f %16.1f' % (vectorizer, build_workers, elapsed, peak_rss_mb, worker_rss_mb))
+
+
+if __name__ == '__main__':
+    main()
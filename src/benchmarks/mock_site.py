@@ -0,0 +1,264 @@
+"""
+Local stand-in for wikiart.org and galleriesnow.net serving HTML fixtures, for reproducible end-to-end runs
+
+cd src && python -m benchmarks.mock_site record --data-dir /srv/data --num-artists 500 --output fixtures.jsonl.gz
+cd src && python -m benchmarks.mock_site synthetic --num-artists 2000 --output fixtures.jsonl.gz
+cd src && python -m benchmarks.mock_site serve --fixtures fixtures.jsonl.gz --port 8800 --latency-ms 50 --error-rate 0.01
+
+Fixtures are gzipped JSON lines of {site, path, html}. `record` takes them from the HTML cache stores of a
+previous scrape (alphabet pages, which are never cached, are rebuilt from artists_pages.csv), `synthetic`
+generates pages in the same layout. Sites are served under /wikiart and /galleriesnow, absolute links to the
+real sites are rewritten to the mock. Responses carry an ETag and answer If-None-Match with 304, so incremental
+runs revalidate as against the real site; `--latency-ms` / `--jitter-ms` delay every response and
+`--error-rate` answers that share of requests with 503.
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import random
+import string
+from typing import Dict, Iterable, Iterator, List
+from urllib.parse import unquote, urlsplit
+
+SITE_ORIGINS = {'wikiart': 'https://www.wikiart.org', 'galleriesnow': 'https://www.galleriesnow.net'}
+ALPHABET_PAGE = '/en/Alphabet/{letter}/text-list'
+HTML_DIRS = ['artists_raw_html', 'art_links', 'artworks_raw_html', 'galleriesnow_raw_html']
+
+
+def write_fixtures(path: str, pages: Iterable[dict]) -> int:
+    num_pages = 0
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        for page in pages:
+            f.write(json.dumps(page, ensure_ascii=False) + '\n')
+            num_pages += 1
+    return num_pages
+
+
+def read_fixtures(path: str) -> Iterator[dict]:
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def site_path(url: str, origins: Dict[str, str]):
+    """(site, decoded path) of a real site url, None for urls of other hosts"""
+    for site, origin in origins.items():
+        if url.startswith(origin + '/'):
+            return site, unquote(urlsplit(url[len(origin):]).path)
+    return None
+
+
+def alphabet_pages(artists: List[tuple]) -> Iterator[dict]:
+    """Alphabet listings of (artist_name, artist_link), artists filed by the first letter of their name"""
+    by_letter = {letter: [] for letter in string.ascii_lowercase}
+    for artist_name, artist_link in artists:
+        letter = artist_name[:1].lower()
+        by_letter[letter if letter in by_letter else 'a'].append((artist_name, artist_link))
+    for letter, letter_artists in by_letter.items():
+        items = ''.join(f'<li><a href="{link}">{name}</a></li>' for name, link in letter_artists)
+        yield {
+            'site': 'wikiart', 'path': ALPHABET_PAGE.format(letter=letter),
+            'html': f'<html><body><div class="masonry-text-view masonry-text-view-all"><ul>{items}</ul></div></body></html>'
+        }
+
+
+def record(data_dir: str, artists_pages_csv: str, num_artists: int, wikiart_origin: str, seed: int = 0) -> Iterator[dict]:
+    """Cached pages of a sample of artists (artist page, artworks list, artwork pages) plus all galleriesnow pages"""
+    import pandas as pd
+
+    os.environ['ROOT_DATA_DIR'] = data_dir
+    from html_cache import html_cache
+    from wikiart import parse_artworks_list
+
+    origins = dict(SITE_ORIGINS, wikiart=wikiart_origin.rstrip('/'))
+    artists_df = pd.read_csv(artists_pages_csv)
+    if num_artists < artists_df.shape[0]:
+        artists_df = artists_df.sample(num_artists, random_state=seed).sort_index()
+    yield from alphabet_pages(list(zip(artists_df['artist_name'], artists_df['artist_link'])))
+    artist_pages, art_links, artwork_pages = (html_cache(name) for name in HTML_DIRS[:3])
+    for artist_link in artists_df['artist_link']:
+        artist_url = os.path.join(origins['wikiart'], artist_link[1:])
+        list_url = os.path.join(artist_url, 'all-works/text-list')
+        urls = [(artist_pages, artist_url), (art_links, list_url)]
+        list_html = art_links.get(list_url)
+        if list_html is not None:
+            # get_artworks_links requests the first 11 artworks of an artist
+            urls += [(artwork_pages, os.path.join(origins['wikiart'], link[1:])) for link in parse_artworks_list(list_html)[:11]]
+        for cache, url in urls:
+            html_content = cache.get(url)
+            if html_content is not None:
+                site, path = site_path(url, origins)
+                yield {'site': site, 'path': path, 'html': html_content}
+    galleries = html_cache(HTML_DIRS[3])
+    for url in galleries.urls():
+        located = site_path(url, origins)
+        if located is not None:
+            yield {'site': located[0], 'path': located[1], 'html': galleries.get(url)}
+
+
+def synthetic(num_artists: int, num_cities: int = 3, exhibitions_per_city: int = 60, seed: int = 0) -> Iterator[dict]:
+    """Pages in the layout the extractors expect; wiki texts draw from a Zipf-like vocabulary"""
+    rng = random.Random(seed)
+    vocabulary = [''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 10))) for _ in range(5000)]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    movements = ['Cubism', 'Surrealism', 'Impressionism', 'Post-Impressionism', 'Abstract Expressionism', 'Baroque',
+                 'Northern Renaissance', 'Pop Art', 'Art Nouveau (Modern)', 'Naive Art (Primitivism)', 'Realism']
+    fields = ['painting', 'sculpture', 'graphics', 'photography', 'architecture', 'drawing']
+    artists = []
+    for ind in range(num_artists):
+        first = ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 8)))
+        artists.append((f'{first.capitalize()} Artist{ind}', f'/en/{first}-artist{ind}'))
+    yield from alphabet_pages(artists)
+    for artist_name, artist_link in artists:
+        wiki_text = ' '.join(rng.choices(vocabulary, weights, k=rng.randint(100, 400)))
+        artist_movements = ', '.join(rng.sample(movements, rng.randint(1, 3)))
+        artist_fields = ''.join(f'<a>{field},</a> ' for field in rng.sample(fields, rng.randint(1, 3)))
+        yield {'site': 'wikiart', 'path': artist_link, 'html': f'''<html><body>
+<div class="wiki-layout-artist-image-wrapper"><img src="https://uploads.wikiart.org{artist_link}.jpg"></div>
+<div class="wiki-layout-artist-info"><ul>
+<li><s>Nationality:</s><span>{rng.choice(['French', 'Spanish', 'German', 'Dutch', 'Russian'])}</span></li>
+<li><s>Art Movement:</s><a>{artist_movements}</a></li>
+<li><s>Field:</s>{artist_fields}</li>
+<li><s>Wikipedia:</s><a>en.wikipedia.org/wiki/{artist_name.replace(' ', '_')}</a></li>
+<li><s>Share:</s><a>share</a></li>
+</ul></div>
+<div id="info-tab-wikipediaArticle" class="wiki-layout-artist-info-tab">{wiki_text}</div>
+</body></html>'''}
+        works = [f'{artist_link}/work-{i}' for i in range(rng.randint(0, 15))]
+        items = ''.join(f'<li><a href="{work}">Work {i}</a></li>' for i, work in enumerate(works))
+        yield {
+            'site': 'wikiart', 'path': f'{artist_link}/all-works/text-list',
+            'html': f'<html><body><ul class="painting-list-text">{items}</ul></body></html>'
+        }
+        for work in works[:11]:
+            yield {'site': 'wikiart', 'path': work, 'html': (
+                f'<html><body><div class="wiki-layout-artist-image-wrapper">'
+                f'<img src="https://uploads.wikiart.org{work}.jpg"></div></body></html>'
+            )}
+    galleriesnow = SITE_ORIGINS['galleriesnow']
+    for city_num in range(num_cities):
+        city = ['london', 'berlin', 'paris', 'new-york', 'vienna'][city_num % 5] + ('' if city_num < 5 else str(city_num))
+        items = []
+        for n in range(exhibitions_per_city):
+            gallery_num = n % (exhibitions_per_city // 3 + 1)
+            gallery_name = f'{city} gallery {gallery_num}'
+            exhibition_path = f'/exhibitions/{city}/show-{n}'
+            gallery_path = f'/galleries/{city}/gallery-{gallery_num}'
+            items.append(
+                f'<li data-gallery-name="{gallery_name}"><div class="panel-heading">'
+                f'<a href="{galleriesnow}{gallery_path}">{gallery_name}</a></div>'
+                f'<div class="panel-body"><a href="{galleriesnow}{exhibition_path}">more</a><div class="extb-1">'
+                f'<a href="{galleriesnow}{exhibition_path}">Show {n}</a><div class="space_address"> {n} Street </div>'
+                f'<div class="d-block"> 10:00 - 18:00 </div></div></div></li>'
+            )
+            description = ' '.join(rng.choices(vocabulary, weights, k=60))
+            yield {'site': 'galleriesnow', 'path': exhibition_path, 'html': (
+                f'<html><body><div class="col-md-8"><p>Artist: <a href="/artists/a{n}">Artist {n}</a></p></div>'
+                f'<div class="row"><p>{description}</p></div></body></html>'
+            )}
+            slides = ''.join(
+                f'<div class="slick-image-slide"><div class="ex_fullimg" '
+                f'style="background-image: url(\'https://img.galleriesnow.net{gallery_path}/{i}.jpg\')"></div></div>'
+                for i in range(gallery_num % 4)
+            )
+            yield {'site': 'galleriesnow', 'path': gallery_path, 'html': f'<html><body>{slides}</body></html>'}
+        yield {
+            'site': 'galleriesnow', 'path': f'/exhibitions/{city}',
+            'html': f'<html><body><ul class="contentul">{"".join(items)}</ul></body></html>'
+        }
+
+
+class MockSite:
+    """aiohttp app over the fixtures; pages are prepared once (links rewritten, ETag computed) when it starts"""
+    def __init__(self, fixtures_path: str, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0, seed: int = 0):
+        self.fixtures_path = fixtures_path
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._pages = {}  # type: Dict[str, tuple]
+        self.num_requests = 0
+        self.num_errors = 0
+
+    def load(self, base_url: str):
+        for page in read_fixtures(self.fixtures_path):
+            html_content = page['html']
+            for site, origin in SITE_ORIGINS.items():
+                html_content = html_content.replace(origin, f'{base_url}/{site}')
+            self._pages[f"/{page['site']}{page['path']}"] = (
+                html_content, '"%s"' % hashlib.sha1(html_content.encode()).hexdigest()
+            )
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        self.num_requests += 1
+        delay = self.latency + self._rng.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self._rng.random() < self.error_rate:
+            self.num_errors += 1
+            return web.Response(status=503, headers={'Retry-After': '0'})
+        page = self._pages.get(request.path)
+        if page is None:
+            return web.Response(status=404)
+        html_content, etag = page
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(text=html_content, content_type='text/html', headers={'ETag': etag})
+
+    async def stats(self, _):
+        from aiohttp import web
+
+        return web.json_response({'pages': len(self._pages), 'requests': self.num_requests, 'errors': self.num_errors})
+
+    def app(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.add_routes([web.get('/_stats', self.stats), web.get('/{tail:.*}', self.handle)])
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+    record_parser = commands.add_parser('record')
+    record_parser.add_argument('--data-dir', type=str, required=True, help='ROOT_DATA_DIR of a previous scrape')
+    record_parser.add_argument('--artists-pages', type=str, help='artists_pages.csv, default: the artifact of config.yml')
+    record_parser.add_argument('--num-artists', type=int, default=500)
+    record_parser.add_argument('--output', type=str, required=True)
+    synthetic_parser = commands.add_parser('synthetic')
+    synthetic_parser.add_argument('--num-artists', type=int, default=2000)
+    synthetic_parser.add_argument('--num-cities', type=int, default=3)
+    synthetic_parser.add_argument('--output', type=str, required=True)
+    serve_parser = commands.add_parser('serve')
+    serve_parser.add_argument('--fixtures', type=str, required=True)
+    serve_parser.add_argument('--host', type=str, default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8800)
+    serve_parser.add_argument('--latency-ms', type=float, default=0)
+    serve_parser.add_argument('--jitter-ms', type=float, default=0)
+    serve_parser.add_argument('--error-rate', type=float, default=0)
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        from utils import artifact_path, wikiart_base_url
+
+        pages = record(args.data_dir, args.artists_pages or artifact_path('artists_pages.csv'), args.num_artists, wikiart_base_url())
+        print('Pages recorded: %d' % write_fixtures(args.output, pages))
+    elif args.command == 'synthetic':
+        print('Pages generated: %d' % write_fixtures(args.output, synthetic(args.num_artists, args.num_cities)))
+    else:
+        from aiohttp import web
+
+        site = MockSite(args.fixtures, args.latency_ms, args.jitter_ms, args.error_rate)
+        site.load(f'http://{args.host}:{args.port}')
+        print('Serving %d pages on http://%s:%d' % (len(site._pages), args.host, args.port), flush=True)
+        web.run_app(site.app(), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == '__main__':
+    main()
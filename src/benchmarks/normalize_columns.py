@@ -0,0 +1,79 @@
+"""
+artist_field / artist_movement / art tag splitting: per-row .apply vs the column-wise normalize module
+
+cd src && python -m benchmarks.normalize_columns --artifact artists_info.csv
+cd src && python -m benchmarks.normalize_columns --synthetic 200000
+
+Outputs of both implementations must be identical.
+"""
+import argparse
+import time
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.tag_split import MOVEMENT_WORDS, synthetic_movements
+from normalize import normalize_field, normalize_movement, movement_tags
+from utils import artifact_path, read_artifact
+
+
+def process_field(raw_str):
+    """per-row artist_field before the normalize module, kept as the reference output"""
+    if not isinstance(raw_str, str):
+        return ''
+    return ' '.join(sorted(set([
+        i.strip().replace(',', '')
+        for i in raw_str.split(' ')
+        if len(i.strip().replace(',', '')) > 0]))
+    )
+
+
+def process_art_movement(raw_str):
+    """per-row artist_movement before the normalize module, kept as the reference output"""
+    if not isinstance(raw_str, str):
+        return ''
+    res = ' '.join(sorted(set([i.strip() for i in raw_str.split(',')])))
+    return ' '.join(sorted(set(res.split(' '))))
+
+
+def raw_tags(movements: pd.Series) -> list:
+    """per-row tag split of compute_tags before the normalize module"""
+    tag_lists = movements.fillna('').apply(lambda x: x.lower()).apply(
+        lambda raw_str: [i.strip() for i in raw_str.split(',') if len(i.strip().lower()) > 0]
+    )
+    return list(chain.from_iterable(tag_lists.values))
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--artifact', type=str, default=None, help='csv with `field` and `art movement` columns')
+    parser.add_argument('--synthetic', type=int, default=100000, help='number of synthetic artists without --artifact')
+    args = parser.parse_args()
+
+    if args.artifact:
+        artists_df = read_artifact(artifact_path(args.artifact), columns=['field', 'art movement'])
+    else:
+        rng = np.random.default_rng(0)
+        fields = [', '.join(rng.choice(MOVEMENT_WORDS[:8], rng.integers(0, 4))) for _ in range(args.synthetic)]
+        artists_df = pd.DataFrame({'field': fields, 'art movement': synthetic_movements(args.synthetic)})
+    print('%-16s %10s %10s %10s %10s' % ('column', 'rows', 'apply_s', 'column_s', 'identical'))
+    for name, reference, columnwise, values in (
+        ('artist_field', lambda x: x.apply(process_field), normalize_field, artists_df['field']),
+        ('artist_movement', lambda x: x.apply(process_art_movement), normalize_movement, artists_df['art movement']),
+        ('raw_tags', raw_tags, lambda x: movement_tags(x).tolist(), artists_df['art movement']),
+    ):
+        expected, reference_s = timed(reference, values)
+        result, columnwise_s = timed(columnwise, values)
+        identical = list(expected) == list(result)
+        print('%-16s %10d %10.3f %10.3f %10s' % (name, values.size, reference_s, columnwise_s, identical))
+
+
+if __name__ == '__main__':
+    main()
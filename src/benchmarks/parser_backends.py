@@ -0,0 +1,86 @@
+"""
+Golden-file equivalence check and per-page parse time for every html parser backend
+
+cd src && python -m benchmarks.parser_backends --html-dir /srv/data/artists_raw_html --golden /srv/data/golden_artists.json
+
+Pages are read from an HTML cache store (index.sqlite + segments), keyed by url in the golden file.
+The golden file is written from the first available backend ('html.parser') when it does not exist yet,
+every backend is then compared with it page by page.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from html_cache import HtmlCache
+from html_parser import PARSER_BACKENDS
+from wikiart import parse_artist_page, parse_artwork_page, parse_artworks_list
+
+PARSE_FUNCTIONS = {
+    'artist': parse_artist_page,
+    'artwork': parse_artwork_page,
+    'artworks_list': parse_artworks_list,
+}
+
+
+def load_pages(html_dir: str, limit: int) -> Dict[str, str]:
+    """First `limit` pages (by url) of an HTML cache store, keyed by url"""
+    cache = HtmlCache(html_dir)
+    return {url: cache.get(url) for url in cache.urls()[:limit]}
+
+
+def run_backend(parse_fn, pages: Dict[str, str], backend: str):
+    results, timings = {}, []  # type: Dict, List[float]
+    for name, html_content in pages.items():
+        start = time.perf_counter()
+        parsed = parse_fn(html_content, backend)
+        timings.append(time.perf_counter() - start)
+        # json round trip: tuples become lists, same as in the golden file
+        results[name] = json.loads(json.dumps(parsed))
+    return results, np.array(timings) * 1000
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--html-dir', type=str, required=True)
+    parser.add_argument('--golden', type=str, required=True)
+    parser.add_argument('--page-type', type=str, default='artist', choices=list(PARSE_FUNCTIONS))
+    parser.add_argument('--limit', type=int, default=500)
+    args = parser.parse_args()
+
+    parse_fn = PARSE_FUNCTIONS[args.page_type]
+    pages = load_pages(args.html_dir, args.limit)
+    golden = None
+    if os.path.exists(args.golden):
+        with open(args.golden, 'r') as f:
+            golden = json.load(f)
+    num_failed = 0
+    print('%-12s %6s %10s %10s %10s %10s' % ('backend', 'pages', 'mean_ms', 'p50_ms', 'p99_ms', 'mismatch'))
+    for backend in PARSER_BACKENDS:
+        try:
+            results, timings_ms = run_backend(parse_fn, pages, backend)
+        except ImportError as e:
+            print('%-12s skipped: %s' % (backend, e))
+            continue
+        if golden is None:
+            golden = results
+            with open(args.golden, 'w') as f:
+                json.dump(golden, f, ensure_ascii=False, indent=1)
+            print('Golden file written from %s: %s' % (backend, args.golden))
+        mismatches = [name for name in results if name in golden and results[name] != golden[name]]
+        num_failed += len(mismatches)
+        print('%-12s %6d %10.3f %10.3f %10.3f %10d' % (
+            backend, len(results), timings_ms.mean(),
+            np.percentile(timings_ms, 50), np.percentile(timings_ms, 99), len(mismatches)
+        ))
+        for name in mismatches[:5]:
+            print('  %s differs:\n    got      %s\n    expected %s' % (name, results[name], golden[name]))
+    return 1 if num_failed > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""
+Throughput and latency of a running search service
+
+cd src && python search_service.py &
+cd src && python -m benchmarks.search_load --url http://localhost:8080 --concurrency 32 --requests 5000
+
+Queries are artist names and the first words of wiki texts; `--unique-queries` bounds how many distinct
+queries are sent, so it sets the share of requests answered by the query cache.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+import numpy as np
+
+from prepare_search_index import SOURCE_ARTIFACT
+from utils import artifact_path, read_artifact
+
+
+def sample_queries(num_queries: int, seed: int = 0) -> list:
+    texts_df = read_artifact(artifact_path(SOURCE_ARTIFACT), columns=['artist_name', 'wiki_text']).fillna('')
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(texts_df.shape[0], min(num_queries, texts_df.shape[0]), replace=False)
+    queries = []
+    for i, row in enumerate(rows):
+        if i % 2 == 0:
+            queries.append(texts_df['artist_name'].iloc[row])
+        else:
+            queries.append(' '.join(texts_df['wiki_text'].iloc[row].split(' ')[:rng.integers(3, 20)]))
+    return queries
+
+
+async def run(url: str, queries: list, num_requests: int, concurrency: int, k: int) -> dict:
+    latencies, errors = [], 0
+    next_request = iter(range(num_requests))
+
+    async def worker(session: aiohttp.ClientSession):
+        nonlocal errors
+        for i in next_request:
+            start = time.perf_counter()
+            try:
+                async with session.get(f'{url}/recommend', params={'q': queries[i % len(queries)], 'k': k}) as res:
+                    await res.read()
+                    if res.status != 200:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        await asyncio.gather(*[worker(session) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+        async with session.get(f'{url}/health') as res:
+            health = await res.json()
+    return {
+        'requests': num_requests, 'errors': errors, 'concurrency': concurrency,
+        'throughput_rps': num_requests / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)), 'p99_ms': float(np.percentile(latencies, 99)),
+        'service': health,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', type=str, default='http://localhost:8080')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--unique-queries', type=int, default=2000)
+    parser.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+
+    queries = sample_queries(args.unique_queries)
+    report = asyncio.run(run(args.url.rstrip('/'), queries, args.requests, args.concurrency, args.k))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
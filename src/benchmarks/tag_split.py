@@ -0,0 +1,91 @@
+"""
+Tag normalization of compute_tags: former per-tag DataFrame merge vs the tag -> size hash index
+
+cd src && python -m benchmarks.tag_split --artifact artists_info.csv
+cd src && python -m benchmarks.tag_split --synthetic 20000
+
+Both implementations split every unique art movement tag, outputs must be identical.
+"""
+import argparse
+import time
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+from utils import artifact_path, n_gram_split, read_artifact
+from wikiart import greedy_tag_split
+
+MOVEMENT_WORDS = [
+    'abstract', 'expressionism', 'impressionism', 'post-impressionism', 'realism', 'socialist', 'art', 'nouveau',
+    'modern', 'naive', 'primitivism', 'neo', 'classicism', 'romanticism', 'baroque', 'pop', 'street', 'minimalism',
+    'conceptual', 'surrealism', 'cubism', 'analytical', 'synthetic', 'fauvism', 'symbolism', 'academic', 'renaissance',
+]
+
+
+def greedy_tag_split_reference(raw_tag_description: str, tags_df: pd.DataFrame) -> str:
+    """greedy_tag_split before the hash index, kept as the reference output"""
+    input_str = raw_tag_description
+    res = (
+        pd.DataFrame(n_gram_split(input_str), columns=['tag'])
+        .merge(tags_df[~tags_df['tag'].isin([input_str])], how='inner', on='tag')
+        .sort_values(by='size', ascending=False)  # sort values for greedy matching algorithms
+        ['tag']
+        .values
+    )
+    res_tags = []
+    for i in res:
+        if i in input_str and len(i) < 20: # 27
+            res_tags.append(i)
+            input_str = input_str.replace(i, '')
+        if ' '.join(res_tags) == input_str:
+            break
+    if len(res_tags) == 0:
+        res_tags.append(input_str)
+    return ','.join([' '.join(set(j.split(' '))) for j in res_tags])
+
+
+def synthetic_movements(num_artists: int, seed: int = 0) -> pd.Series:
+    rng = np.random.default_rng(seed)
+    movements = []
+    for _ in range(num_artists):
+        tags = [
+            ' '.join(rng.choice(MOVEMENT_WORDS, rng.integers(1, 5))) for _ in range(rng.integers(1, 4))
+        ]
+        movements.append(', '.join(tags))
+    return pd.Series(movements)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--artifact', type=str, default=None, help='csv with an `art movement` column')
+    parser.add_argument('--synthetic', type=int, default=5000, help='number of synthetic artists without --artifact')
+    args = parser.parse_args()
+
+    if args.artifact:
+        movements = read_artifact(artifact_path(args.artifact), columns=['art movement'])['art movement']
+    else:
+        movements = synthetic_movements(args.synthetic)
+    raw_tags = chain.from_iterable(
+        [i.strip() for i in raw_str.split(',') if len(i.strip()) > 0] for raw_str in movements.fillna('').str.lower()
+    )
+    tags_df = pd.Series(list(raw_tags), name='tag').value_counts().reset_index(name='cnt')
+    tags_df['size'] = tags_df['tag'].str.len()
+
+    start = time.perf_counter()
+    reference = [greedy_tag_split_reference(tag, tags_df) for tag in tags_df['tag']]
+    reference_s = time.perf_counter() - start
+    start = time.perf_counter()
+    tag_sizes = dict(zip(tags_df['tag'], tags_df['size']))
+    indexed = [greedy_tag_split(tag, tag_sizes) for tag in tags_df['tag']]
+    indexed_s = time.perf_counter() - start
+
+    num_mismatches = sum(a != b for a, b in zip(reference, indexed))
+    print('%-10s %8s %12s' % ('method', 'tags', 'seconds'))
+    print('%-10s %8d %12.3f' % ('merge', len(reference), reference_s))
+    print('%-10s %8d %12.3f' % ('index', len(indexed), indexed_s))
+    print('identical output: %s (%d mismatches), speedup x%.0f' % (num_mismatches == 0, num_mismatches, reference_s / indexed_s))
+
+
+if __name__ == '__main__':
+    main()
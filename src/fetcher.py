@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import time
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from utils import logger
+from metrics import metrics
+from http_client import RETRY_STATUSES, http_config, retry_delay
+from html_cache import html_cache
+
+
+class HostRateLimiter:
+    """
+    Spaces out request starts so that one host gets at most `rate` requests per second.
+    Slots are booked under a thread lock, so fetchers of stages running in parallel threads can share one limiter.
+    """
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = {}  # type: Dict[str, float]
+        self._lock = threading.Lock()
+
+    async def wait(self, host: str):
+        if self.interval == 0.0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+_rate_limiters = {}  # type: Dict[float, HostRateLimiter]
+_rate_limiters_lock = threading.Lock()
+
+
+def shared_rate_limiter(rate: float) -> HostRateLimiter:
+    """One limiter per rate and process: concurrent pipeline stages together stay within the per-host rate"""
+    with _rate_limiters_lock:
+        if rate not in _rate_limiters:
+            _rate_limiters[rate] = HostRateLimiter(rate)
+        return _rate_limiters[rate]
+
+
+class AsyncFetcher:
+    """
+    Downloads pages concurrently into the HTML cache store used by `wikiart.get_html`.
+
+    fetcher = AsyncFetcher(concurrency=16, rate_limit_per_host=8)
+    statuses = fetcher.prefetch(urls, 'artists_raw_html')  # {url: 200 / 304 / None}
+
+    200 - page downloaded (new or changed), 304 - cached page is used, None - download failed.
+    With `revalidate=True` cached pages are re-requested with their ETag / Last-Modified validators.
+    """
+    def __init__(
+        self,
+        concurrency: Optional[int] = None,
+        rate_limit_per_host: Optional[float] = None,
+        num_retries: Optional[int] = None,
+        timeout: Optional[float] = None
+    ):
+        cfg = http_config()
+        self.concurrency = concurrency or cfg.get('concurrency', 16)
+        self.per_domain_concurrency = cfg.get('per_domain_concurrency', 8)
+        self.rate_limit_per_host = rate_limit_per_host or cfg.get('rate_limit_per_host', 8)
+        self.num_retries = num_retries or cfg.get('num_retries', 5)
+        self.timeout = timeout or cfg.get('timeout', 30)
+
+    async def _download(self, session: aiohttp.ClientSession, url: str, headers: Dict[str, str]):
+        """(status, text, response headers); status is None when all retries failed"""
+        host = urlsplit(url).netloc
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(self.per_domain_concurrency)
+        for attempt in range(self.num_retries):
+            retry_after = None
+            wait_start = time.perf_counter()
+            try:
+                # slots are held per attempt, never while sleeping before a retry; the rate slot is taken inside them,
+                # so a request leaves right after its spacing and never queues on a semaphore after it
+                async with self._semaphore, self._host_slots[host]:
+                    await self._limiter.wait(host)
+                    start = time.perf_counter()
+                    metrics.observe('http_wait_seconds', start - wait_start, client='async')
+                    async with session.get(url, headers=headers) as res:
+                        body = await res.read()
+                        metrics.observe('http_request_seconds', time.perf_counter() - start, client='async')
+                        metrics.inc('http_requests_total', client='async', status=res.status)
+                        metrics.inc('http_downloaded_bytes_total', len(body), client='async')
+                        if res.status in (200, 304):
+                            return res.status, await res.text(), res.headers
+                        logger.error('Failed to retrieve webpage %s. Status code: %s', url, res.status)
+                        if res.status not in RETRY_STATUSES:
+                            return None, None, None
+                        retry_after = res.headers.get('Retry-After')
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                metrics.inc('http_errors_total', client='async', error=type(e).__name__)
+                logger.error('Failed to retrieve webpage %s\n%s', url, e)
+            if attempt + 1 < self.num_retries:
+                metrics.inc('http_retries_total', client='async')
+                await asyncio.sleep(retry_delay(attempt, retry_after))
+        return None, None, None
+
+    async def _fetch(self, session: aiohttp.ClientSession, url: str, html_dir_name: str, revalidate: bool) -> Optional[int]:
+        cache = html_cache(html_dir_name)
+        headers = {}
+        if url in cache:
+            metrics.inc('html_cache_hits_total', cache=html_dir_name)
+            if not revalidate:
+                return 304
+            headers = cache.conditional_headers(url)
+        else:
+            metrics.inc('html_cache_misses_total', cache=html_dir_name)
+        status, html_content, res_headers = await self._download(session, url, headers)
+        if status == 304:
+            metrics.inc('html_cache_not_modified_total', cache=html_dir_name)
+            cache.mark_not_modified(url)
+        elif status == 200:
+            cache.put(url, html_content, status, res_headers.get('ETag'), res_headers.get('Last-Modified'))
+            self._num_downloaded += 1
+            if self._num_downloaded % 500 == 0:
+                logger.info('Pages downloaded: %d', self._num_downloaded)
+        elif url in cache:
+            logger.error('Revalidation failed, cached page is used: %s', url)
+            return 304
+        return status
+
+    async def _prefetch(self, urls: Iterable[str], html_dir_name: str, revalidate: bool) -> Dict[str, Optional[int]]:
+        # asyncio primitives are bound to the running loop, so they are created per run; the rate limiter is shared
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._limiter = shared_rate_limiter(self.rate_limit_per_host)
+        self._host_slots = {}  # type: Dict[str, asyncio.Semaphore]
+        self._num_downloaded = 0
+        unique_urls = list(dict.fromkeys(urls))
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            results = await asyncio.gather(*[
+                self._fetch(session, url, html_dir_name, revalidate) for url in unique_urls
+            ])
+        return dict(zip(unique_urls, results))
+
+    def prefetch(self, urls: Iterable[str], html_dir_name: str = '', revalidate: bool = False) -> Dict[str, Optional[int]]:
+        """Makes sure every url is in the HTML cache, returns per-url statuses"""
+        return asyncio.run(self._prefetch(urls, html_dir_name, revalidate))
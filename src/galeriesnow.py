@@ -1,12 +1,19 @@
 import os
-from typing import Optional, List
-import requests
+import json
+from functools import partial
+from typing import Dict, List, Tuple
 import re
 
 import pandas as pd
-from bs4 import BeautifulSoup
 
-from utils import logger
+from utils import logger, parallel_map
+from metrics import metrics
+from writers import CsvStreamWriter
+from html_parser import make_soup
+from fetcher import AsyncFetcher
+from html_cache import html_cache, parse_cached_page
+
+GALLERIESNOW_HTML_DIR = 'galleriesnow_raw_html'
 
 
 def extract_txt_description(scraper):
@@ -38,94 +45,132 @@ def extract_artist(scraper):
             res.update({'artist_name': g.text, 'artist_link': f'{prefix}{link}'})
   return res
 
-def get_exhibition_description(exhibition_url):
+def parse_exhibition_page(html_content: str) -> Dict[str, str]:
+    galery_scraper = make_soup(html_content)
     res = {}
-    galery_web_page = requests.get(exhibition_url)
-    galery_scraper = BeautifulSoup(markup=galery_web_page.content, features="html.parser")
     res.update(extract_artist(galery_scraper))
     res.update(extract_txt_description(galery_scraper))
     return res
 
-def get_exhibitions(url: str, output_csv_path: str) -> pd.DataFrame:
-    if not os.path.exists(output_csv_path):
-        logger.info('Loading to %s...' % output_csv_path)
-        artwork_web_page = requests.get(url)
-        galleries_scraper = BeautifulSoup(markup=artwork_web_page.content, features="html.parser")
-        galleries_block = galleries_scraper.find(name='ul', class_='contentul')
-
-        img_iter = galleries_block.find_all(name='li')
-        cnt = 0
-        batch_size = 5
-        res = []
-        for i in img_iter:
-            cur_exhibition = {'galery_name' : i['data-gallery-name']}
-            g = i.find(name='div', class_='panel-body')
-            link = g.find('a')
-            if link is not None:
-                cur_exhibition.update({'exhibition_link': link['href']})
-                cur_exhibition.update(get_exhibition_description(link['href']))
-                t = g.find(name='div', class_='extb-1')
-                if t is not None:
-                    exhibition_link = t.find('a')
-                    if exhibition_link is not None:
-                        cur_exhibition.update({'exhibition_name': exhibition_link.text})
-                    addr = t.find(name='div', class_='space_address')
-                    if addr is not None:
-                        cur_exhibition.update({'galery_adress':  addr.text.strip()})
-                    open_hours = t.find(name='div', class_='d-block')
-                    if open_hours is not None:
-                        cur_exhibition.update({'open hours':  open_hours.text.strip()})
-                    res.append(cur_exhibition)
-                    cnt += 1
-                    if cnt % batch_size == 0:
-                        print('%d saved' % cnt)
-        # saving data
-        pd.json_normalize(res).to_csv(output_csv_path, index=False)
-    logger.info('Exhibitions data collected: %s', output_csv_path)
+def parse_gallery_images(html_content: str) -> str:
+    gallery_scraper = make_soup(html_content)
+    res = []
+    for tt in gallery_scraper.find_all(class_='slick-image-slide'):
+        img = tt.find(class_='ex_fullimg')
+        res.append(re.search(r"url\('(\S+)'\)", img['style']).group(1))
+    return json.dumps(res)
 
-def gallerty_images(url: str) -> Optional[List]:
-  import json
-
-  galery_web_page = requests.get(url)
-  gallery_scraper = BeautifulSoup(markup=galery_web_page.content, features="html.parser")
-  t = gallery_scraper.find_all(class_='slick-image-slide')
-  res = []
-  for tt in t:
-    img = tt.find(class_='ex_fullimg')
-    pattern = r"url\('(\S+)'\)"
-    res.append(re.search(pattern, img['style']).group(1))
-  res = json.dumps(res)
-  return res
+def parse_listing(html_content: str) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+    """
+    (exhibitions, galleries) of a city listing page, both outputs come from one parse.
+    Exhibitions keep their `exhibition_link` to fetch the description, galleries are unique by name
+    and keep their `gallery_link` (if any) to fetch the images.
+    """
+    galleries_block = make_soup(html_content).find(name='ul', class_='contentul')
+    exhibitions, galleries, gallery_names = [], [], set()
+    for i in galleries_block.find_all(name='li'):
+        galery_name = i['data-gallery-name']
+        g = i.find(name='div', class_='panel-body')
+        link = g.find('a')
+        t = g.find(name='div', class_='extb-1')
+        if link is not None and t is not None:
+            cur_exhibition = {'galery_name': galery_name, 'exhibition_link': link['href']}
+            exhibition_link = t.find('a')
+            if exhibition_link is not None:
+                cur_exhibition.update({'exhibition_name': exhibition_link.text})
+            addr = t.find(name='div', class_='space_address')
+            if addr is not None:
+                cur_exhibition.update({'galery_adress': addr.text.strip()})
+            open_hours = t.find(name='div', class_='d-block')
+            if open_hours is not None:
+                cur_exhibition.update({'open hours': open_hours.text.strip()})
+            exhibitions.append(cur_exhibition)
+        if galery_name not in gallery_names:
+            gallery_names.add(galery_name)
+            cur_gallery = {'galery_name': galery_name}
+            d = i.find(class_='panel-heading')
+            if d is not None:
+                cur_gallery.update({'gallery_link': d.find('a')['href']})
+            galleries.append(cur_gallery)
+    return exhibitions, galleries
 
-def get_galleries(url: str, output_csv_path: str, overwrite: bool = False):
-    if not os.path.exists(output_csv_path) or overwrite:
-        artwork_web_page = requests.get(url)
-        galleries_scraper = BeautifulSoup(markup=artwork_web_page.content, features="html.parser")
-        galleries_block = galleries_scraper.find(name='ul', class_='contentul')
+def parse_detail_pages(parse_fn, urls: List[str]) -> Dict[str, object]:
+    """Cached pages parsed in a process pool, None for pages that could not be downloaded"""
+    return dict(zip(urls, parallel_map(partial(parse_cached_page, parse_fn, GALLERIESNOW_HTML_DIR), urls)))
 
-        img_iter = galleries_block.find_all(name='li')
-        cnt = 0
-        batch_size = 5
-        res = []
-        for i in img_iter:
-            cur_exhibition = {'galery_name' : i['data-gallery-name']}
-            if i['data-gallery-name'] not in [i['galery_name'] for i in res]:
-                d = i.find(class_='panel-heading')
-                if d is not None:
-                    gallery_link = d.find('a')['href']
-                    gallery_imgs = gallerty_images(gallery_link)
-                    cur_exhibition.update({'gallery_link': gallery_link, 'gallery_imgs': gallery_imgs})
+def scrape_cities(cities: List[Tuple[str, str, str]], overwrite_galleries: bool = False):
+    """
+    Exhibitions and galleries csv files of (listing url, exhibitions csv path, galleries csv path) cities.
+    Every listing page is downloaded and parsed once for both outputs, then exhibition and gallery pages
+    of all cities are downloaded concurrently into the HTML cache and parsed in a process pool.
+    Existing outputs are kept (galleries are redone with `overwrite_galleries`).
+    """
+    cities = [
+        (url, exhibitions_path, galleries_path, not os.path.exists(exhibitions_path),
+         overwrite_galleries or not os.path.exists(galleries_path))
+        for url, exhibitions_path, galleries_path in cities
+    ]
+    cities = [city for city in cities if city[3] or city[4]]
+    if len(cities) == 0:
+        logger.info('Exhibitions and galleries data already collected')
+        return
+    fetcher = AsyncFetcher()
+    cache = html_cache(GALLERIESNOW_HTML_DIR)
+    # listings change every week, cached ones are only reused when the server says they are unchanged
+    with metrics.timer('phase_seconds', phase='galleries_listings'):
+        statuses = fetcher.prefetch([city[0] for city in cities], GALLERIESNOW_HTML_DIR, revalidate=True)
+    listings = {}
+    for url, *_ in cities:
+        if statuses[url] is None:
+            logger.error('Failed to retrieve listing %s, city skipped', url)
+            continue
+        with metrics.timer('parse_seconds', parser='parse_listing'):
+            listings[url] = parse_listing(cache.get(url))
+    exhibition_urls = list(dict.fromkeys(
+        exhibition['exhibition_link']
+        for url, _, _, do_exhibitions, _ in cities if do_exhibitions and url in listings for exhibition in listings[url][0]
+    ))
+    gallery_urls = list(dict.fromkeys(
+        gallery['gallery_link']
+        for url, _, _, _, do_galleries in cities if do_galleries and url in listings for gallery in listings[url][1]
+        if 'gallery_link' in gallery
+    ))
+    # detail pages keep their urls between runs (gallery images change), so cached ones are revalidated too
+    with metrics.timer('phase_seconds', phase='galleries_fetch'):
+        statuses = fetcher.prefetch(exhibition_urls + gallery_urls, GALLERIESNOW_HTML_DIR, revalidate=True)
+    logger.info(
+        'Galleries pages fetched: %d of %d, modified: %d', sum(status is not None for status in statuses.values()),
+        len(statuses), sum(status == 200 for status in statuses.values())
+    )
+    with metrics.timer('phase_seconds', phase='galleries_parse'):
+        descriptions = parse_detail_pages(parse_exhibition_page, exhibition_urls)
+        gallery_imgs = parse_detail_pages(parse_gallery_images, gallery_urls)
+    for url, exhibitions_path, galleries_path, do_exhibitions, do_galleries in cities:
+        if url not in listings:
+            continue
+        exhibitions, galleries = listings[url]
+        if do_exhibitions:
+            res = []
+            for exhibition in exhibitions:
+                # column order of the former one-by-one scrape: description fields right after the link
+                cur_exhibition = {'galery_name': exhibition['galery_name'], 'exhibition_link': exhibition['exhibition_link']}
+                cur_exhibition.update(descriptions[exhibition['exhibition_link']] or {})
+                cur_exhibition.update(exhibition)
                 res.append(cur_exhibition)
-                cnt += 1
-                if cnt % batch_size == 0:
-                  print('gallery imgs type', type(gallery_imgs))
-                  logger.info('Galleries loaded: %d', cnt)
-        (
-            pd
-            .json_normalize(res)
-            .to_csv(output_csv_path, index=False)
-        )
-    logger.info('Gallery images collected: %s', output_csv_path)
+            pd.json_normalize(res).to_csv(exhibitions_path, index=False)
+            metrics.inc('exhibitions_written_total', len(res))
+            logger.info('Exhibitions data collected: %s, %d rows', exhibitions_path, len(res))
+        if do_galleries:
+            res = []
+            for gallery in galleries:
+                if 'gallery_link' in gallery:
+                    gallery = dict(gallery, gallery_imgs=gallery_imgs[gallery['gallery_link']] or json.dumps([]))
+                res.append(gallery)
+            pd.json_normalize(res).to_csv(galleries_path, index=False)
+            logger.info('Gallery images collected: %s, %d rows', galleries_path, len(res))
+    failed_urls = [city[0] for city in cities if city[0] not in listings]
+    if len(failed_urls) > 0:
+        raise RuntimeError(f'Listing pages not retrieved, restart to retry: {failed_urls}')
 
 def merge_exhibitions_data(artifact_partition_name, exhibitions_data_path: str, galleries_data_path: str, output_csv_path: str):
     if not os.path.exists(output_csv_path):
@@ -140,7 +185,13 @@ def merge_exhibitions_data(artifact_partition_name, exhibitions_data_path: str,
       logger.info('Final data: num rows %d', final_df.shape[0])
     logger.info('Merged data saved to %s', output_csv_path)
 
-def collapse_data(input_files: list, output_file_path: str):
-  res_df = pd.concat([pd.read_csv(f_name) for f_name in input_files])
-  logger.info('Num rows total: %d', res_df.shape[0])
-  res_df.to_csv(output_file_path, index=False, compression='gzip')
+def collapse_data(input_files: list, output_file_path: str, chunksize: int = 10000):
+  """City files are streamed chunk by chunk into one csv and its Parquet twin, columns are the union of all headers"""
+  columns = []
+  for f_name in input_files:
+    columns += [column for column in pd.read_csv(f_name, nrows=0).columns if column not in columns]
+  with CsvStreamWriter(output_file_path, columns, parquet_categories=['city_name']) as writer:
+    for f_name in input_files:
+      for chunk in pd.read_csv(f_name, dtype=str, chunksize=chunksize):
+        writer.write(chunk)
+  logger.info('Num rows total: %d', writer.num_rows)
@@ -0,0 +1,262 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from utils import logger
+from metrics import metrics
+
+try:
+    import zstandard
+except ImportError:  # gzip-compatible zlib is always available
+    zstandard = None
+
+
+def url_key(url: str) -> str:
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+
+def compress(html_content: str):
+    raw = html_content.encode('utf-8')
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=9).compress(raw)
+    return 'zlib', zlib.compress(raw, 6)
+
+
+def decompress(codec: str, data: bytes) -> str:
+    if codec == 'zstd':
+        raw = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        raw = zlib.decompress(data)
+    return raw.decode('utf-8')
+
+
+class HtmlCache:
+    """
+    Raw HTML store of one cache directory (e.g. artists_raw_html).
+
+    Pages are keyed by a hash of the full url, compressed and appended to segment files;
+    `index.sqlite` maps the url hash to (segment, offset, length) plus fetch time and status,
+    so a lookup is one primary key query and one pread instead of a filesystem stat per url.
+    ETag / Last-Modified of the response are kept for conditional revalidation.
+    """
+    def __init__(self, cache_dir: str, segment_prefix: str = 'segment', segment_max_bytes: int = 256 * 2 ** 20):
+        self.cache_dir = cache_dir
+        self.segment_prefix = segment_prefix
+        self.segment_max_bytes = segment_max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite'), check_same_thread=False, timeout=60)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url_hash TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                segment TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                codec TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                etag TEXT,
+                last_modified TEXT
+            )
+        """)
+        columns = {row[1] for row in self._db.execute('PRAGMA table_info(pages)')}
+        for column in ('etag', 'last_modified'):
+            if column not in columns:  # index created before validators were stored
+                self._db.execute(f'ALTER TABLE pages ADD COLUMN {column} TEXT')
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._read_fds = {}  # type: Dict[str, int]
+        self._segment_name = None  # type: Optional[str]
+
+    def _segment_path(self, segment: str) -> str:
+        return os.path.join(self.cache_dir, segment)
+
+    def _writable_segment(self, num_bytes: int) -> str:
+        if self._segment_name is None:
+            existing = sorted(f for f in os.listdir(self.cache_dir) if f.startswith(f'{self.segment_prefix}_'))
+            self._segment_name = existing[-1] if existing else f'{self.segment_prefix}_00000.bin'
+        segment_path = self._segment_path(self._segment_name)
+        if os.path.exists(segment_path) and os.path.getsize(segment_path) + num_bytes > self.segment_max_bytes:
+            segment_num = int(self._segment_name.rsplit('_', 1)[-1].split('.')[0]) + 1
+            self._segment_name = f'{self.segment_prefix}_{segment_num:05d}.bin'
+        return self._segment_name
+
+    def _lookup(self, url: str):
+        with self._lock:
+            return self._db.execute(
+                'SELECT segment, offset, length, codec FROM pages WHERE url_hash = ?', (url_key(url),)
+            ).fetchone()
+
+    def __contains__(self, url: str) -> bool:
+        return self._lookup(url) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def urls(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._db.execute('SELECT url FROM pages ORDER BY url')]
+
+    def get(self, url: str) -> Optional[str]:
+        row = self._lookup(url)
+        if row is None:
+            return None
+        segment, offset, length, codec = row
+        return decompress(codec, self._read(segment, offset, length))
+
+    def _read(self, segment: str, offset: int, length: int) -> bytes:
+        with self._lock:
+            if segment not in self._read_fds:
+                self._read_fds[segment] = os.open(self._segment_path(segment), os.O_RDONLY)
+        return os.pread(self._read_fds[segment], length, offset)
+
+    def _append(self, data: bytes) -> Tuple[str, int]:
+        """Writes compressed page data to the current segment; call with the lock held"""
+        segment = self._writable_segment(len(data))
+        with open(self._segment_path(segment), 'ab') as f:
+            offset = f.tell()
+            f.write(data)
+        return segment, offset
+
+    def put(
+        self,
+        url: str,
+        html_content: str,
+        status: int = 200,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None
+    ):
+        codec, data = compress(html_content)
+        with self._lock:
+            segment, offset = self._append(data)
+            self._db.execute(
+                'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (url_key(url), url, segment, offset, len(data), codec, status, time.time(), etag, last_modified)
+            )
+            self._db.commit()
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """If-None-Match / If-Modified-Since for a cached page, empty dict if there is nothing to revalidate"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT etag, last_modified FROM pages WHERE url_hash = ?', (url_key(url),)
+            ).fetchone()
+        headers = {}
+        if row is not None:
+            etag, last_modified = row
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def mark_not_modified(self, url: str):
+        with self._lock:
+            self._db.execute(
+                'UPDATE pages SET status = 304, fetched_at = ? WHERE url_hash = ?', (time.time(), url_key(url))
+            )
+            self._db.commit()
+
+    def merge(self, other: 'HtmlCache') -> int:
+        """
+        Copies the pages of another store that are missing here or were fetched later than the copy here,
+        compressed data, status, fetch time and validators as they are; returns the number of pages copied
+        """
+        with other._lock:
+            rows = other._db.execute(
+                'SELECT url_hash, url, segment, offset, length, codec, status, fetched_at, etag, last_modified FROM pages'
+            ).fetchall()
+        with self._lock:
+            fetched_at = dict(self._db.execute('SELECT url_hash, fetched_at FROM pages'))
+        num_merged = 0
+        for url_hash, url, segment, offset, length, codec, status, other_fetched_at, etag, last_modified in rows:
+            if fetched_at.get(url_hash, -1) >= other_fetched_at:
+                continue
+            data = other._read(segment, offset, length)
+            with self._lock:
+                segment, offset = self._append(data)
+                self._db.execute(
+                    'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (url_hash, url, segment, offset, length, codec, status, other_fetched_at, etag, last_modified)
+                )
+            num_merged += 1
+        with self._lock:
+            self._db.commit()
+        logger.info('Pages merged from %s to %s: %d of %d', other.cache_dir, self.cache_dir, num_merged, len(rows))
+        return num_merged
+
+    def import_legacy_pages(self, urls: Iterable[str]) -> int:
+        """
+        Moves pages of the old one-file-per-page layout (`<last url part up to a dot>.html`) into the store.
+        A file name that several of `urls` map to (slugs with dots: a.-y.-jackson, a.-j.-casson -> a.html)
+        cannot be attributed to one of them; such files are left in place and those pages are downloaded again.
+        """
+        legacy_files = {f for f in os.listdir(self.cache_dir) if f.endswith('.html')}
+        num_imported = 0
+        if len(legacy_files) == 0:
+            return num_imported
+        urls_by_file = {}  # type: Dict[str, List[str]]
+        for url in urls:
+            urls_by_file.setdefault(f"{url.split('/')[-1].split('.')[0]}.html", []).append(url)
+        num_ambiguous = 0
+        for legacy_file, file_urls in urls_by_file.items():
+            if legacy_file not in legacy_files:
+                continue
+            if len(set(file_urls)) > 1:
+                num_ambiguous += 1
+                continue
+            url = file_urls[0]
+            if url not in self:
+                legacy_path = os.path.join(self.cache_dir, legacy_file)
+                with open(legacy_path, 'r', encoding='utf-8') as file:
+                    self.put(url, file.read())
+                os.remove(legacy_path)
+                legacy_files.discard(legacy_file)
+                num_imported += 1
+        logger.info(
+            'Legacy pages imported to %s: %d, skipped as shared by several urls: %d', self.cache_dir, num_imported, num_ambiguous
+        )
+        return num_imported
+
+
+_caches = {}  # type: Dict[tuple, HtmlCache]
+_caches_lock = threading.Lock()
+
+
+def html_cache(html_dir_name: str = '') -> HtmlCache:
+    """
+    Cache store of a directory under ROOT_DATA_DIR; one instance per process (pool workers open their own).
+    With HTML_CACHE_SEGMENT set (sharded scrapes) every store gets its own segment, e.g. artists_raw_html_shard0of4
+    """
+    key = (os.getpid(), html_dir_name)
+    with _caches_lock:
+        if key not in _caches:
+            segment = os.getenv('HTML_CACHE_SEGMENT')
+            dir_name = f'{html_dir_name}_{segment}' if segment else html_dir_name
+            _caches[key] = HtmlCache(os.path.join(os.environ['ROOT_DATA_DIR'], dir_name))
+        return _caches[key]
+
+
+def merge_segments(html_dir_name: str, segments: List[str]) -> int:
+    """Folds the stores of sharded scrapes (`<html_dir_name>_<segment>`, see `html_cache`) into `<html_dir_name>`"""
+    target = html_cache(html_dir_name)
+    root_data_dir = os.environ['ROOT_DATA_DIR']
+    return sum(target.merge(HtmlCache(os.path.join(root_data_dir, f'{html_dir_name}_{segment}'))) for segment in segments)
+
+
+def parse_cached_page(parse_fn: Callable, html_dir_name: str, url: Optional[str]):
+    """Process pool worker: reads the page from the cache store and parses it, None for missing pages"""
+    if url is None:
+        return None
+    html_content = html_cache(html_dir_name).get(url)
+    if html_content is None:
+        return None
+    with metrics.timer('parse_seconds', parser=getattr(parse_fn, '__name__', 'parse')):
+        return parse_fn(html_content)
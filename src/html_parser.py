@@ -0,0 +1,45 @@
+import os
+
+from bs4 import BeautifulSoup
+
+from utils import config
+
+# 'html.parser' and 'lxml' are BeautifulSoup tree builders,
+# 'selectolax' switches the wikiart extractors to CSS selectors over the lexbor tree
+PARSER_BACKENDS = ('html.parser', 'lxml', 'selectolax')
+
+
+def parser_backend() -> str:
+    backend = os.getenv('HTML_PARSER', config.get('html_parser', 'html.parser'))
+    if backend not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown html parser '{backend}', expected one of {PARSER_BACKENDS}")
+    return backend
+
+
+def make_soup(markup, backend: str = None) -> BeautifulSoup:
+    """BeautifulSoup tree for find/find_all extractors; selectolax has no bs4 API, lxml is used instead"""
+    features = backend or parser_backend()
+    if features == 'selectolax':
+        features = 'lxml'
+    return BeautifulSoup(markup=markup, features=features)
+
+
+def make_tree(markup):
+    from selectolax.lexbor import LexborHTMLParser
+
+    return LexborHTMLParser(markup)
+
+
+def node_text(node) -> str:
+    """
+    selectolax text of a node as BeautifulSoup's get_text() returns it: bs4 collapses whitespace-only
+    text nodes to '\n' (or ' ' when they have no newline), indentation between tags would differ otherwise
+    """
+    parts = []
+    for child in node.traverse(include_text=True):
+        if child.tag == '-text':
+            text = child.text_content
+            if text.strip() == '':
+                text = '\n' if '\n' in text else ' '
+            parts.append(text)
+    return ''.join(parts)
@@ -0,0 +1,113 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils import config, logger
+from metrics import metrics
+
+# throttling and transient server errors, everything else is returned to the caller as is
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def http_config() -> dict:
+    return config.get('http', {})
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff with full jitter: uniform(0, min(cap, base * 2 ** attempt))"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after_delay(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header, which is either delta-seconds or an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    cfg = http_config()
+    backoff_max = cfg.get('backoff_max', 60)
+    delay = retry_after_delay(retry_after)
+    if delay is None:
+        delay = backoff_delay(attempt, cfg.get('backoff_base', 0.5), backoff_max)
+    return min(delay, backoff_max)
+
+
+class HttpClient:
+    """
+    Shared keep-alive session for all scrapers:
+    connection pooling, per-domain concurrency caps, timeouts and retries with backoff / Retry-After
+    """
+    def __init__(self):
+        cfg = http_config()
+        self.timeout = cfg.get('timeout', 30)
+        self.num_retries = cfg.get('num_retries', 5)
+        self.per_domain_concurrency = cfg.get('per_domain_concurrency', 8)
+        pool_size = cfg.get('concurrency', 16)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._domain_slots = {}  # type: Dict[str, threading.BoundedSemaphore]
+        self._lock = threading.Lock()
+
+    def _domain_slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._domain_slots:
+                self._domain_slots[host] = threading.BoundedSemaphore(self.per_domain_concurrency)
+            return self._domain_slots[host]
+
+    def get(self, url: str, headers: Optional[dict] = None, num_retries: Optional[int] = None) -> Optional[requests.Response]:
+        """Last response (possibly non-200) after retries, None if the host could not be reached at all"""
+        num_retries = num_retries or self.num_retries
+        res = None
+        for attempt in range(num_retries):
+            retry_after = None
+            try:
+                wait_start = time.perf_counter()
+                with self._domain_slot(url):
+                    start = time.perf_counter()
+                    metrics.observe('http_wait_seconds', start - wait_start, client='sync')
+                    res = self.session.get(url, headers=headers, timeout=self.timeout)
+                    metrics.observe('http_request_seconds', time.perf_counter() - start, client='sync')
+                metrics.inc('http_requests_total', client='sync', status=res.status_code)
+                metrics.inc('http_downloaded_bytes_total', len(res.content), client='sync')
+                if res.status_code not in RETRY_STATUSES:
+                    return res
+                retry_after = res.headers.get('Retry-After')
+                logger.error('Failed to retrieve webpage %s. Status code: %s', url, res.status_code)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                metrics.inc('http_errors_total', client='sync', error=type(e).__name__)
+                logger.error('Failed to retrieve webpage %s\n%s', url, e)
+            if attempt + 1 < num_retries:
+                metrics.inc('http_retries_total', client='sync')
+                time.sleep(retry_delay(attempt, retry_after))
+        return res
+
+
+_client = None  # type: Optional[HttpClient]
+_client_lock = threading.Lock()
+
+
+def get_client() -> HttpClient:
+    """One client (and connection pool) per process"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+    return _client
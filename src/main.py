@@ -1,61 +1,225 @@
 import argparse
+import os
+from functools import partial
+from typing import List, Optional, Tuple
 
 from utils import (
     config,
+    logger,
     artifact_path,
+    parquet_path,
+    parse_shard,
+    shard_name,
+    shard_path,
     prepare_service_data
 )
+from pipeline import Stage, StageRunner, FAILED, BLOCKED
+from metrics import run_report_path, serve_prometheus, write_report
 from wikiart import (
     get_artists_pages,
     get_artists_info,
     get_photo_urls,
+    merge_shard_outputs,
     merge_data as merge_wikiart_data,
 )
+from html_cache import merge_segments
 from galeriesnow import (
-    get_exhibitions,
-    get_galleries,
+    scrape_cities,
     merge_exhibitions_data,
     collapse_data
 )
 
-def scrape_wikidata():
+WIKIDATA_SHARDED = {
+    # sharded output -> parquet column types of the merged file
+    'artists_info.csv': {'ind': 'int64', 'request_result_success': 'bool'},
+    'artists_wiki_texts.csv': {'ind': 'int64'},
+    'artists_artworks.csv': None,
+}
+# HTML cache stores of the wikidata scrape, one segment per shard
+WIKIDATA_HTML_CACHES = ('artists_raw_html', 'art_links', 'artworks_raw_html')
+
+def wikidata_stages(incremental: bool = False, shard: Optional[Tuple[int, int]] = None) -> List[Stage]:
+    """
+    artists_pages -> artists_info and artworks in parallel (both only read artists_pages.csv) -> merge;
+    with `incremental` artists info is revalidated on every run.
+    A `shard` (index, num_shards) scrapes only its artists into its own outputs and HTML cache segments,
+    the merge runs once all shards are collected, see `shard_merge_stages`
+    """
     csv_path = artifact_path('artists_pages.csv')
-    get_artists_pages(csv_path)
-    # TODO: refactor get_artists_info, using parallel batch processing
-    get_artists_info(csv_path, artifact_path('artists_info.csv'), artifact_path('artists_wiki_texts.csv'))
-    get_photo_urls(csv_path, artifact_path('artists_artworks.csv'), artifact_path('data_batches'))
-    merge_wikiart_data(
-        artifact_path('artists_artworks.csv'),
-        artifact_path('artists_info.csv'),
-        artifact_path('content_db.csv.gz'),
-        artifact_path('tags_db.csv.gz')
+    info_csv_path, wiki_csv_path = (shard_path(artifact_path(name), shard) for name in ('artists_info.csv', 'artists_wiki_texts.csv'))
+    artworks_csv_path = shard_path(artifact_path('artists_artworks.csv'), shard)
+    batches_dir_name = shard_path(artifact_path('data_batches'), shard)
+    stage_suffix = '' if shard is None else f'_{shard_name(shard)}'
+    stages = [
+        Stage('artists_pages', partial(get_artists_pages, csv_path), outputs=[csv_path]),
+        Stage(
+            f'artists_info{stage_suffix}',
+            partial(get_artists_info, csv_path, info_csv_path, wiki_csv_path, incremental=incremental, shard=shard),
+            inputs=[csv_path],
+            outputs=[info_csv_path, wiki_csv_path],
+            scratch=[
+                info_csv_path.replace('.csv', '.jsonl'), wiki_csv_path.replace('.csv', '.jsonl'),
+                parquet_path(info_csv_path), parquet_path(wiki_csv_path)
+            ],
+            always=incremental
+        ),
+        Stage(
+            f'artworks{stage_suffix}',
+            partial(get_photo_urls, csv_path, artworks_csv_path, batches_dir_name, shard=shard),
+            inputs=[csv_path],
+            outputs=[artworks_csv_path],
+            scratch=[batches_dir_name]
+        ),
+    ]
+    if shard is None:
+        stages.append(wikiart_merge_stage())
+    return stages
+
+def wikiart_merge_stage() -> Stage:
+    artworks_csv_path, info_csv_path = artifact_path('artists_artworks.csv'), artifact_path('artists_info.csv')
+    return Stage(
+        'wikiart_merge',
+        partial(
+            merge_wikiart_data,
+            artworks_csv_path, info_csv_path, artifact_path('content_db.csv.gz'), artifact_path('tags_db.csv.gz')
+        ),
+        inputs=[artworks_csv_path, info_csv_path],
+        outputs=[artifact_path('content_db.csv.gz'), artifact_path('tags_db.csv.gz')],
+        scratch=[parquet_path(artifact_path('content_db.csv.gz')), parquet_path(artifact_path('tags_db.csv.gz'))]
     )
 
-def scrape_galleriesnow(galleries_list):
-    resulted_files = []
-    for gallery_link in galleries_list:
-        artifact_partition_name = gallery_link.split('/')[-1]
-        #
-        exhibitions_file_path = artifact_path(f'{artifact_partition_name}_exhibitions.csv')
-        get_exhibitions(gallery_link, exhibitions_file_path)
-        #
-        galleries_file_path = artifact_path(f'{artifact_partition_name}_galleries.csv')
-        get_galleries(gallery_link, galleries_file_path, overwrite=False)
-        #
-        final_file_path = artifact_path(f'{artifact_partition_name}_exhibitions_db.csv')
-        resulted_files.append(final_file_path)
-        merge_exhibitions_data(artifact_partition_name, exhibitions_file_path, galleries_file_path, final_file_path)
-    collapse_data(resulted_files, artifact_path('exhibitions_db.csv.gz'))
-    print('Galleries collected')
+def shard_merge_stages(num_shards: int) -> List[Stage]:
+    """
+    Outputs of all `num_shards` shards (copied into the data dir after the scrape) -> unsharded artifacts
+    -> the usual wikiart merge; `ind` is the artists_pages.csv row in every shard, so it stays consistent.
+    The shard HTML cache stores are folded into the main ones, so reparse and incremental runs work unsharded
+    """
+    shards = [(index, num_shards) for index in range(num_shards)]
+    stages = []
+    for name, column_types in WIKIDATA_SHARDED.items():
+        shard_csv_paths = [shard_path(artifact_path(name), shard) for shard in shards]
+        output_csv_path = artifact_path(name)
+        stages.append(Stage(
+            f"shards_merge_{name.split('.')[0]}",
+            partial(merge_shard_outputs, shard_csv_paths, output_csv_path, column_types),
+            inputs=shard_csv_paths,
+            outputs=[output_csv_path],
+            scratch=[parquet_path(output_csv_path)]
+        ))
+    segments = [shard_name(shard) for shard in shards]
+    for html_dir_name in WIKIDATA_HTML_CACHES:
+        # the main store is not an output a stale rerun could remove; copying skips pages already there
+        stages.append(Stage(
+            f'shards_merge_{html_dir_name}',
+            partial(merge_segments, html_dir_name, segments),
+            inputs=[os.path.join(os.environ['ROOT_DATA_DIR'], f'{html_dir_name}_{segment}', 'index.sqlite') for segment in segments],
+            always=True
+        ))
+    return stages + [wikiart_merge_stage()]
+
+def reparse_wikidata(shard: Optional[Tuple[int, int]] = None):
+    """
+    Rebuilds artists info and artworks from the HTML cache only, without network requests;
+    artworks go through their own batch dir, batches of the scrape are kept
+    """
+    get_artists_info(
+        artifact_path('artists_pages.csv'),
+        shard_path(artifact_path('artists_info.csv'), shard),
+        shard_path(artifact_path('artists_wiki_texts.csv'), shard),
+        offline=True,
+        overwrite=True,
+        shard=shard
+    )
+    get_photo_urls(
+        artifact_path('artists_pages.csv'),
+        shard_path(artifact_path('artists_artworks.csv'), shard),
+        shard_path(artifact_path('data_batches_reparse'), shard),
+        shard=shard,
+        offline=True,
+        overwrite=True
+    )
+
+def galleriesnow_stages(galleries_list) -> List[Stage]:
+    """One scrape of all cities (pages are fetched concurrently across them) -> per-city merges -> one collapsed file"""
+    cities = {gallery_link.split('/')[-1]: gallery_link for gallery_link in galleries_list}
+    exhibitions_paths = {name: artifact_path(f'{name}_exhibitions.csv') for name in cities}
+    galleries_paths = {name: artifact_path(f'{name}_galleries.csv') for name in cities}
+    final_paths = {name: artifact_path(f'{name}_exhibitions_db.csv') for name in cities}
+    stages = [Stage(
+        'galleries_scrape',
+        partial(scrape_cities, [(link, exhibitions_paths[name], galleries_paths[name]) for name, link in cities.items()]),
+        outputs=list(exhibitions_paths.values()) + list(galleries_paths.values())
+    )]
+    stages += [
+        Stage(
+            f'galleries_merge_{name}',
+            partial(merge_exhibitions_data, name, exhibitions_paths[name], galleries_paths[name], final_paths[name]),
+            inputs=[exhibitions_paths[name], galleries_paths[name]],
+            outputs=[final_paths[name]]
+        )
+        for name in cities
+    ]
+    stages.append(Stage(
+        'galleries_collapse',
+        partial(collapse_data, list(final_paths.values()), artifact_path('exhibitions_db.csv.gz')),
+        inputs=list(final_paths.values()),
+        outputs=[artifact_path('exhibitions_db.csv.gz')],
+        scratch=[parquet_path(artifact_path('exhibitions_db.csv.gz'))]
+    ))
+    return stages
+
+def run_stages(pipeline: str, stages: List[Stage], force: List[str], state_name: str = 'pipeline_state.json'):
+    """Runs the stages and writes the run report (metrics of every stage) even when some of them fail"""
+    serve_prometheus()
+    results = {}
+    try:
+        results = StageRunner(stages, artifact_path(state_name)).run(force)
+    finally:
+        write_report(run_report_path(pipeline.replace(',', '_')), pipeline=pipeline, stages=results)
+    logger.info('Stages: %s', results)
+    failed = [name for name, result in results.items() if result in (FAILED, BLOCKED)]
+    if len(failed) > 0:
+        raise SystemExit(f'Failed stages: {failed}')
 
 parser = argparse.ArgumentParser()
-parser.add_argument('--pipeline', type=str, required=True)
-args = parser.parse_args()
+parser.add_argument('--pipeline', type=str, required=True, help='wikidata, galleries or both as wikidata,galleries; reparse; deploy')
+parser.add_argument('--incremental', action='store_true', help='revalidate cached pages, reparse only changed ones')
+parser.add_argument('--force', type=str, default='', help='comma separated stages to redo even if up to date')
+parser.add_argument('--shard', type=str, default=None, help='i/N: wikidata scrape of the i-th of N artist partitions, 0 <= i < N')
+parser.add_argument('--merge-shards', type=int, default=None, help='N: merge the outputs of N wikidata shards')
 
 if __name__ == '__main__':
-    if args.pipeline == 'wikidata':
-        scrape_wikidata()
-    elif args.pipeline == 'galleries':
-        scrape_galleriesnow(config['galleries_pages'])
+    # parsed here, not at import: process pool workers import the main module again
+    args = parser.parse_args()
+    pipelines = args.pipeline.split(',')
+    shard = parse_shard(args.shard) if args.shard else None
+    if shard is not None and args.pipeline not in ('wikidata', 'reparse'):
+        parser.error('--shard applies to the wikidata and reparse pipelines only')
+    if args.merge_shards and (args.pipeline != 'wikidata' or shard is not None):
+        parser.error('--merge-shards applies to the unsharded wikidata pipeline only')
+    if shard is not None:
+        # html_cache of this process and its pool workers
+        os.environ['HTML_CACHE_SEGMENT'] = shard_name(shard)
+    if args.pipeline == 'reparse':
+        try:
+            reparse_wikidata(shard)
+        finally:
+            write_report(run_report_path('reparse' if shard is None else f'reparse_{shard_name(shard)}'), pipeline='reparse')
     elif args.pipeline == 'deploy':
         prepare_service_data()
+    elif set(pipelines) <= {'wikidata', 'galleries'}:
+        stages = []
+        if args.merge_shards:
+            stages += shard_merge_stages(args.merge_shards)
+        elif 'wikidata' in pipelines:
+            stages += wikidata_stages(args.incremental, shard)
+        if 'galleries' in pipelines:
+            stages += galleriesnow_stages(config['galleries_pages'])
+        force = [name for name in args.force.split(',') if len(name) > 0]
+        if shard is None:
+            run_stages(args.pipeline, stages, force)
+        else:
+            # own state file: shards may share a data dir
+            run_stages(f'{args.pipeline}_{shard_name(shard)}', stages, force, f'pipeline_state_{shard_name(shard)}.json')
+    else:
+        parser.error(f'unknown pipeline {args.pipeline}')
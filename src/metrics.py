@@ -0,0 +1,232 @@
+"""
+Process-wide counters, histograms and timers for the scrapers, the pipeline stages and the search index.
+
+metrics.inc('http_requests_total', status=200)
+metrics.observe('http_request_seconds', 0.12, client='async')
+with metrics.timer('parse_seconds', parser='parse_artist_page'):
+    ...
+
+Values recorded in `utils.parallel_map` workers are sent back with every result and merged into the parent,
+so parse times of the process pool show up in the run report. `write_report` dumps everything as JSON,
+`serve_prometheus` exposes the text format on `/metrics`.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from utils import config, logger, artifact_path
+
+# seconds, from a cache hit to a slow page with retries
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 3600.0)
+
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def metric_key(name: str, labels: dict) -> MetricKey:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+class Histogram:
+    """Bucketed observations; quantiles are the upper bounds of the buckets they fall in"""
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def merge(self, other: 'Histogram'):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            'count': self.count, 'sum': self.sum, 'mean': self.sum / max(1, self.count), 'max': self.max,
+            'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99),
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.counters = {}  # type: Dict[MetricKey, float]
+        self.histograms = {}  # type: Dict[MetricKey, Histogram]
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = metric_key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = metric_key(name, labels)
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Wall time of the block in the `name` histogram, also when the block raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def drain(self) -> Tuple[dict, dict]:
+        """Everything recorded since the last drain, reset; pool workers send it back to the parent"""
+        with self._lock:
+            counters, histograms = self.counters, self.histograms
+            self.counters, self.histograms = {}, {}
+        return counters, histograms
+
+    def merge(self, drained: Tuple[dict, dict]):
+        counters, histograms = drained
+        with self._lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, histogram in histograms.items():
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(histogram.buckets)
+                self.histograms[key].merge(histogram)
+
+    def counter_total(self, name: str) -> float:
+        with self._lock:
+            return sum(value for (key_name, _), value in self.counters.items() if key_name == name)
+
+    def report(self) -> dict:
+        elapsed = time.time() - self.started
+        with self._lock:
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+            histograms = [
+                dict({'name': name, 'labels': dict(labels)}, **histogram.summary())
+                for (name, labels), histogram in sorted(self.histograms.items())
+            ]
+        cache_hits, cache_misses = self.counter_total('html_cache_hits_total'), self.counter_total('html_cache_misses_total')
+        return {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'elapsed_seconds': elapsed,
+            'derived': {
+                'requests_per_second': self.counter_total('http_requests_total') / max(elapsed, 1e-9),
+                'downloaded_bytes_per_second': self.counter_total('http_downloaded_bytes_total') / max(elapsed, 1e-9),
+                'retries': self.counter_total('http_retries_total'),
+                'html_cache_hit_ratio': cache_hits / max(1, cache_hits + cache_misses),
+            },
+            'counters': counters,
+            'histograms': histograms,
+        }
+
+    def prometheus_text(self) -> str:
+        def series(name: str, labels: tuple, extra: List[Tuple[str, str]] = ()) -> str:
+            pairs = list(labels) + list(extra)
+            if len(pairs) == 0:
+                return name
+            return name + '{' + ','.join('%s="%s"' % (label, value.replace('"', '\\"')) for label, value in pairs) + '}'
+
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f'# TYPE {name} counter')
+                lines += [
+                    f'{series(name, labels)} {value}' for (key_name, labels), value in sorted(self.counters.items())
+                    if key_name == name
+                ]
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f'# TYPE {name} histogram')
+                for (key_name, labels), histogram in sorted(self.histograms.items()):
+                    if key_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, bucket_count in zip(list(histogram.buckets) + ['+Inf'], histogram.counts):
+                        cumulative += bucket_count
+                        lines.append(f'{series(name + "_bucket", labels, [("le", str(bound))])} {cumulative}')
+                    lines.append(f'{series(name + "_sum", labels)} {histogram.sum}')
+                    lines.append(f'{series(name + "_count", labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+
+def reset_metrics():
+    """Pool worker initializer: a forked worker starts with a copy of the parent values, which must not be sent back"""
+    metrics.drain()
+
+
+def call_with_metrics(func, item):
+    """`utils.parallel_map` worker wrapper: (result, metrics recorded while computing it)"""
+    result = func(item)
+    return result, metrics.drain()
+
+
+def run_report_path(name: str) -> str:
+    """`metrics.report_dir` (default: the run_reports artifact dir) / <name>_<start time>.json"""
+    report_dir = config.get('metrics', {}).get('report_dir') or artifact_path('run_reports')
+    return os.path.join(report_dir, f"{name}_{time.strftime('%Y%m%d_%H%M%S', time.localtime(metrics.started))}.json")
+
+
+def write_report(path: str, **extra) -> str:
+    """JSON run report of everything recorded in this process, `extra` (pipeline, stage results) at the top level"""
+    report = dict(extra, **metrics.report())
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    logger.info('Run report saved to %s', path)
+    return path
+
+
+def serve_prometheus(port: Optional[int] = None, host: str = '0.0.0.0') -> Optional[ThreadingHTTPServer]:
+    """
+    Prometheus text format on http://host:port/metrics from a daemon thread, for the duration of the run;
+    the port defaults to `metrics.prometheus_port`, no endpoint when it is not set
+    """
+    port = port or config.get('metrics', {}).get('prometheus_port')
+    if not port:
+        return None
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info('Prometheus metrics on port %d', port)
+    return server
@@ -0,0 +1,252 @@
+import json
+import os
+import re
+import shutil
+from functools import partial
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+from numpy.lib.format import open_memmap
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+from utils import logger, parallel_map
+
+MANIFEST_FILE = 'manifest.json'
+
+
+class TermVectorizer:
+    """
+    `transform` of a fitted word TfidfVectorizer (no n-grams, no stop words, l2 norm, raw tf) over memory-mapped
+    arrays: `terms` sorted for binary search, `term_columns` their matrix columns and `idf` per column.
+    Nothing is unpickled or rebuilt, so loading costs only the mmap calls.
+    """
+    def __init__(self, terms: np.ndarray, term_columns: np.ndarray, idf: np.ndarray, token_pattern: str, lowercase: bool):
+        self.terms = terms
+        self.term_columns = term_columns
+        self.idf = idf
+        self.token_pattern = token_pattern
+        self.lowercase = lowercase
+        self._tokenize = re.compile(token_pattern).findall
+
+    @classmethod
+    def from_tfidf(cls, vectorizer) -> 'TermVectorizer':
+        feature_names = vectorizer.get_feature_names_out().astype(str)
+        order = np.argsort(feature_names)
+        return cls(
+            feature_names[order], order.astype(np.int32), vectorizer.idf_, vectorizer.token_pattern, vectorizer.lowercase
+        )
+
+    def _lookup(self, text: str):
+        """(known token columns, number of tokens) of a text"""
+        tokens = self._tokenize(text.lower() if self.lowercase else text)
+        # the cast to the fixed width of `terms` would truncate longer tokens into a vocabulary term
+        max_len = self.terms.dtype.itemsize // 4
+        fitting = np.array([token for token in tokens if len(token) <= max_len], dtype=self.terms.dtype)
+        positions = np.searchsorted(self.terms, fitting)
+        positions[positions == self.terms.size] = 0
+        return self.term_columns[positions[self.terms[positions] == fitting]], len(tokens)
+
+    def count_oov(self, texts: List[str]) -> Tuple[int, int]:
+        """(out of vocabulary tokens, all tokens) of the texts"""
+        num_known, num_tokens = 0, 0
+        for text in texts:
+            columns, text_tokens = self._lookup(text)
+            num_known += columns.size
+            num_tokens += text_tokens
+        return num_tokens - num_known, num_tokens
+
+    def transform(self, texts: List[str]) -> sparse.csr_matrix:
+        indptr, indices, data = [0], [], []
+        for text in texts:
+            columns, counts = np.unique(self._lookup(text)[0], return_counts=True)
+            weights = counts * self.idf[columns]
+            norm = np.sqrt(weights @ weights)
+            indices.append(columns)
+            data.append(weights / norm if norm > 0 else weights)
+            indptr.append(indptr[-1] + columns.size)
+        return sparse.csr_matrix(
+            (np.concatenate(data + [np.empty(0)]), np.concatenate(indices + [np.empty(0, dtype=np.int64)]), indptr),
+            shape=(len(texts), self.idf.size)
+        )
+
+
+class HashingTermVectorizer:
+    """
+    Vocabulary-free counterpart of TermVectorizer: tokens are hashed into `idf.size` columns.
+    Columns no corpus document hashes into have idf 0, so out of vocabulary tokens are dropped like in TfidfVectorizer.
+    """
+    def __init__(self, idf: np.ndarray, token_pattern: str, lowercase: bool):
+        self.idf = idf
+        self.token_pattern = token_pattern
+        self.lowercase = lowercase
+        self._hasher = HashingVectorizer(
+            n_features=idf.size, token_pattern=token_pattern, lowercase=lowercase, alternate_sign=False, norm=None
+        )
+
+    def counts(self, texts: List[str]) -> sparse.csr_matrix:
+        return self._hasher.transform(texts)
+
+    def count_oov(self, texts: List[str]) -> Tuple[int, int]:
+        counts = self.counts(texts)
+        return int(counts.data[self.idf[counts.indices] == 0].sum()), int(counts.data.sum())
+
+    def transform(self, texts: List[str]) -> sparse.csr_matrix:
+        return tfidf_rows(self.counts(texts), self.idf)
+
+
+def tfidf_rows(counts: sparse.csr_matrix, idf: np.ndarray) -> sparse.csr_matrix:
+    rows = counts.multiply(idf.reshape(1, -1)).tocsr()
+    rows.eliminate_zeros()
+    return normalize(rows)
+
+
+def hash_counts(params: dict, texts: List[str]) -> sparse.csr_matrix:
+    """Process pool worker of the streaming build"""
+    return HashingTermVectorizer(np.ones(params['n_features']), params['token_pattern'], params['lowercase']).counts(texts)
+
+
+def _vectorizer_arrays(vectorizer) -> Dict[str, np.ndarray]:
+    if isinstance(vectorizer, HashingTermVectorizer):
+        return {'idf': vectorizer.idf}
+    return {'terms': vectorizer.terms, 'term_columns': vectorizer.term_columns, 'idf': vectorizer.idf}
+
+
+def _save_arrays(index_dir: str, arrays: Dict[str, np.ndarray]):
+    for name, array in arrays.items():
+        np.save(os.path.join(index_dir, f'{name}.npy'), np.ascontiguousarray(array), allow_pickle=False)
+
+
+def _new_tmp_dir(index_dir: str) -> str:
+    tmp_dir = f'{index_dir}.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    return tmp_dir
+
+
+def _finish_index(tmp_dir: str, index_dir: str, shape: tuple, vectorizer, arrays: Dict[str, np.ndarray], info: dict):
+    """Writes vectorizer and document arrays plus the manifest next to the corpus arrays, then swaps the directory in"""
+    _save_arrays(tmp_dir, _vectorizer_arrays(vectorizer))
+    _save_arrays(tmp_dir, arrays)
+    manifest = {
+        'shape': list(shape),
+        'vectorizer': 'hashing' if isinstance(vectorizer, HashingTermVectorizer) else 'terms',
+        'token_pattern': vectorizer.token_pattern,
+        'lowercase': vectorizer.lowercase,
+        'arrays': sorted(arrays),
+        'info': info or {},
+    }
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f)
+    shutil.rmtree(index_dir, ignore_errors=True)
+    os.replace(tmp_dir, index_dir)
+    logger.info('Search index saved to %s', index_dir)
+
+
+def save_index(index_dir: str, corpus: sparse.csr_matrix, vectorizer, arrays: Dict[str, np.ndarray], info: dict = None):
+    """
+    Writes the corpus CSR arrays, the vectorizer and any per-document `arrays` (e.g. `artist_name`)
+    as uncompressed .npy files, `info` goes to the manifest; the directory is swapped in only when complete
+    """
+    tmp_dir = _new_tmp_dir(index_dir)
+    corpus = sparse.csr_matrix(corpus)
+    _save_arrays(tmp_dir, {'data': corpus.data, 'indices': corpus.indices, 'indptr': corpus.indptr})
+    _finish_index(tmp_dir, index_dir, corpus.shape, vectorizer, arrays, info)
+
+
+def build_streaming_index(
+    index_dir: str,
+    chunks: Iterable[Tuple[List[str], Dict[str, np.ndarray]]],
+    n_features: int,
+    token_pattern: str,
+    lowercase: bool = True,
+    max_workers: int = 1,
+    info: dict = None
+):
+    """
+    Index of (texts, per-document arrays) chunks with memory bounded by a chunk, not by the corpus:
+    1st pass hashes every chunk to term counts (optionally over a process pool), spills them to disk
+    and accumulates document frequencies; 2nd pass applies idf and writes rows straight into the
+    memory-mapped CSR arrays of the index.
+    """
+    tmp_dir = _new_tmp_dir(index_dir)
+    params = {'n_features': n_features, 'token_pattern': token_pattern, 'lowercase': lowercase}
+    chunk_arrays = []
+
+    def chunk_texts():
+        for texts, arrays in chunks:
+            chunk_arrays.append(arrays)
+            yield texts
+
+    if max_workers > 1:
+        chunk_counts = parallel_map(partial(hash_counts, params), chunk_texts(), max_workers, 1, max_pending=2 * max_workers)
+    else:
+        chunk_counts = map(partial(hash_counts, params), chunk_texts())
+    doc_freq = np.zeros(n_features, dtype=np.int64)
+    num_docs, nnz, num_chunks = 0, 0, 0
+    for counts in chunk_counts:
+        doc_freq += np.bincount(counts.indices, minlength=n_features)
+        sparse.save_npz(os.path.join(tmp_dir, f'counts_{num_chunks:05d}.npz'), counts, compressed=False)
+        num_docs, nnz, num_chunks = num_docs + counts.shape[0], nnz + counts.nnz, num_chunks + 1
+    # smooth idf of TfidfVectorizer, 0 for columns without documents
+    idf = np.where(doc_freq > 0, np.log((1 + num_docs) / (1 + doc_freq)) + 1, 0.0)
+    # every counted column has documents, so idf > 0 and tf-idf rows keep exactly the non zeros of their counts
+    index_dtype = np.int32 if nnz < np.iinfo(np.int32).max else np.int64
+    data = open_memmap(os.path.join(tmp_dir, 'data.npy'), 'w+', np.float32, (nnz,))
+    indices = open_memmap(os.path.join(tmp_dir, 'indices.npy'), 'w+', index_dtype, (nnz,))
+    indptr = open_memmap(os.path.join(tmp_dir, 'indptr.npy'), 'w+', index_dtype, (num_docs + 1,))
+    indptr[0] = 0
+    row, offset = 0, 0
+    for chunk_num in range(num_chunks):
+        counts_path = os.path.join(tmp_dir, f'counts_{chunk_num:05d}.npz')
+        rows = tfidf_rows(sparse.load_npz(counts_path), idf)
+        data[offset:offset + rows.nnz] = rows.data
+        indices[offset:offset + rows.nnz] = rows.indices
+        indptr[row + 1:row + rows.shape[0] + 1] = offset + rows.indptr[1:]
+        row, offset = row + rows.shape[0], offset + rows.nnz
+        os.remove(counts_path)
+    for array in (data, indices, indptr):
+        array.flush()
+    del data, indices, indptr
+    arrays = {name: np.concatenate([arrays[name] for arrays in chunk_arrays]) for name in (chunk_arrays or [{}])[0]}
+    _finish_index(tmp_dir, index_dir, (num_docs, n_features), HashingTermVectorizer(idf, token_pattern, lowercase), arrays, info)
+    logger.info('Streaming index built: %d documents in %d chunks, %d non zeros', num_docs, num_chunks, nnz)
+
+
+def index_exists(index_dir: str) -> bool:
+    return os.path.exists(os.path.join(index_dir, MANIFEST_FILE))
+
+
+def index_info(index_dir: str) -> dict:
+    with open(os.path.join(index_dir, MANIFEST_FILE)) as f:
+        return json.load(f).get('info', {})
+
+
+def update_index_info(index_dir: str, info: dict):
+    """Merges `info` into the manifest info of an existing index; the manifest is replaced atomically"""
+    manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest['info'] = dict(manifest.get('info', {}), **info)
+    with open(f'{manifest_path}.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+
+
+def load_index(index_dir: str):
+    """(corpus, vectorizer, arrays) backed by read-only memory maps shared between processes through the page cache"""
+    with open(os.path.join(index_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+
+    def mmap(name: str) -> np.ndarray:
+        return np.load(os.path.join(index_dir, f'{name}.npy'), mmap_mode='r', allow_pickle=False)
+
+    corpus = sparse.csr_matrix((mmap('data'), mmap('indices'), mmap('indptr')), shape=tuple(manifest['shape']), copy=False)
+    if manifest.get('vectorizer') == 'hashing':
+        vectorizer = HashingTermVectorizer(mmap('idf'), manifest['token_pattern'], manifest['lowercase'])
+    else:
+        vectorizer = TermVectorizer(
+            mmap('terms'), mmap('term_columns'), mmap('idf'), manifest['token_pattern'], manifest['lowercase']
+        )
+    return corpus, vectorizer, {name: mmap(name) for name in manifest['arrays']}
@@ -0,0 +1,80 @@
+"""
+Column-wise normalisation of artist fields with Arrow compute: whole columns are split, trimmed and flattened
+by C++ kernels, tokens are deduplicated and sorted per row with one table sort and joined back with
+`binary_join` over list offsets, no per-row Python.
+
+Arrow sorts strings by UTF-8 bytes, which is the code point order of Python's `sorted`.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+def _strings(values: pd.Series) -> pa.Array:
+    """Column as an Arrow string array, non-string cells (NaN, None, numbers) become ''"""
+    try:
+        array = pa.array(values.to_numpy(dtype=object), type=pa.string(), from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        array = pa.array(values.where(values.str.len().notna(), None).to_numpy(dtype=object), type=pa.string(), from_pandas=True)
+    return array.fill_null('')
+
+
+def _split(array: pa.Array, pattern: str):
+    """(row of every token, tokens) of the split strings"""
+    lists = pc.split_pattern(array, pattern)
+    return pc.list_parent_indices(lists).to_numpy(), pc.list_flatten(lists)
+
+
+def _join(rows: np.ndarray, tokens: pa.Array, num_rows: int, sep: str) -> np.ndarray:
+    """Tokens grouped by their (ascending) row joined with `sep`, '' for rows without tokens"""
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=num_rows))]).astype(np.int32)
+    lists = pa.ListArray.from_arrays(pa.array(offsets), tokens)
+    return pc.binary_join(lists, sep).to_numpy(zero_copy_only=False)
+
+
+def _join_sorted_unique(rows: np.ndarray, tokens: pa.Array, num_rows: int, sep: str = ' ') -> np.ndarray:
+    order = pc.sort_indices(pa.table({'row': rows, 'token': tokens}), sort_keys=[('row', 'ascending'), ('token', 'ascending')])
+    rows, tokens = rows[order.to_numpy()], pc.take(tokens, order)
+    keep = np.ones(rows.size, dtype=bool)
+    if rows.size > 1:
+        same_token = pc.equal(tokens.slice(1), tokens.slice(0, rows.size - 1)).to_numpy(zero_copy_only=False)
+        keep[1:] = (rows[1:] != rows[:-1]) | ~same_token
+    return _join(rows[keep], tokens.filter(pa.array(keep)), num_rows, sep)
+
+
+def normalize_field(values: pd.Series) -> pd.Series:
+    """artist_field: space separated words without commas, deduplicated and sorted"""
+    rows, tokens = _split(_strings(values), ' ')
+    tokens = pc.replace_substring(pc.utf8_trim_whitespace(tokens), ',', '')
+    non_empty = pc.greater(pc.utf8_length(tokens), 0)
+    rows, tokens = rows[non_empty.to_numpy(zero_copy_only=False)], tokens.filter(non_empty)
+    return pd.Series(_join_sorted_unique(rows, tokens, values.size), index=values.index)
+
+
+def normalize_movement(values: pd.Series) -> pd.Series:
+    """artist_movement: words of the comma separated movements, deduplicated and sorted"""
+    movement_rows, movements = _split(_strings(values), ',')
+    word_movements, words = _split(pc.utf8_trim_whitespace(movements), ' ')
+    return pd.Series(_join_sorted_unique(movement_rows[word_movements], words, values.size), index=values.index)
+
+
+def add_artist_columns(artists_df: pd.DataFrame) -> pd.DataFrame:
+    artists_df['artist_field'] = normalize_field(artists_df['field'])
+    artists_df['artist_movement'] = normalize_movement(artists_df['art movement'])
+    return artists_df
+
+
+def movement_tags(values: pd.Series) -> pd.Series:
+    """Lowercased, stripped, non empty comma separated movements; exploded, index = row position"""
+    rows, tags = _split(pc.utf8_lower(_strings(values)), ',')
+    tags = pc.utf8_trim_whitespace(tags)
+    non_empty = pc.greater(pc.utf8_length(tags), 0)
+    return pd.Series(
+        tags.filter(non_empty).to_numpy(zero_copy_only=False), index=rows[non_empty.to_numpy(zero_copy_only=False)]
+    )
+
+
+def join_tags(tags: pd.Series, num_rows: int, sep: str = ',') -> pd.Series:
+    """Inverse of `movement_tags`: tags of every row position joined in their order, '' for rows without tags"""
+    return pd.Series(_join(tags.index.to_numpy(), pa.array(tags.to_numpy(dtype=object), type=pa.string()), num_rows, sep))
@@ -0,0 +1,203 @@
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+from utils import file_digest, logger
+from metrics import metrics
+
+DONE, SKIPPED, FAILED, BLOCKED = 'done', 'skipped', 'failed', 'blocked'
+
+
+class Stage:
+    """
+    A pipeline step with the files it reads and writes; stages depend on the stages producing their `inputs`.
+    `scratch` files and directories (resume state, batch files) are removed with stale outputs.
+    `always` stages run on every invocation, e.g. the incremental refresh that revalidates pages over the network.
+    """
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], None],
+        inputs: Sequence[str] = (),
+        outputs: Sequence[str] = (),
+        scratch: Sequence[str] = (),
+        always: bool = False
+    ):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.scratch = list(scratch)
+        self.always = always
+
+
+class StageRunner:
+    """
+    Runs stages as soon as the stages they depend on are finished, independent ones in parallel threads
+    (CPU heavy stages fan out to their own process pools).
+
+    A stage is skipped when its outputs exist and the content hashes of its inputs and outputs are those
+    recorded after its last successful run, so a rebuild redoes only stages whose inputs actually changed.
+    Outputs are removed before a rerun only when they are stale (inputs changed, outputs were modified, forced);
+    a stage that never finished keeps its partial outputs to resume from.
+    File hashes are cached by (size, mtime) in the state file, unchanged files are not read again.
+
+    runner = StageRunner([Stage('pages', get_pages, outputs=[pages_csv]), ...], artifact_path('pipeline_state.json'))
+    runner.run(force=['pages'])  # {stage name: done / skipped / failed / blocked}
+    """
+    def __init__(self, stages: List[Stage], state_path: str, max_workers: Optional[int] = None):
+        self.stages = {stage.name: stage for stage in stages}
+        if len(self.stages) < len(stages):
+            raise ValueError('Stage names must be unique')
+        producers = {}
+        for stage in stages:
+            for output in stage.outputs:
+                if output in producers:
+                    raise ValueError(f'{output} is an output of both {producers[output]} and {stage.name}')
+                producers[output] = stage.name
+        self.upstream = {
+            stage.name: sorted({producers[path] for path in stage.inputs if path in producers}) for stage in stages
+        }
+        self._check_acyclic()
+        self.state_path = state_path
+        self.max_workers = max_workers or len(stages)
+        self._lock = threading.Lock()
+        self._state = {'stages': {}, 'files': {}}
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                self._state = json.load(f)
+
+    def _check_acyclic(self):
+        visited, on_path = set(), set()
+
+        def visit(name: str):
+            if name in on_path:
+                raise ValueError(f'Stage dependency cycle through {name}')
+            if name in visited:
+                return
+            on_path.add(name)
+            for upstream_name in self.upstream[name]:
+                visit(upstream_name)
+            on_path.remove(name)
+            visited.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    def _digest(self, path: str) -> Optional[str]:
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        with self._lock:
+            cached = self._state['files'].get(path)
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+        digest = file_digest(path)
+        with self._lock:
+            self._state['files'][path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def _digests(self, paths: Iterable[str]) -> Dict[str, Optional[str]]:
+        return {path: self._digest(path) for path in paths}
+
+    def _save_state(self):
+        with self._lock:
+            tmp_path = f'{self.state_path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self._state, f, indent=1)
+            os.replace(tmp_path, self.state_path)
+
+    def _plan(self, stage: Stage, upstream_ran: bool, force: bool) -> Optional[str]:
+        """Why the stage has to run, None to skip it; `stale:` reasons remove the outputs first"""
+        if force:
+            return 'stale: forced'
+        inputs, outputs = self._digests(stage.inputs), self._digests(stage.outputs)
+        missing_inputs = [path for path, digest in inputs.items() if digest is None]
+        if len(missing_inputs) > 0:
+            raise FileNotFoundError(f'Inputs of {stage.name} are missing: {missing_inputs}')
+        with self._lock:
+            record = self._state['stages'].get(stage.name)
+        outputs_exist = all(digest is not None for digest in outputs.values())
+        if record is None:
+            if not outputs_exist:
+                return 'outputs missing'
+            if upstream_ran:
+                return 'stale: outputs predate the stage record, inputs were rebuilt'
+            # outputs of runs before the stage was recorded are adopted as they are
+            with self._lock:
+                self._state['stages'][stage.name] = {'inputs': inputs, 'outputs': outputs}
+            return 'always' if stage.always else None
+        if record['inputs'] != inputs:
+            return 'stale: inputs changed'
+        if not outputs_exist:
+            return 'outputs missing'
+        if record['outputs'] != outputs:
+            return 'stale: outputs modified'
+        if stage.always:
+            return 'always'
+        return None
+
+    def _remove_outputs(self, stage: Stage):
+        for path in stage.outputs + stage.scratch:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+        with self._lock:
+            self._state['stages'].pop(stage.name, None)
+
+    def _run_stage(self, stage: Stage, upstream_ran: bool, force: bool) -> str:
+        reason = self._plan(stage, upstream_ran, force)
+        if reason is None:
+            logger.info('Stage %s: up to date, skipped', stage.name)
+            return SKIPPED
+        logger.info('Stage %s: running (%s)', stage.name, reason)
+        if reason.startswith('stale'):
+            self._remove_outputs(stage)
+        with metrics.timer('stage_seconds', stage=stage.name):
+            stage.func()
+        missing_outputs = [path for path in stage.outputs if not os.path.exists(path)]
+        if len(missing_outputs) > 0:
+            raise RuntimeError(f'Stage {stage.name} did not write {missing_outputs}')
+        record = {'inputs': self._digests(stage.inputs), 'outputs': self._digests(stage.outputs)}
+        with self._lock:
+            self._state['stages'][stage.name] = record
+        self._save_state()
+        logger.info('Stage %s: done', stage.name)
+        return DONE
+
+    def run(self, force: Iterable[str] = ()) -> Dict[str, str]:
+        force = set(force)
+        unknown = force - set(self.stages)
+        if len(unknown) > 0:
+            raise ValueError(f'Unknown stages: {sorted(unknown)}')
+        results = {}  # type: Dict[str, str]
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while len(results) < len(self.stages):
+                for name, stage in self.stages.items():
+                    if name in results or name in running.values():
+                        continue
+                    upstream = [results.get(upstream_name) for upstream_name in self.upstream[name]]
+                    if any(result in (FAILED, BLOCKED) for result in upstream):
+                        logger.error('Stage %s: blocked by a failed upstream stage', name)
+                        results[name] = BLOCKED
+                    elif all(result is not None for result in upstream):
+                        future = executor.submit(self._run_stage, stage, DONE in upstream, name in force)
+                        running[future] = name
+                if len(running) == 0:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        logger.exception('Stage %s failed: %s', name, e)
+                        results[name] = FAILED
+                    metrics.inc('stages_total', result=results[name])
+        self._save_state()
+        return results
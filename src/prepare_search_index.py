@@ -1,18 +1,108 @@
 import json
 import os
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Tuple
 
 import pandas as pd
-import joblib
 import numpy as np
-from scipy.sparse import save_npz, load_npz
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy.sparse import csr_matrix, vstack
 from sklearn.feature_extraction.text import TfidfVectorizer
 
 from utils import (
+    config,
     artifact_path,
+    read_artifact,
+    iter_artifact,
+    parquet_path,
+    file_digest,
     logger
 )
+from ann_index import IVFIndex, top_k_rows
+from metrics import metrics, run_report_path, write_report
+from mmap_index import (
+    TermVectorizer, build_streaming_index, index_exists, index_info, load_index, save_index, update_index_info
+)
+
+SOURCE_ARTIFACT = 'artists_wiki_texts.csv'
+TOKEN_PATTERN = r'\b[\w\d]{3,}\b'
+# derived from the corpus rows, rebuilt after every index change
+DERIVED_ARTIFACTS = ['ivf_index.npz', 'artist_neighbour_ids.npy', 'artist_neighbour_scores.npy']
+
+
+def source_path(artifact_name: str) -> str:
+    """The file `read_artifact` reads"""
+    path = artifact_path(artifact_name)
+    return parquet_path(path) if os.path.exists(parquet_path(path)) else path
+
+
+def source_fingerprint(artifact_name: str, known: Optional[dict] = None) -> dict:
+    """
+    Data version, size, mtime and content hash of the source file. The hash of `known` (an earlier fingerprint)
+    is reused while size and mtime are unchanged, so starts do not read the whole file
+    """
+    path = source_path(artifact_name)
+    stat = os.stat(path)
+    fingerprint = {'data_version': config['data_version'], 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if known is not None and 'sha1' in known and all(known.get(key) == value for key, value in fingerprint.items()):
+        return dict(fingerprint, sha1=known['sha1'])
+    return dict(fingerprint, sha1=file_digest(path))
+
+
+def build_params() -> dict:
+    """Settings the index was built with, recorded in its manifest: a change means a full rebuild"""
+    search_config = config.get('search_index', {})
+    params = {'vectorizer': search_config.get('vectorizer', 'tfidf'), 'token_pattern': TOKEN_PATTERN}
+    if params['vectorizer'] == 'hashing':
+        params['n_features'] = search_config.get('n_features', 2 ** 20)
+    return params
+
+
+def same_source(fingerprint: Optional[dict], other: dict) -> bool:
+    return fingerprint is not None and all(fingerprint.get(key) == other[key] for key in ('data_version', 'sha1'))
+
+
+def row_hashes(df: pd.DataFrame) -> np.ndarray:
+    return pd.util.hash_pandas_object(df[['artist_name', 'wiki_text']], index=False).to_numpy()
+
+
+def document_arrays(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    return {
+        'ind': df['ind'].to_numpy(dtype=np.int64),
+        'artist_name': df['artist_name'].fillna('').to_numpy(dtype=str),
+        'row_hash': row_hashes(df),
+    }
+
+
+def drop_derived_artifacts():
+    for artifact_name in DERIVED_ARTIFACTS:
+        if os.path.exists(artifact_path(artifact_name)):
+            os.remove(artifact_path(artifact_name))
+
+
+def save_search_index(index_dir: str, corpus: csr_matrix, vectorizer, df: pd.DataFrame, info: dict):
+    save_index(index_dir, corpus, vectorizer, document_arrays(df), info)
+
+
+def build_neighbour_table(
+    corpus: csr_matrix, n_neighbours: int = 20, chunk_size: int = 1024
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top `n_neighbours` rows for every row of the corpus, the row itself excluded: int32 ids and float16 scores.
+    Rows are scored in chunks of `chunk_size` x corpus, so memory is bounded by one dense chunk of scores
+    """
+    corpus = csr_matrix(corpus, dtype=np.float32)
+    corpus_t = corpus.T.tocsc()
+    num_rows = corpus.shape[0]
+    n_neighbours = min(n_neighbours, num_rows - 1)
+    neighbour_ids = np.empty((num_rows, n_neighbours), dtype=np.int32)
+    neighbour_scores = np.empty((num_rows, n_neighbours), dtype=np.float16)
+    for start in range(0, num_rows, chunk_size):
+        end = min(start + chunk_size, num_rows)
+        similarities = (corpus[start:end] @ corpus_t).toarray()
+        similarities[np.arange(end - start), np.arange(start, end)] = -np.inf
+        chunk_ids, chunk_scores = top_k_rows(similarities, n_neighbours)
+        neighbour_ids[start:end] = chunk_ids
+        neighbour_scores[start:end] = chunk_scores
+    return neighbour_ids, neighbour_scores
 
 
 class ContentDB:
@@ -22,44 +112,170 @@ class ContentDB:
         # Simple BoW recommendations
         self.embedder = None
         self.corpus_numpy = None
-        
+        self.ann_index = None  # type: Optional[IVFIndex]
+        self.neighbour_ids = None  # type: Optional[np.ndarray]
+        self.neighbour_scores = None  # type: Optional[np.ndarray]
+        self.index_dir = None  # type: Optional[str]
+
     def init_db(self):
-        self.df = pd.read_csv(artifact_path('artists_wiki_texts.csv'))
-        # self.df = pd.read_csv(artifact_path('content_db.csv.gz'), compression='gzip')
-        # self.df['art_tags'] = self.df['art_tags'].fillna(value='')
-        # self.df['wikipedia'] = self.df['wikipedia'].fillna(value='')
-        # print('Num artists %d' % self.df.shape[0])
+        search_config = config.get('search_index', {})
+        index_dir = self.index_dir = artifact_path('search_index')
+        self.refresh_index(index_dir)
+        with metrics.timer('phase_seconds', phase='index_load'):
+            self.corpus_numpy, self.embedder, arrays = load_index(index_dir)
+            self.df = pd.DataFrame(arrays)
+        logger.info('Search index mapped from %s: %s', index_dir, self.corpus_numpy.shape)
+        if search_config.get('ann', False):
+            with metrics.timer('phase_seconds', phase='ann_index'):
+                self.init_ann_index()
+        if search_config.get('n_neighbours'):
+            with metrics.timer('phase_seconds', phase='neighbour_table'):
+                self.init_neighbours()
+        print("DB prepared succesfully! Num embeds %d" % self.corpus_numpy.shape[0])
+
+    def refresh_index(self, index_dir: str):
+        """
+        Builds the index, or rebuilds / updates it when the source artifact changed, rebuilds it when `build_params`
+        changed. Without the source file (serving hosts) the index is used as it is; the source is only hashed
+        when its size or mtime changed
+        """
+        if not index_exists(index_dir):
+            with metrics.timer('phase_seconds', phase='index_build'):
+                self.build_index(index_dir, source_fingerprint(SOURCE_ARTIFACT))
+            drop_derived_artifacts()
+            return
+        if not os.path.exists(source_path(SOURCE_ARTIFACT)):
+            logger.info('%s is not on this host, search index used as it is', SOURCE_ARTIFACT)
+            return
+        info = index_info(index_dir)
+        known_fingerprint = info.get('fingerprint')
+        fingerprint = source_fingerprint(SOURCE_ARTIFACT, known_fingerprint)
+        if info.get('params') != build_params():
+            logger.info('Search index settings changed: %s -> %s, full rebuild', info.get('params'), build_params())
+            with metrics.timer('phase_seconds', phase='index_build'):
+                self.build_index(index_dir, fingerprint)
+            drop_derived_artifacts()
+            return
+        if same_source(known_fingerprint, fingerprint):
+            if fingerprint != known_fingerprint:  # touched or copied, same content: hash once
+                update_index_info(index_dir, {'fingerprint': fingerprint})
+            return
+        logger.info('Search index is stale: %s changed', SOURCE_ARTIFACT)
+        incremental = config.get('search_index', {}).get('incremental', False)
+        with metrics.timer('phase_seconds', phase='index_update' if incremental else 'index_build'):
+            if incremental:
+                self.update_index(index_dir, fingerprint)
+            else:
+                self.build_index(index_dir, fingerprint)
+        drop_derived_artifacts()
+
+    def build_index(self, index_dir: str, fingerprint: dict):
+        if config.get('search_index', {}).get('vectorizer', 'tfidf') == 'hashing':
+            return self.build_streaming_index(index_dir, fingerprint)
+        df = read_artifact(artifact_path(SOURCE_ARTIFACT), columns=['ind', 'artist_name', 'wiki_text'])
+        # df = pd.read_csv(artifact_path('content_db.csv.gz'), compression='gzip')
+        # df['art_tags'] = df['art_tags'].fillna(value='')
+        # df['wikipedia'] = df['wikipedia'].fillna(value='')
+        # print('Num artists %d' % df.shape[0])
         # self.tags_df = pd.read_csv(artifact_path('tags_db.csv.gz'), compression='gzip').query('cnt > 1')
         # self.tags_df = self.tags_df[self.tags_df['tag'].str.len() <= 15].copy()
         # excluded_tags = ['art']
         # self.tags_df.drop(self.tags_df[self.tags_df['tag'].isin(excluded_tags)].index, inplace=True)
         # print('Num tags %d' % self.tags_df.shape[0])
-        print('Preparing vector DB... %d' % self.df.shape[0])
-        embeds_path = artifact_path('embeds.npy')
-        model_filename = artifact_path('tfidf_vectorizer.pkl')
-        if os.path.exists(embeds_path):
-            logger.info('Loading from dump...')
-            self.embedder = joblib.load(model_filename)
-            # self.corpus_numpy = np.load(embeds_path, allow_pickle=False)
-            self.corpus_numpy = load_npz(embeds_path)
-            print(self.corpus_numpy.shape)
-        else:
-            embedder = TfidfVectorizer(
-                analyzer='word',
-                lowercase=True,
-                token_pattern=r'\b[\w\d]{3,}\b'
+        print('Preparing vector DB... %d' % df.shape[0])
+        embedder = TfidfVectorizer(
+            analyzer='word',
+            lowercase=True,
+            token_pattern=TOKEN_PATTERN
+        )
+        # corpus = embedder.fit_transform(df['art_tags'].values)
+        corpus = embedder.fit_transform(df['wiki_text'].values)
+        logger.info('Full refit: %s', corpus.shape)
+        save_search_index(index_dir, corpus, TermVectorizer.from_tfidf(embedder), df, {
+            'fingerprint': fingerprint, 'params': build_params(), 'num_oov_tokens': 0, 'num_tokens': 0,
+        })
+
+    def build_streaming_index(self, index_dir: str, fingerprint: dict):
+        """Hashing vectorizer over chunks of the source artifact, peak memory does not grow with the corpus"""
+        search_config = config.get('search_index', {})
+        chunks = (
+            (chunk['wiki_text'].fillna('').tolist(), document_arrays(chunk))
+            for chunk in iter_artifact(
+                artifact_path(SOURCE_ARTIFACT), ['ind', 'artist_name', 'wiki_text'], search_config.get('chunksize', 5000)
             )
-            # embedder.fit(self.df['art_tags'].values)
-            embedder.fit(self.df['wiki_text'].values)
-            # self.corpus_numpy = embedder.transform(self.df['art_tags'].values)
-            self.corpus_numpy = embedder.transform(self.df['wiki_text'].values)
-            self.embedder = embedder
-            logger.info('Dumping models... %s, %s', self.corpus_numpy.shape, type(self.corpus_numpy))
-            joblib.dump(embedder, model_filename)
-            # np.save(embeds_path, self.corpus_numpy, allow_pickle=False)
-            save_npz(embeds_path, self.corpus_numpy)
-        print("DB prepared succesfully! Num embeds %d" % self.corpus_numpy.shape[0])
+        )
+        build_streaming_index(
+            index_dir, chunks, search_config.get('n_features', 2 ** 20), TOKEN_PATTERN,
+            max_workers=search_config.get('build_workers') or 1,
+            info={'fingerprint': fingerprint, 'params': build_params(), 'num_oov_tokens': 0, 'num_tokens': 0}
+        )
+
+    def update_index(self, index_dir: str, fingerprint: dict):
+        """
+        Only new and changed artists are transformed with the frozen vocabulary / idf and appended,
+        removed artists are dropped. Out of vocabulary tokens are counted across updates since the last refit,
+        past `search_index.max_vocab_drift` of all transformed tokens the index is refitted instead.
+        """
+        corpus, vectorizer, arrays = load_index(index_dir)
+        if 'row_hash' not in arrays:  # index written before row hashes were stored
+            return self.build_index(index_dir, fingerprint)
+        info = index_info(index_dir)
+        df = read_artifact(artifact_path(SOURCE_ARTIFACT), columns=['ind', 'artist_name', 'wiki_text'])
+        old_rows = pd.Series(np.arange(arrays['ind'].size), index=arrays['ind']).reindex(df['ind']).to_numpy()
+        known = ~np.isnan(old_rows)
+        unchanged = np.zeros(df.shape[0], dtype=bool)
+        unchanged[known] = arrays['row_hash'][old_rows[known].astype(np.int64)] == row_hashes(df)[known]
+        changed_df = df[~unchanged]
+        num_oov_tokens, num_tokens = vectorizer.count_oov(changed_df['wiki_text'].fillna('').tolist())
+        num_oov_tokens += info.get('num_oov_tokens', 0)
+        num_tokens += info.get('num_tokens', 0)
+        vocab_drift = num_oov_tokens / max(1, num_tokens)
+        if vocab_drift > config.get('search_index', {}).get('max_vocab_drift', 0.05):
+            logger.info('Vocabulary drift %.3f, full refit', vocab_drift)
+            return self.build_index(index_dir, fingerprint)
+        new_corpus = vstack([
+            corpus[old_rows[unchanged].astype(np.int64)], vectorizer.transform(changed_df['wiki_text'].fillna('').tolist())
+        ]).tocsr()
+        save_search_index(index_dir, new_corpus, vectorizer, pd.concat([df[unchanged], changed_df]), {
+            'fingerprint': fingerprint, 'params': build_params(), 'num_oov_tokens': num_oov_tokens, 'num_tokens': num_tokens,
+        })
+        logger.info(
+            'Search index updated: %d rows kept, %d transformed, %d dropped, vocabulary drift %.3f',
+            unchanged.sum(), changed_df.shape[0], arrays['ind'].size - unchanged.sum(), vocab_drift
+        )
+
+    def init_ann_index(self):
+        """IVF index of the corpus, refitted when missing or built with other settings (recorded in the index manifest)"""
+        ann_config = config.get('search_index', {})
+        ann_index_path = artifact_path('ivf_index.npz')
+        ann_params = {'n_lists': ann_config.get('n_lists')}
+        if os.path.exists(ann_index_path) and index_info(self.index_dir).get('ann_params') == ann_params:
+            self.ann_index = IVFIndex.load(ann_index_path, self.corpus_numpy, n_probe=ann_config.get('n_probe', 8))
+        else:
+            self.ann_index = IVFIndex(
+                n_lists=ann_params['n_lists'], n_probe=ann_config.get('n_probe', 8)
+            ).fit(self.corpus_numpy)
+            self.ann_index.save(ann_index_path)
+            update_index_info(self.index_dir, {'ann_params': ann_params})
+        logger.info('ANN index ready: %d lists', self.ann_index.n_lists or self.ann_index.centroids.shape[0])
     
+    def init_neighbours(self):
+        """Neighbour table of the corpus, rebuilt when missing or built for another `n_neighbours`"""
+        ids_path, scores_path = artifact_path('artist_neighbour_ids.npy'), artifact_path('artist_neighbour_scores.npy')
+        neighbour_params = {'n_neighbours': config['search_index']['n_neighbours']}
+        if not os.path.exists(scores_path) or index_info(self.index_dir).get('neighbour_params') != neighbour_params:
+            neighbour_ids, neighbour_scores = build_neighbour_table(self.corpus_numpy, neighbour_params['n_neighbours'])
+            np.save(ids_path, neighbour_ids, allow_pickle=False)
+            np.save(scores_path, neighbour_scores, allow_pickle=False)
+            update_index_info(self.index_dir, {'neighbour_params': neighbour_params})
+        self.neighbour_ids = np.load(ids_path, mmap_mode='r')
+        self.neighbour_scores = np.load(scores_path, mmap_mode='r')
+        logger.info('Neighbour table ready: %s', self.neighbour_ids.shape)
+
+    def similar_artists(self, content_id: int, num_recs: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+        """Precomputed (row ids, scores) of the artists closest to the `content_id` row, best first"""
+        return self.neighbour_ids[content_id, :num_recs], self.neighbour_scores[content_id, :num_recs]
+
     def get_content(self, content_id: int) -> Dict:
         content_info = self.df.iloc[content_id].to_dict()
         res = {}
@@ -75,20 +291,57 @@ class ContentDB:
                     res[key] = 'Empty'
         return res
     
+    def recommend_many(self, queries: List[str], k: int = 10, chunk_size: int = 1024) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (rec_ids, scores) arrays of shape (len(queries), min(k, corpus rows)), best first.
+        Exact path: one sparse product per chunk of queries (TF-IDF rows are L2-normalised, so dot == cosine).
+        ANN path: one index search per query (term at a time over its own postings, there is no shared product
+        to batch); queries whose probed lists hold fewer than k rows are answered by the exact path instead
+        """
+        metrics.inc('search_queries_total', len(queries))
+        with metrics.timer('search_seconds', step='transform'):
+            query_embeds = self.embedder.transform(queries).tocsr()
+        if self.ann_index is None:
+            with metrics.timer('search_seconds', step='exact'):
+                return self._exact_top_k(query_embeds, k, chunk_size)
+        k = min(k, self.corpus_numpy.shape[0])
+        rec_ids = np.empty((query_embeds.shape[0], k), dtype=np.int64)
+        scores = np.empty((query_embeds.shape[0], k), dtype=np.float64)
+        short_rows = []
+        with metrics.timer('search_seconds', step='ann'):
+            for i in range(query_embeds.shape[0]):
+                row_ids, row_scores = self.ann_index.search(query_embeds[i], k)
+                if row_ids.size < k:
+                    short_rows.append(i)
+                    continue
+                rec_ids[i], scores[i] = row_ids, row_scores
+        if len(short_rows) > 0:
+            metrics.inc('search_ann_fallbacks_total', len(short_rows))
+            with metrics.timer('search_seconds', step='exact'):
+                rec_ids[short_rows], scores[short_rows] = self._exact_top_k(query_embeds[short_rows], k, chunk_size)
+        return rec_ids, scores
+
+    def _exact_top_k(self, query_embeds, k: int, chunk_size: int) -> Tuple[np.ndarray, np.ndarray]:
+        rec_ids, scores = [], []
+        for start in range(0, query_embeds.shape[0], chunk_size):
+            # corpus CSR on the left: transposing it for `queries @ corpus.T` costs a full conversion per call
+            similarities = (self.corpus_numpy @ query_embeds[start:start + chunk_size].T).T.toarray()
+            chunk_ids, chunk_scores = top_k_rows(similarities, k)
+            rec_ids.append(chunk_ids)
+            scores.append(chunk_scores)
+        return np.vstack(rec_ids), np.vstack(scores)
+
     def recommend(self, user_query, num_recs: int = 10) -> dict:
-        user_pref = ''
         if len(user_query) > 0:
-            query_embed = self.embedder.transform([user_query])
-            similarities = cosine_similarity(query_embed, self.corpus_numpy).flatten()
-            rec_ids = np.argsort(similarities)[::-1][:num_recs]
-            recs = self.df.iloc[rec_ids]
+            rec_ids = self.recommend_many([user_query], num_recs)[0][0]
         else:
             logger.info('random recommendation')
-            recs = self.df.sample(num_recs)
+            rec_ids = np.random.choice(self.df.shape[0], min(num_recs, self.df.shape[0]), replace=False)
+        artist_names = self.df['artist_name'].values
         recs_list = []
-        for _, row in recs.sample(3).iterrows():
+        for rec_id in np.random.choice(rec_ids, min(3, len(rec_ids)), replace=False):
             recs_list.append({
-                'artist_name': row['artist_name'],
+                'artist_name': artist_names[rec_id],
                 # 'artist_url': row['artist_url'],
                 # 'artist_wiki_url': 'https://'+row['wikipedia']
             })
@@ -100,7 +353,9 @@ class ContentDB:
 
 # print(df.shape[0], corpus_df.shape[0], df.columns.tolist(), corpus_df.columns.tolist())
 
-content_db = ContentDB()
-content_db.init_db()
+if __name__ == '__main__':
+    content_db = ContentDB()
+    content_db.init_db()
+    write_report(run_report_path('search_index'))
 
-print(content_db.recommend('picasso'))
\ No newline at end of file
+    print(content_db.recommend('picasso'))
\ No newline at end of file
@@ -0,0 +1,211 @@
+import asyncio
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from aiohttp import web
+
+from utils import config, logger
+from metrics import metrics
+from prepare_search_index import ContentDB
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r'\s+', ' ', query.strip().lower())
+
+
+class QueryCache:
+    """LRU of (normalized query, k) -> (row ids, scores); the least recently used entry goes first when full"""
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # type: OrderedDict
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        if key not in self._entries:
+            self.misses += 1
+            metrics.inc('search_cache_total', result='miss')
+            return None
+        self.hits += 1
+        metrics.inc('search_cache_total', result='hit')
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key: tuple, value: Tuple[np.ndarray, np.ndarray]):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class MicroBatcher:
+    """
+    Coalesces queries into one `ContentDB.recommend_many` call, run on a single worker thread so the event loop
+    keeps accepting requests. A batch is sent `max_wait_ms` after its first query or at `max_batch_size` queries;
+    while a batch is being scored new queries wait for it and go together into the next one.
+    Identical queries of the same batch share one row of the product.
+
+    batcher = MicroBatcher(content_db, max_batch_size=64, max_wait_ms=2)
+    rec_ids, scores = await batcher.search('picasso', k=10)
+    """
+    def __init__(self, content_db: ContentDB, max_batch_size: int = 64, max_wait_ms: float = 2.0):
+        self.content_db = content_db
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending = {}  # type: Dict[str, List[Tuple[int, asyncio.Future]]]
+        self._timer = None  # type: Optional[asyncio.TimerHandle]
+        self._running = False
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self.num_batches = 0
+        self.num_queries = 0
+
+    async def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(query, []).append((k, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._running or len(self._pending) == 0:
+            return
+        queries = list(self._pending)[:self.max_batch_size]
+        batch = {query: self._pending.pop(query) for query in queries}
+        self._running = True
+        asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: Dict[str, List[Tuple[int, asyncio.Future]]]):
+        queries = list(batch)
+        max_k = max(k for waiters in batch.values() for k, _ in waiters)
+        try:
+            rec_ids, scores = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self.content_db.recommend_many, queries, max_k
+            )
+        except Exception as e:
+            for waiters in batch.values():
+                for _, future in waiters:
+                    if not future.cancelled():
+                        future.set_exception(e)
+            return
+        finally:
+            self._running = False
+            self._flush()
+        self.num_batches += 1
+        self.num_queries += len(queries)
+        for row, query in enumerate(queries):
+            for k, future in batch[query]:
+                if not future.cancelled():
+                    future.set_result((rec_ids[row, :k], scores[row, :k]))
+
+
+class SearchService:
+    def __init__(self, content_db: ContentDB, max_batch_size: int = 64, max_wait_ms: float = 2.0, cache_size: int = 10000):
+        self.content_db = content_db
+        self.batcher = MicroBatcher(content_db, max_batch_size, max_wait_ms)
+        self.cache = QueryCache(cache_size)
+        self.max_k = 100
+
+    def _artists(self, rec_ids: np.ndarray, scores: Optional[np.ndarray] = None) -> List[dict]:
+        artist_names = self.content_db.df['artist_name'].values
+        return [
+            {
+                'artist_id': int(rec_id),
+                'artist_name': artist_names[rec_id],
+                'score': None if scores is None else float(scores[i]),
+            }
+            for i, rec_id in enumerate(rec_ids)
+        ]
+
+    def _k(self, request: web.Request) -> int:
+        try:
+            return min(max(int(request.query.get('k', 10)), 1), self.max_k)
+        except ValueError:
+            raise web.HTTPBadRequest(reason='k must be an integer')
+
+    async def recommend(self, request: web.Request) -> web.Response:
+        """GET /recommend?q=<text>&k=10 - top-k artists by cosine similarity, random artists for an empty query"""
+        query, k = normalize_query(request.query.get('q', '')), self._k(request)
+        if len(query) == 0:
+            num_rows = self.content_db.df.shape[0]
+            return web.json_response({
+                'query': query, 'results': self._artists(np.random.choice(num_rows, min(k, num_rows), replace=False))
+            })
+        result = self.cache.get((query, k))
+        if result is None:
+            result = await self.batcher.search(query, k)
+            self.cache.put((query, k), result)
+        return web.json_response({'query': query, 'results': self._artists(*result)})
+
+    async def similar(self, request: web.Request) -> web.Response:
+        """GET /similar/<artist_id>?k=10 - precomputed neighbours of an artist"""
+        artist_id, k = int(request.match_info['artist_id']), self._k(request)
+        if self.content_db.neighbour_ids is None:
+            raise web.HTTPNotFound(reason='neighbour table is disabled, see search_index.n_neighbours')
+        if not 0 <= artist_id < self.content_db.neighbour_ids.shape[0]:
+            raise web.HTTPNotFound(reason=f'unknown artist {artist_id}')
+        return web.json_response({'artist_id': artist_id, 'results': self._artists(*self.content_db.similar_artists(artist_id, k))})
+
+    async def content(self, request: web.Request) -> web.Response:
+        """GET /content/<artist_id> - document fields stored in the index"""
+        artist_id = int(request.match_info['artist_id'])
+        if not 0 <= artist_id < self.content_db.df.shape[0]:
+            raise web.HTTPNotFound(reason=f'unknown artist {artist_id}')
+        row = self.content_db.df.iloc[artist_id]
+        return web.json_response({'artist_id': artist_id, 'ind': int(row['ind']), 'artist_name': row['artist_name']})
+
+    async def health(self, _: web.Request) -> web.Response:
+        return web.json_response({
+            'num_artists': int(self.content_db.df.shape[0]),
+            'cache_entries': len(self.cache), 'cache_hits': self.cache.hits, 'cache_misses': self.cache.misses,
+            'batches': self.batcher.num_batches,
+            'mean_batch_size': self.batcher.num_queries / max(1, self.batcher.num_batches),
+        })
+
+    async def metrics_text(self, _: web.Request) -> web.Response:
+        """GET /metrics - Prometheus text format: query counts and latencies of the search index"""
+        return web.Response(text=metrics.prometheus_text(), content_type='text/plain')
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.get('/recommend', self.recommend),
+            web.get(r'/similar/{artist_id:\d+}', self.similar),
+            web.get(r'/content/{artist_id:\d+}', self.content),
+            web.get('/health', self.health),
+            web.get('/metrics', self.metrics_text),
+        ])
+        return app
+
+
+def main():
+    service_config = config.get('search_service', {})
+    content_db = ContentDB()
+    content_db.init_db()
+    service = SearchService(
+        content_db,
+        max_batch_size=service_config.get('max_batch_size', 64),
+        max_wait_ms=service_config.get('max_wait_ms', 2.0),
+        cache_size=service_config.get('cache_size', 10000)
+    )
+    logger.info('Search service on port %s', service_config.get('port', 8080))
+    web.run_app(
+        service.app(), host=service_config.get('host', '0.0.0.0'), port=service_config.get('port', 8080), access_log=None
+    )
+
+
+if __name__ == '__main__':
+    main()
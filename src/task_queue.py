@@ -0,0 +1,181 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Tuple
+
+PENDING = 'pending'
+IN_PROGRESS = 'in_progress'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # exists, owned by another user
+        return True
+    return True
+
+
+class TaskQueue:
+    """
+    Persistent work queue backed by SQLite: tasks go pending -> in_progress -> done / failed.
+
+    queue = TaskQueue('/srv/data/06_data_batches/tasks.sqlite')
+    queue.enqueue([(ind, {'artist_name': ..., 'artworks_url': ...}), ...])
+    while tasks := queue.claim(30):
+        ...
+        queue.complete([task_id for task_id, _ in tasks])
+
+    Claims are atomic, so several workers can share one queue; a restart only touches unfinished tasks.
+    A claim is a lease of `lease_seconds` held by this worker (host:pid:instance): tasks of a live worker are never
+    taken away, tasks of a worker that died are claimed again once its lease expires, or right away by a restart
+    on the same host (see `requeue`). `keep_leases` extends the leases of a batch while it runs.
+    """
+    def __init__(self, db_path: str, lease_seconds: float = 900):
+        self.lease_seconds = lease_seconds
+        self.hostname = socket.gethostname()
+        # the instance token tells a restarted container apart from its previous run, pids repeat there
+        self.worker_id = f'{self.hostname}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=60, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id INTEGER PRIMARY KEY,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL,
+                error TEXT,
+                worker TEXT,
+                lease_until REAL
+            )
+        """)
+        columns = {row[1] for row in self._db.execute('PRAGMA table_info(tasks)')}
+        for column, column_type in (('worker', 'TEXT'), ('lease_until', 'REAL')):
+            if column not in columns:  # queue created before claims were leased
+                self._db.execute(f'ALTER TABLE tasks ADD COLUMN {column} {column_type}')
+        self._db.execute('CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, task_id)')
+        self._lock = threading.Lock()
+
+    def _set_state(self, task_ids: List[int], state: str, error: str = None):
+        with self._lock:
+            self._db.executemany(
+                'UPDATE tasks SET state = ?, updated_at = ?, error = ? WHERE task_id = ?',
+                [(state, time.time(), error, task_id) for task_id in task_ids]
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+
+    def enqueue(self, tasks: Iterable[Tuple[int, dict]], state: str = PENDING):
+        """Already known task ids are ignored"""
+        with self._lock:
+            self._db.execute('BEGIN')
+            self._db.executemany(
+                'INSERT OR IGNORE INTO tasks (task_id, payload, state, updated_at) VALUES (?, ?, ?, ?)',
+                [(task_id, json.dumps(payload), state, time.time()) for task_id, payload in tasks]
+            )
+            self._db.execute('COMMIT')
+
+    def _dead_local_workers(self) -> List[str]:
+        """Workers of this host whose process is gone, or that had this pid before (restarted container)"""
+        rows = self._db.execute(
+            'SELECT DISTINCT worker FROM tasks WHERE state = ? AND worker LIKE ?', (IN_PROGRESS, f'{self.hostname}:%')
+        ).fetchall()
+        dead = []
+        for (worker,) in rows:
+            pid = int(worker.split(':')[1])
+            if worker != self.worker_id and (pid == os.getpid() or not process_alive(pid)):
+                dead.append(worker)
+        return dead
+
+    def requeue(self, max_attempts: int = 3) -> int:
+        """
+        On start: tasks whose lease expired or whose worker on this host is gone, and failed tasks with attempts left
+        go back to pending; tasks leased by live workers are left alone
+        """
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            dead_workers = self._dead_local_workers()
+            cursor = self._db.execute(
+                'UPDATE tasks SET state = ?, worker = NULL, lease_until = NULL '
+                'WHERE (state = ? AND COALESCE(lease_until, 0) < ?) OR (state = ? AND attempts < ?)',
+                (PENDING, IN_PROGRESS, time.time(), FAILED, max_attempts)
+            )
+            num_requeued = cursor.rowcount
+            num_requeued += self._db.executemany(
+                'UPDATE tasks SET state = ?, worker = NULL, lease_until = NULL WHERE state = ? AND worker = ?',
+                [(PENDING, IN_PROGRESS, worker) for worker in dead_workers]
+            ).rowcount
+            self._db.execute('COMMIT')
+            return num_requeued
+
+    def claim(self, num_tasks: int) -> List[Tuple[int, dict]]:
+        """Pending tasks and tasks of expired leases, leased to this worker"""
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            rows = self._db.execute(
+                'SELECT task_id, payload FROM tasks WHERE state = ? OR (state = ? AND COALESCE(lease_until, 0) < ?) '
+                'ORDER BY task_id LIMIT ?',
+                (PENDING, IN_PROGRESS, now, num_tasks)
+            ).fetchall()
+            self._db.executemany(
+                'UPDATE tasks SET state = ?, attempts = attempts + 1, updated_at = ?, worker = ?, lease_until = ? '
+                'WHERE task_id = ?',
+                [(IN_PROGRESS, now, self.worker_id, now + self.lease_seconds, task_id) for task_id, _ in rows]
+            )
+            self._db.execute('COMMIT')
+        return [(task_id, json.loads(payload)) for task_id, payload in rows]
+
+    def heartbeat(self, task_ids: List[int]):
+        """Extends the leases this worker holds on `task_ids`"""
+        with self._lock:
+            self._db.executemany(
+                'UPDATE tasks SET lease_until = ? WHERE task_id = ? AND state = ? AND worker = ?',
+                [(time.time() + self.lease_seconds, task_id, IN_PROGRESS, self.worker_id) for task_id in task_ids]
+            )
+
+    @contextmanager
+    def keep_leases(self, task_ids: List[int]):
+        """Heartbeats the leases of `task_ids` every third of `lease_seconds` while the block runs"""
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.lease_seconds / 3):
+                self.heartbeat(task_ids)
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, task_ids: List[int]):
+        self._set_state(task_ids, DONE)
+
+    def fail(self, task_ids: List[int], error: str):
+        self._set_state(task_ids, FAILED, error)
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._db.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state').fetchall())
+
+    def num_unfinished(self, max_attempts: int = 3) -> int:
+        """Pending, in progress (any lease) and failed tasks with attempts left"""
+        with self._lock:
+            return self._db.execute(
+                'SELECT COUNT(*) FROM tasks WHERE state IN (?, ?) OR (state = ? AND attempts < ?)',
+                (PENDING, IN_PROGRESS, FAILED, max_attempts)
+            ).fetchone()[0]
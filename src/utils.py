@@ -1,9 +1,14 @@
 import os
 import logging
+import multiprocessing
 import tarfile
 import shutil
 import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional, Tuple
 
 import yaml
 
@@ -54,10 +59,58 @@ def create_tar_gz(directory_path, output_path):
                 archive.add(file_path, arcname=os.path.relpath(file_path, directory_path))
 
 
+def wikiart_base_url() -> str:
+    return os.getenv('WIKIART_BASE_URL', config['wikiart_base_url'])
+
 def artifact_path(artifact_name: str):
     artifact_filename  = f"{config['data_version']}_{artifact_name}"
     return os.path.join(config['root_data_dir'], artifact_filename)
 
+def parquet_path(csv_path: str) -> str:
+    for suffix in ('.csv.gz', '.csv'):
+        if csv_path.endswith(suffix):
+            return csv_path[:-len(suffix)] + '.parquet'
+    return f'{csv_path}.parquet'
+
+def file_digest(path: str) -> str:
+    """sha1 of the file content, read in 1MB blocks"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2 ** 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    """(index, num_shards) of a `--shard i/N` value, 0 <= i < N"""
+    index, num_shards = (int(part) for part in shard.split('/'))
+    if not 0 <= index < num_shards:
+        raise ValueError(f'Shard {shard}: index must be in 0..{num_shards - 1}')
+    return index, num_shards
+
+def shard_of(key: str, num_shards: int) -> int:
+    """Shard of an artist link; a content hash, so every machine and Python process partitions the same way"""
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big') % num_shards
+
+def shard_name(shard: Tuple[int, int]) -> str:
+    return 'shard%dof%d' % shard
+
+def shard_path(path: str, shard: Optional[Tuple[int, int]]) -> str:
+    """Output path of one shard: 06_artists_info.csv -> 06_artists_info_shard0of4.csv; `path` itself without a shard"""
+    if shard is None:
+        return path
+    for suffix in ('.csv.gz', '.csv'):
+        if path.endswith(suffix):
+            return f'{path[:-len(suffix)]}_{shard_name(shard)}{suffix}'
+    return f'{path}_{shard_name(shard)}'
+
+def read_artifact(csv_path: str, columns: Optional[list] = None):
+    """Parquet twin of a csv artifact when it exists (only `columns` are read), the csv itself otherwise"""
+    import pandas as pd
+
+    if os.path.exists(parquet_path(csv_path)):
+        return pd.read_parquet(parquet_path(csv_path), columns=columns)
+    return pd.read_csv(csv_path, usecols=columns)
+
 def init_nltk():
     import nltk
     
@@ -95,6 +148,9 @@ def prepare_service_data():
         'content_db.csv.gz',
         'exhibitions_db.csv.gz'
     ]
+    service_file_names += [
+        parquet_path(f) for f in service_file_names if os.path.exists(artifact_path(parquet_path(f)))
+    ]
     result_data_dir = artifact_path('service_data')
     if os.path.exists(result_data_dir):
         postfix = files_version()
@@ -107,6 +163,59 @@ def prepare_service_data():
     logger.info('Data collected to %s', result_data_dir)
     create_tar_gz(result_data_dir, f'{result_data_dir}.tar.gz'.replace(f"{config['data_version']}_", ''))
 
+def parallel_map(
+    func: Callable, items: Iterable, max_workers: Optional[int] = None, chunksize: int = 16, max_pending: Optional[int] = None
+) -> Iterator:
+    """
+    CPU-bound stage (HTML parsing) over all cores, results are yielded lazily in input order
+    parsed = parallel_map(partial(parse_cached_page, parse_artist_page, 'artists_raw_html'), urls)
+
+    executor.map submits all items at once; with `max_pending` at most that many items are in flight,
+    so large items (e.g. text chunks) are read from the iterable only as results are consumed.
+    Metrics recorded by the workers come back with the results.
+    Workers start from a forkserver, not by forking the caller: stages run in parallel threads, and a fork taken
+    while another thread holds a lock (logging, HTML cache, metrics) would leave that lock held in the worker.
+    """
+    from metrics import metrics, call_with_metrics, reset_metrics
+
+    def merged(result_with_metrics):
+        result, drained = result_with_metrics
+        metrics.merge(drained)
+        return result
+
+    max_workers = max_workers or config.get('parse_workers') or os.cpu_count()
+    func = partial(call_with_metrics, func)
+    mp_context = multiprocessing.get_context('forkserver')
+    # modules of the mapped function are imported once in the fork server (on its start, i.e. the first pool),
+    # not again by every worker of every pool: artworks batches open a pool each
+    mp_context.set_forkserver_preload([
+        part.__module__ for part in (func.func, *func.args) if callable(part) and hasattr(part, '__module__')
+    ] if isinstance(func, partial) else [func.__module__])
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context, initializer=reset_metrics) as executor:
+        if max_pending is None:
+            yield from map(merged, executor.map(func, items, chunksize=chunksize))
+            return
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= max_pending:
+                yield merged(pending.popleft().result())
+        while pending:
+            yield merged(pending.popleft().result())
+
+
+def iter_artifact(csv_path: str, columns: Optional[list] = None, chunksize: int = 5000) -> Iterator:
+    """Chunked `read_artifact`: DataFrames of at most `chunksize` rows"""
+    import pandas as pd
+
+    if os.path.exists(parquet_path(csv_path)):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(parquet_path(csv_path)).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(csv_path, usecols=columns, chunksize=chunksize)
+
 def n_gram_split(input_str: str):
   potential_tags = []
   tokens = input_str.split(' ')
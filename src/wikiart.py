@@ -1,75 +1,84 @@
 import os
+import shutil
 import json
-import requests
-import time
-from typing import List, Dict
+from functools import partial
+from typing import List, Dict, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 from bs4 import BeautifulSoup
 
-from utils import logger, init_nltk, n_gram_split
+from utils import logger, init_nltk, n_gram_split, wikiart_base_url, parallel_map, shard_of
+from fetcher import AsyncFetcher
+from html_cache import html_cache, parse_cached_page
+from task_queue import TaskQueue, DONE, FAILED
+from writers import (
+    JsonlWriter, CsvStreamWriter, read_jsonl, read_jsonl_column, jsonl_to_csv, concat_frames, write_parquet, csv_to_parquet
+)
+from http_client import get_client
+from html_parser import make_soup, make_tree, node_text, parser_backend
+from normalize import add_artist_columns, movement_tags, join_tags
+from metrics import metrics
 
 
 def prepare_pages_list() -> List[str]:
     import string
 
-    BASE_URL = "https://www.wikiart.org/en/Alphabet"
+    BASE_URL = os.path.join(wikiart_base_url(), 'en/Alphabet')
     postfix = 'text-list'
 
     alphabet = list(string.ascii_lowercase)
     pages_list = [os.path.join(BASE_URL, page_liter, postfix) for page_liter in alphabet]
     return pages_list
 
-def request_retries(url, num_retries: int = 3):
-    # TODO: use 'backoff' module  instead of this
-    res = None
-    for _ in range(num_retries):
-        try:
-            res = requests.get(url)
-            if res.status_code == 200:
-                return res
-            else:
-                print("Failed to retrieve webpage %s. Status code: %s" % (url, res.status_code))
-        except requests.exceptions.ConnectionError as e:
-            logger.error('Failed to retrieve webpage %s\n%s', url, e)
-            time.sleep(0.25)
-    return res
+def request_retries(url, num_retries: Optional[int] = None):
+    return get_client().get(url, num_retries=num_retries)
 
-def get_html(url, html_dir_name=''):
-    html_dir = os.path.join(os.environ['ROOT_DATA_DIR'], html_dir_name)
-    html_file_name = url.split('/')[-1].split('.')[0]
-    html_path = os.path.join(html_dir, f"{html_file_name}.html")
-    if os.path.exists(html_path):
-        with open(html_path, 'r', encoding='utf-8') as file:
-            html_content = file.read()
-    else:
-        html_content = request_retries(url)
-        html_content = html_content.text  # `.content` ?
-        with open(html_path, 'w', encoding='utf-8') as file:
-            file.write(html_content)
+def get_html(url, html_dir_name='', offline: bool = False) -> Optional[str]:
+    cache = html_cache(html_dir_name)
+    html_content = cache.get(url)
+    metrics.inc('html_cache_hits_total' if html_content is not None else 'html_cache_misses_total', cache=html_dir_name)
+    if html_content is None and not offline:
+        res = request_retries(url)
+        if res is not None and res.status_code == 200:
+            html_content = res.text
+            cache.put(url, html_content, res.status_code)
     return html_content
 
+def cache_html(url, html_dir_name='', offline: bool = False) -> Optional[str]:
+    """Makes sure the page is in the HTML cache; the url for parse stage workers, None on failure"""
+    if url in html_cache(html_dir_name):
+        metrics.inc('html_cache_hits_total', cache=html_dir_name)
+        return url
+    if offline or get_html(url, html_dir_name) is None:
+        return None
+    return url
+
+def cache_pages(urls: List[str], html_dir_name: str = '', offline: bool = False) -> List[Optional[str]]:
+    """Batch version of `cache_html`: missing pages are downloaded concurrently by the asyncio fetcher"""
+    if offline:
+        return [cache_html(url, html_dir_name, offline=True) for url in urls]
+    statuses = AsyncFetcher().prefetch(urls, html_dir_name)
+    return [url if statuses[url] is not None else None for url in urls]
+
 def get_artists_pages(result_csv_path: str):
     page_list: List[str] = prepare_pages_list()
     if not os.path.exists(result_csv_path):
-        res_df = pd.DataFrame([], columns=['artist_name', 'artist_link'])
-        for current_alphabet_page in page_list:
-            artists_scraper = BeautifulSoup(
-                markup=requests.get(current_alphabet_page).content, features="html.parser"
-            )
-            res = artists_scraper.find(name="div", class_='masonry-text-view masonry-text-view-all')
-            artists = res.find_all(name='li')
-            print('Current page: %s, num artists: %d' % (current_alphabet_page, len(artists)))
-            res = []
-            for artist in artists:
-                artist_info = artist.find('a')
-                res.append((artist_info['href'], artist_info.get_text()))
-            current_page_df = pd.DataFrame(res, columns=['artist_link', 'artist_name'])
-            res_df = pd.concat([res_df, current_page_df])
-        res_df.to_csv(result_csv_path, index=False)
+        with CsvStreamWriter(result_csv_path, ['artist_name', 'artist_link']) as writer:
+            for current_alphabet_page in page_list:
+                artists_scraper = make_soup(request_retries(current_alphabet_page).content)
+                res = artists_scraper.find(name="div", class_='masonry-text-view masonry-text-view-all')
+                artists = res.find_all(name='li')
+                print('Current page: %s, num artists: %d' % (current_alphabet_page, len(artists)))
+                res = []
+                for artist in artists:
+                    artist_info = artist.find('a')
+                    res.append((artist_info['href'], artist_info.get_text()))
+                writer.write(pd.DataFrame(res, columns=['artist_link', 'artist_name']))
+        num_rows = writer.num_rows
     else:
-        res_df = pd.read_csv(result_csv_path)
-    logger.info("Artists pages saved to %s: %d rows", result_csv_path, res_df.shape[0])
+        num_rows = pd.read_csv(result_csv_path).shape[0]
+    logger.info("Artists pages saved to %s: %d rows", result_csv_path, num_rows)
 
 def extract_artist_wiki(artist_info_scraper: BeautifulSoup) -> str:
     wiki_text = 'Empty wiki'
@@ -92,7 +101,8 @@ def extract_artists_info(artist_page_scraper: BeautifulSoup) -> Dict[str, str]:
                 if prop_html is not None and prop_html.get_text() is not None:
                     property_name = prop_html.get_text().strip().lower().replace(':', '')
                     if property_name != 'share':
-                        prop_values = ' '.join(set(
+                        # dict.fromkeys: ordered dedup, so the output does not depend on string hashing
+                        prop_values = ' '.join(dict.fromkeys(
                             [i.get_text().strip().replace('\n', ' ') for i in prop.find_all(name='span')] +
                             [i.get_text().strip().replace('\n', ' ') for i in prop.find_all(name='a')]
                             )
@@ -105,61 +115,171 @@ def extract_artists_info(artist_page_scraper: BeautifulSoup) -> Dict[str, str]:
             )
     return res_dict
 
-def process_field(raw_str):
-    if not isinstance(raw_str, str):
-        return ''
-    try:
-        res = ' '.join(sorted(set([
-            i.strip().replace(',', '')
-            for i in raw_str.split(' ')
-            if len(i.strip().replace(',', '')) > 0]))
+def extract_artist_wiki_css(artist_info_tree) -> str:
+    wiki_text = 'Empty wiki'
+    wiki_node = artist_info_tree.css_first('#info-tab-wikipediaArticle.wiki-layout-artist-info-tab')
+    if wiki_node is not None:
+        wiki_text = node_text(wiki_node)
+    return wiki_text.replace('\n', ' ')
+
+def extract_artists_info_css(artist_page_tree) -> Dict[str, str]:
+    """selectolax version of `extract_artists_info`"""
+    res_dict = {}
+    artist_info = artist_page_tree.css_first('div.wiki-layout-artist-info')
+    if artist_info is not None:
+        for prop in artist_info.css('li'):
+            prop_html = prop.css_first('s')
+            if prop_html is not None:
+                property_name = prop_html.text().strip().lower().replace(':', '')
+                if property_name != 'share':
+                    prop_values = ' '.join(dict.fromkeys(
+                        [i.text().strip().replace('\n', ' ') for i in prop.css('span')] +
+                        [i.text().strip().replace('\n', ' ') for i in prop.css('a')]
+                        )
+                    )
+                    res_dict.update({property_name: prop_values})
+        res_dict['artist_pic'] = (
+            artist_page_tree
+            .css_first('div.wiki-layout-artist-image-wrapper')
+            .css_first('img')
+            .attributes['src']
         )
-    except Exception as e:
-        print(raw_str)
-        raise e
-    return res
+    return res_dict
+
+def parse_artist_page(html_content: str, backend: Optional[str] = None) -> Tuple[str, Dict[str, str]]:
+    if (backend or parser_backend()) == 'selectolax':
+        artist_info_tree = make_tree(html_content)
+        return extract_artist_wiki_css(artist_info_tree), extract_artists_info_css(artist_info_tree)
+    artist_info_scraper = make_soup(html_content, backend)
+    return extract_artist_wiki(artist_info_scraper), extract_artists_info(artist_info_scraper)
+
+def select_shard(artists_df: pd.DataFrame, shard: Optional[Tuple[int, int]]) -> pd.DataFrame:
+    """Artists of one shard by hash of artist_link; rows keep their artists_pages.csv index, which becomes `ind`"""
+    if shard is None:
+        return artists_df
+    index, num_shards = shard
+    return artists_df[[shard_of(artist_link, num_shards) == index for artist_link in artists_df['artist_link']]]
+
+ARTIST_INFO_COLUMNS = [
+    'ind', 'artist_name', 'artist_url', 'request_result_success', 'artist_pic',
+    'born', 'died', 'nationality', 'art movement', 'painting school', 'genre', 'field',
+    'influenced by', 'influenced on', 'teachers', 'pupils', 'friends and co-workers', 'family and relatives',
+    'art institution', 'wikipedia', 'official site',
+    'artist_field', 'artist_movement', 'other_properties'
+]
+WIKI_TEXT_COLUMNS = ['ind', 'artist_name', 'wiki_text']
+
+def artist_records(ind: int, artist_name: str, artist_page_url: str, parsed_page) -> Tuple[Dict, Dict]:
+    """artists_info and wiki_texts rows of one artist; artist_field / artist_movement are added column-wise to the csv"""
+    artist_dict = {
+        'ind': ind, 'artist_name': artist_name, 'artist_url': artist_page_url,
+        'request_result_success': False
+    }
+    wiki_text = 'Empty wiki'
+    if parsed_page is not None:
+        wiki_text, artist_info = parsed_page
+        artist_dict.update(artist_info)
+        artist_dict.update({'request_result_success': True})
+    return artist_dict, {'ind': ind, 'artist_name': artist_name, 'wiki_text': wiki_text}
 
-def get_artists_info(input_csv_path: str, output_csv_path: str, output_wikitext_csv_path: str):
-    if not os.path.exists(output_csv_path):
-        wiki_descriptions = []
-        artists_info = []
-        cnt = 0
-        input_df = pd.read_csv(input_csv_path)
-        logger.info('Artists information (wiki, etc) scraping started: %d rows', input_df.shape[0])
-        for ind, row in input_df.iterrows():
-            artist_page_url = os.path.join('https://www.wikiart.org', row['artist_link'][1:])
-            artist_info_page = get_html(artist_page_url, 'artists_raw_html')
-            artist_dict = {
-                'ind': ind, 'artist_name': row['artist_name'], 'artist_url': artist_page_url,
-                'request_result_success': False
-            }
-            wiki_text = 'Empty wiki'
-            if artist_info_page is not None:
-                # artist_info_scraper = BeautifulSoup(markup=artist_info_page.content, features="html.parser")
-                artist_info_scraper = BeautifulSoup(markup=artist_info_page, features="html.parser")
-                wiki_text = extract_artist_wiki(artist_info_scraper)
-                artist_info = extract_artists_info(artist_info_scraper)
-                artist_dict.update(artist_info)
-                artist_dict.update({'request_result_success': True})
-            wiki_descriptions.append((ind, row['artist_name'], wiki_text))
-            artists_info.append(artist_dict)
-            # time.sleep(0.25)
+def get_artists_info(
+    input_csv_path: str,
+    output_csv_path: str,
+    output_wikitext_csv_path: str,
+    offline: bool = False,
+    overwrite: bool = False,
+    incremental: bool = False,
+    shard: Optional[Tuple[int, int]] = None
+):
+    """
+    Network stage: artist pages are downloaded to `artists_raw_html` (skipped when `offline`)
+    Parsing stage: cached pages are parsed in a process pool, results stream back in input order
+    and are appended record by record to `.jsonl` files next to the csv outputs, so an interrupted run
+    resumes after the last written artist; the csv files are built from them at the end and they are removed.
+    Incremental mode: cached pages are revalidated with conditional requests, only pages that came back
+    with 200 (and new artists) are reparsed, other rows are kept from the existing output files
+    `shard` (index, num_shards): only the artists of that shard, see `select_shard`
+    """
+    outputs_exist = os.path.exists(output_csv_path) and os.path.exists(output_wikitext_csv_path)
+    if outputs_exist and not (overwrite or incremental):
+        logger.info('Artists info already exists files: %s; %s', output_csv_path, output_wikitext_csv_path)
+        return
+    incremental = incremental and outputs_exist
+    info_jsonl_path = output_csv_path.replace('.csv', '.jsonl')
+    wiki_jsonl_path = output_wikitext_csv_path.replace('.csv', '.jsonl')
+    fresh_start = overwrite or incremental
+    written_inds = set() if fresh_start else read_jsonl_column(info_jsonl_path, 'ind')
+    written_wiki_inds = set() if fresh_start else read_jsonl_column(wiki_jsonl_path, 'ind')
+    pages_df = pd.read_csv(input_csv_path)
+    base_url = wikiart_base_url()
+    # before any filtering: a slug collision is only seen among all artists
+    html_cache('artists_raw_html').import_legacy_pages(
+        [os.path.join(base_url, artist_link[1:]) for artist_link in pages_df['artist_link']]
+    )
+    input_df = select_shard(pages_df, shard)
+    logger.info('Artists information (wiki, etc) scraping started: %d rows', input_df.shape[0])
+    if len(written_inds) > 0:
+        input_df = input_df[~input_df.index.isin(written_inds)]
+        logger.info('Resuming: %d artists already written, %d left', len(written_inds), input_df.shape[0])
+    artist_page_urls = [os.path.join(base_url, artist_link[1:]) for artist_link in input_df['artist_link']]
+    if offline:
+        statuses = {url: 304 if cache_html(url, 'artists_raw_html', offline=True) else None for url in artist_page_urls}
+    else:
+        with metrics.timer('phase_seconds', phase='artists_fetch'):
+            statuses = AsyncFetcher().prefetch(artist_page_urls, 'artists_raw_html', revalidate=incremental)
+        logger.info(
+            'Artists pages fetched: %d of %d, modified: %d',
+            sum(status is not None for status in statuses.values()), len(statuses),
+            sum(status == 200 for status in statuses.values())
+        )
+    cached_urls = [url if statuses[url] is not None else None for url in artist_page_urls]
+    if incremental:
+        prev_info_df = pd.read_csv(output_csv_path)
+        prev_wiki_df = pd.read_csv(output_wikitext_csv_path)
+        known_urls = set(prev_info_df.loc[prev_info_df['request_result_success'], 'artist_url'])
+        cached_urls = [
+            url if url is not None and (statuses[url] == 200 or url not in known_urls) else None
+            for url in cached_urls
+        ]
+        reparsed_inds = {ind for ind, url in zip(input_df.index, cached_urls) if url is not None}
+        input_df = input_df[input_df.index.isin(reparsed_inds)]
+        cached_urls = [url for url in cached_urls if url is not None]
+        artist_page_urls = cached_urls
+        logger.info('Artists to reparse: %d', len(cached_urls))
+    parsed_pages = parallel_map(partial(parse_cached_page, parse_artist_page, 'artists_raw_html'), cached_urls)
+    cnt = 0
+    with metrics.timer('phase_seconds', phase='artists_parse'), \
+            JsonlWriter(info_jsonl_path, ARTIST_INFO_COLUMNS, 'other_properties', fresh_start) as info_writer, \
+            JsonlWriter(wiki_jsonl_path, WIKI_TEXT_COLUMNS, overwrite=fresh_start) as wiki_writer:
+        for (ind, row), artist_page_url, parsed_page in zip(input_df.iterrows(), artist_page_urls, parsed_pages):
+            artist_dict, wiki_dict = artist_records(ind, row['artist_name'], artist_page_url, parsed_page)
+            # wiki first: artists_info.jsonl marks the artist as written
+            if ind not in written_wiki_inds:
+                wiki_writer.write(wiki_dict)
+            info_writer.write(artist_dict)
+            metrics.inc('artists_written_total', success=artist_dict['request_result_success'])
             cnt += 1
             if cnt % 500 == 0:
                 logger.info('Num artists %d of %d', cnt, input_df.shape[0])
-        # saving data to artists_info.csv
-        artists_info_df = pd.json_normalize(artists_info)
-        artists_info_df['artist_field'] = artists_info_df['field'].apply(process_field)
-        artists_info_df['artist_movement'] = artists_info_df['art movement'].apply(process_art_movement)
-        artists_info_df.to_csv(output_csv_path, index=False)
-        logger.info('authors info saved to %s', output_csv_path)
-        (
-            pd.DataFrame(wiki_descriptions, columns=['ind', 'artist_name', 'wiki_text'])
-            .to_csv(output_wikitext_csv_path, index=False)
-        )
-        logger.info('wiki textx saved to %s', output_wikitext_csv_path)
+    if incremental:
+        for prev_df, jsonl_path, csv_path, transform in (
+            (prev_info_df, info_jsonl_path, output_csv_path, add_artist_columns),
+            (prev_wiki_df, wiki_jsonl_path, output_wikitext_csv_path, None)
+        ):
+            merged_df = pd.concat([prev_df[~prev_df['ind'].isin(reparsed_inds)], read_jsonl(jsonl_path)]).sort_values(by='ind')
+            if transform is not None:
+                merged_df = transform(merged_df)
+            merged_df.to_csv(csv_path, index=False)
     else:
-        logger.info('Artists info already exists files: %s; %s', output_csv_path, output_wikitext_csv_path)
+        jsonl_to_csv(info_jsonl_path, output_csv_path, ARTIST_INFO_COLUMNS, transform=add_artist_columns)
+        jsonl_to_csv(wiki_jsonl_path, output_wikitext_csv_path, WIKI_TEXT_COLUMNS)
+    logger.info('authors info saved to %s', output_csv_path)
+    logger.info('wiki textx saved to %s', output_wikitext_csv_path)
+    csv_to_parquet(output_csv_path, {'ind': 'int64', 'request_result_success': 'bool'})
+    csv_to_parquet(output_wikitext_csv_path, {'ind': 'int64'})
+    # the run is complete: nothing to resume from, csv and parquet hold every record
+    for jsonl_path in (info_jsonl_path, wiki_jsonl_path):
+        os.remove(jsonl_path)
 
 def get_artworks_json(artist_scraper: BeautifulSoup) -> str:
     img_set = artist_scraper.find(
@@ -172,131 +292,214 @@ def get_artworks_json(artist_scraper: BeautifulSoup) -> str:
             res = json.dumps([i.find(name='img')['img-source'].replace("'", "") for i in img_iter])
     return res
 
-def get_artwork_by_url(url) -> str:
-    # artwork_web_page = requests.get(url)
-    artwork_web_page = get_html(url, 'artworks_raw_html')
-    artwork_scraper = BeautifulSoup(markup=artwork_web_page, features="html.parser")
+def parse_artwork_page(html_content: str, backend: Optional[str] = None) -> Optional[str]:
+    if (backend or parser_backend()) == 'selectolax':
+        artwork_block = make_tree(html_content).css_first('div.wiki-layout-artist-image-wrapper')
+        if artwork_block is None or artwork_block.css_first('img') is None:
+            return None
+        return artwork_block.css_first('img').attributes['src']
+    artwork_scraper = make_soup(html_content, backend)
     class_ = 'wiki-layout-artist-image-wrapper'
     artwork_block = artwork_scraper.find(name='div', class_=class_)
-    res = artwork_block.find('img')['src']
-    return res
+    if artwork_block is None or artwork_block.find('img') is None:
+        return None
+    return artwork_block.find('img')['src']
 
-def get_artworks_links(artworks_url: str, limit: int = 10):
-    # artworks_page = request_retries(artworks_url).content
-    artworks_page = get_html(artworks_url, 'art_links')
-    artworks_array = []
-    if artworks_page is not None:
-        artwork_links_collector: BeautifulSoup = BeautifulSoup(markup=artworks_page, features="html.parser")
-        BASE_URL = "https://www.wikiart.org"
-        img_link_set = artwork_links_collector.find(name='ul', class_='painting-list-text')
+def parse_artworks_list(html_content: str, backend: Optional[str] = None) -> List[str]:
+    links = []
+    if (backend or parser_backend()) == 'selectolax':
+        img_link_set = make_tree(html_content).css_first('ul.painting-list-text')
         if img_link_set is not None:
-            img_iter = img_link_set.find_all(name='li')
-            exception_occured = False
-            artwork_cnt = 0
-            for i in img_iter:
-                if artwork_cnt > limit:
-                    break
-                try:
-                    link = i.find('a')['href']
-                    artwork_url = os.path.join(BASE_URL, link[1:])
-                    artworks_array.append(get_artwork_by_url(artwork_url))
-                    artwork_cnt += 1
-                except Exception as e:
-                    if not exception_occured:
-                        logger.error('url: %s, error %s', artworks_url, e)
-                        exception_occured = True
-    return artworks_array
-
-def save_batch(batch_data: List, final_csv_path: str, batches_dir_name: str, batch_num: int, batch_size: int):
-    batch_file_name = (
-        final_csv_path
-        .replace('.csv', f'_{batch_num * batch_size}_{batch_num * batch_size + batch_size}.csv')
-        .split('/')[-1]
-    )
+            for i in img_link_set.css('li'):
+                link = i.css_first('a')
+                if link is not None and link.attributes.get('href'):
+                    links.append(link.attributes['href'])
+        return links
+    artwork_links_collector: BeautifulSoup = make_soup(html_content, backend)
+    img_link_set = artwork_links_collector.find(name='ul', class_='painting-list-text')
+    if img_link_set is not None:
+        for i in img_link_set.find_all(name='li'):
+            link = i.find('a')
+            if link is not None and link.get('href'):
+                links.append(link['href'])
+    return links
+
+def get_artwork_by_url(url) -> Optional[str]:
+    artwork_web_page = get_html(url, 'artworks_raw_html')
+    if artwork_web_page is None:
+        return None
+    return parse_artwork_page(artwork_web_page)
+
+def get_artworks_links(artworks_urls: List[str], limit: int = 10, offline: bool = False) -> List[List[str]]:
+    """
+    Artwork image urls for a batch of artists. Pages of the whole batch are fetched concurrently
+    (artworks lists first, then every artwork page of every artist, capped by `http.concurrency`)
+    and parsed in a process pool.
+    """
+    base_url = wikiart_base_url()
+    list_urls = cache_pages(artworks_urls, 'art_links', offline)
+    artworks_links = parallel_map(partial(parse_cached_page, parse_artworks_list, 'art_links'), list_urls)
+    artwork_urls = [
+        [os.path.join(base_url, link[1:]) for link in links[:limit + 1]] if links is not None else []
+        for links in artworks_links
+    ]
+    unique_artwork_urls = list(dict.fromkeys(url for urls in artwork_urls for url in urls))
+    cached_artwork_urls = cache_pages(unique_artwork_urls, 'artworks_raw_html', offline)
+    artwork_srcs = dict(zip(
+        unique_artwork_urls,
+        parallel_map(partial(parse_cached_page, parse_artwork_page, 'artworks_raw_html'), cached_artwork_urls)
+    ))
+    artworks_arrays = []
+    for artworks_url, urls in zip(artworks_urls, artwork_urls):
+        artworks_array = [artwork_srcs[url] for url in urls if artwork_srcs[url] is not None]
+        if len(artworks_array) < len(urls):
+            logger.error('url: %s, failed artworks: %d', artworks_url, len(urls) - len(artworks_array))
+        artworks_arrays.append(artworks_array)
+    return artworks_arrays
+
+ARTWORKS_COLUMNS = ['ind', 'artist_name', 'artworks_url', 'artworks']
+
+def save_batch(batch_data: List, final_csv_path: str, batches_dir_name: str):
+    """Batch file is named by its first and last artist ind; written to a temp file first, so it is never partial"""
+    first_ind, last_ind = batch_data[0][0], batch_data[-1][0]
+    batch_file_name = final_csv_path.replace('.csv', f'_{first_ind}_{last_ind}.csv').split('/')[-1]
     batch_file_name = os.path.join(batches_dir_name, batch_file_name)
-    (
-        pd
-        .DataFrame(batch_data, columns=['ind', 'artist_name', 'artworks_url', 'artworks'])
-        .to_csv(batch_file_name, index=False)
-    )
+    pd.DataFrame(batch_data, columns=ARTWORKS_COLUMNS).to_csv(f'{batch_file_name}.tmp', index=False)
+    os.replace(f'{batch_file_name}.tmp', batch_file_name)
     logger.info('Saved to %s', batch_file_name)
 
-def collect_batches(batches_dir_name: str,  overwrite: bool = False):
+def collect_batches(batches_dir_name: str) -> pd.DataFrame:
     logger.info('Collecting batches from %s', batches_dir_name)
-    res = pd.DataFrame([], columns=['ind', 'artist_name', 'artworks_url', 'artworks'])
-    try: 
-        batch_files = os.listdir(batches_dir_name)
-        # batches from previous runs
-        for batch_file in batch_files:
-            res = pd.concat([res, pd.read_csv(os.path.join(batches_dir_name, batch_file))])
-        if res.shape[0] > 0 and overwrite:
-            for batch_file in batch_files:
-                logger.info('removing %s', batch_file)
-                os.remove(os.path.join(batches_dir_name, batch_file))
-        logger.info('Batches collected, num rows: %d', res.shape[0])
-    except FileNotFoundError:
-        os.makedirs(batches_dir_name)
+    batch_files = sorted(f for f in os.listdir(batches_dir_name) if f.endswith('.csv'))
+    res = concat_frames(
+        (pd.read_csv(os.path.join(batches_dir_name, batch_file)) for batch_file in batch_files), ARTWORKS_COLUMNS
+    )
+    logger.info('Batches collected, num rows: %d', res.shape[0])
     return res
 
-def get_photo_urls(input_csv_path, output_csv_path, batches_dir_name, batch_size: int = 30):
+def init_artworks_queue(input_csv_path: str, batches_dir_name: str, shard: Optional[Tuple[int, int]] = None) -> TaskQueue:
+    """
+    One task per artist; on every start artists new to artists_pages.csv are enqueued, known ones are left as they are.
+    Artists of batch files from runs before the queue existed are enqueued as done.
+    """
     page_postfix = 'all-works/text-list'
-    batches_df = collect_batches(batches_dir_name)
-    if batches_df.shape[0] > 0:
-        logger.info('Removing files...')
-        min_id, max_id = batches_df['ind'].min(), batches_df['ind'].max()
-        result_f_name = output_csv_path.replace('.csv', f'_{min_id}_{max_id}.csv').split('/')[-1]
-        batch_files = os.listdir(batches_dir_name)
-        for batch_file in batch_files:
-            logger.info('removing %s', batch_file)
-            os.remove(os.path.join(batches_dir_name, batch_file))
-        logger.info('Saving to %s', os.path.join(batches_dir_name, result_f_name))
-        batches_df.sort_values(by='ind').to_csv(os.path.join(batches_dir_name, result_f_name), index=False)
-    collected_ids = [int(i) for i in batches_df['ind'].values]
-    logger.info('Artwork url retrieval started. Num already collected artists: %d', len(collected_ids))
-    if not os.path.exists(output_csv_path):
-        artworks = []
-        cnt = 0
-        batch_num = 0
-        for ind, row in pd.read_csv(input_csv_path).iterrows():
-            cnt += 1
-            if ind in collected_ids:
-                if cnt % batch_size == 0:
-                    batch_num += 1
-                continue  # skip all collected ids
-            logger.info('scraping %d: %s...', ind, row['artist_link'])
-            result_url = os.path.join(os.path.join('https://www.wikiart.org', row['artist_link'][1:]), page_postfix)
-            artworks_links = get_artworks_links(result_url)
-            artworks.append((ind, row['artist_name'], result_url, json.dumps(artworks_links)))
-            if cnt % batch_size == 0:
-                save_batch(artworks, output_csv_path, batches_dir_name, batch_num, batch_size)
-                batch_num += 1
-                logger.info('Num processed links %d', cnt)
-                artworks = []
-        final_df = collect_batches(batches_dir_name)
-        logger.info('Total num rows %d', final_df.shape[0])
-        final_df.sort_values(by='ind').to_csv(output_csv_path, index=False)
+    os.makedirs(batches_dir_name, exist_ok=True)
+    queue = TaskQueue(os.path.join(batches_dir_name, 'tasks.sqlite'))
+    base_url = wikiart_base_url()
+    tasks = [
+        (ind, {
+            'artist_name': artist_name,
+            'artworks_url': os.path.join(os.path.join(base_url, artist_link[1:]), page_postfix)
+        })
+        for ind, artist_name, artist_link in select_shard(pd.read_csv(input_csv_path), shard)[['artist_name', 'artist_link']].itertuples()
+    ]
+    num_known = len(queue)
+    if num_known == 0:
+        collected_ids = set(collect_batches(batches_dir_name)['ind'].astype(int))
+        queue.enqueue([task for task in tasks if task[0] in collected_ids], state=DONE)
+        logger.info('Artworks queue created: %d tasks, %d already collected', len(tasks), len(collected_ids))
+    # INSERT OR IGNORE: only artists without a task yet
+    queue.enqueue(tasks)
+    if num_known > 0 and len(queue) > num_known:
+        logger.info('Artworks queue: %d new artists enqueued', len(queue) - num_known)
+    return queue
+
+def get_photo_urls(
+    input_csv_path, output_csv_path, batches_dir_name, batch_size: int = 30, max_attempts: int = 3,
+    shard: Optional[Tuple[int, int]] = None, offline: bool = False, overwrite: bool = False
+):
+    """
+    Artworks of every artist through the work queue of `batches_dir_name`, batch files are collected into the csv.
+    `offline`: artworks lists and artwork pages only from the HTML cache, missing pages give no artworks;
+    `overwrite` starts over with an empty queue and batch dir
+    """
+    if os.path.exists(output_csv_path) and not overwrite:
+        logger.info('Artworks data already exists: %s', output_csv_path)
+        return
+    if overwrite:
+        shutil.rmtree(batches_dir_name, ignore_errors=True)
+    queue = init_artworks_queue(input_csv_path, batches_dir_name, shard)
+    logger.info('Requeued tasks: %d', queue.requeue(max_attempts))
+    logger.info('Artwork url retrieval started: %s', queue.counts())
+    while True:
+        tasks = queue.claim(batch_size)
+        if len(tasks) == 0:
+            break
+        task_ids = [task_id for task_id, _ in tasks]
+        try:
+            with metrics.timer('phase_seconds', phase='artworks_batch'), queue.keep_leases(task_ids):
+                artworks_links = get_artworks_links([task['artworks_url'] for _, task in tasks], offline=offline)
+        except Exception as e:
+            logger.error('Batch %d-%d failed: %s', task_ids[0], task_ids[-1], e)
+            metrics.inc('artworks_batches_total', result='failed')
+            queue.fail(task_ids, str(e))
+            continue
+        metrics.inc('artworks_batches_total', result='done')
+        artworks = [
+            (task_id, task['artist_name'], task['artworks_url'], json.dumps(links))
+            for (task_id, task), links in zip(tasks, artworks_links)
+        ]
+        save_batch(artworks, output_csv_path, batches_dir_name)
+        queue.complete(task_ids)
+        logger.info('Queue state %s', queue.counts())
+    counts = queue.counts()
+    num_unfinished = queue.num_unfinished(max_attempts)
+    if num_unfinished > 0:
+        # the stage fails without an output, so the next run requeues them instead of skipping the stage
+        raise RuntimeError(
+            f'Artworks of {num_unfinished} artists are not collected yet (failed with attempts left or leased '
+            f'by another worker): {counts}, run the stage again'
+        )
+    if counts.get(FAILED, 0) > 0:
+        logger.error('Failed artists without attempts left, missing from %s: %d', output_csv_path, counts[FAILED])
+    # a batch saved right before a crash (but not marked done) is redone on restart, so rows can repeat
+    final_df = collect_batches(batches_dir_name).drop_duplicates(subset='ind')
+    logger.info('Total num rows %d', final_df.shape[0])
+    final_df.sort_values(by='ind').to_csv(output_csv_path, index=False)
     logger.info('Artworks data saved')
 
-def process_art_movement(raw_str):
-    if not isinstance(raw_str, str):
-        return ''
-    try:
-        res = ' '.join(sorted(set([i.strip() for i in raw_str.split(',')])))
-        res = ' '.join(sorted(set(res.split(' '))))
-    except Exception as e:
-        print(raw_str)
-        raise e
-    return res
+def merge_shard_outputs(shard_csv_paths: List[str], output_csv_path: str, column_types: Optional[Dict[str, str]] = None):
+    """
+    Rows of all shards ordered by `ind`, cell text as the shards wrote it. Shards split one artists_pages.csv,
+    so an `ind` in more than one shard means they were scraped from different artist lists
+    """
+    merged_df = concat_frames(
+        (pd.read_csv(path, dtype=str, keep_default_na=False) for path in shard_csv_paths),
+        pd.read_csv(shard_csv_paths[0], nrows=0).columns.tolist()
+    )
+    merged_df = merged_df.sort_values(by='ind', key=lambda inds: inds.astype(int), kind='stable')
+    duplicated = merged_df['ind'].duplicated()
+    if duplicated.any():
+        raise ValueError(
+            f'{duplicated.sum()} artists are in more than one shard of {output_csv_path}, '
+            'shards were built from different artists_pages.csv'
+        )
+    merged_df.to_csv(output_csv_path, index=False)
+    logger.info('Shards merged to %s: %d rows', output_csv_path, merged_df.shape[0])
+    if column_types is not None:
+        csv_to_parquet(output_csv_path, column_types)
 
-def greedy_tag_split(raw_tag_description: str, tags_df: pd.DataFrame) -> str:
-    """greedy_tag_split('post-impressionism socialist realism')"""
+def greedy_order(candidates: List[str], tag_sizes: Dict[str, int]) -> List[str]:
+    """
+    Candidates by descending tag size, ties in the order of
+    `DataFrame.sort_values(by='size', ascending=False)` (the former merge + sort of greedy_tag_split)
+    """
+    if len(candidates) == 0:
+        return candidates
+    sizes = np.array([tag_sizes[tag] for tag in candidates], dtype=np.int64)
+    positions = np.arange(sizes.size)[::-1]
+    order = positions[sizes[::-1].argsort(kind='quicksort')][::-1]
+    return [candidates[i] for i in order]
+
+
+def greedy_tag_split(raw_tag_description: str, tag_sizes: Dict[str, int]) -> str:
+    """
+    greedy_tag_split('post-impressionism socialist realism', {'socialist realism': 17, ...})
+    `tag_sizes` maps every known tag to its length, n-grams of the description are looked up in it
+    """
     input_str = raw_tag_description
-    res = (
-        pd.DataFrame(n_gram_split(input_str), columns=['tag'])
-        .merge(tags_df[~tags_df['tag'].isin([input_str])], how='inner', on='tag')
-        .sort_values(by='size', ascending=False)  # sort values for greedy matching algorithms
-        ['tag']
-        .values
+    res = greedy_order(
+        [tag for tag in n_gram_split(input_str) if tag in tag_sizes and tag != input_str], tag_sizes
     )
     res_tags = []
     for i in res:
@@ -310,36 +513,34 @@ def greedy_tag_split(raw_tag_description: str, tags_df: pd.DataFrame) -> str:
     return ','.join([' '.join(set(j.split(' '))) for j in res_tags])
 
 def compute_tags(artists_df) -> pd.DataFrame:
-    from itertools import chain
     from nltk.corpus import stopwords
 
-    def process_art_movement(raw_str: str):
-        return [i.strip() for i in raw_str.split(',') if len(i.strip().lower()) > 0]
-
-    artists_df['art movement'] = artists_df['art movement'].fillna('').apply(lambda x: x.lower())
-    artists_df['art_movement_raw_tags'] = artists_df['art movement'].apply(process_art_movement)
-    flatten_genres = list(chain.from_iterable(artists_df['art_movement_raw_tags'].values))
+    artists_df['art movement'] = artists_df['art movement'].fillna('').str.lower()
+    # raw tags of all artists exploded in one column, index = artist row position
+    raw_tags = movement_tags(artists_df['art movement']).rename('tag')
     tags_df = (
-        pd.DataFrame(flatten_genres,columns=['tag'])['tag']
+        raw_tags
         .value_counts()
         .reset_index(name='cnt')
     )
     # tags_df.rename(columns={'index': 'tag'}, inplace=True)
     print(tags_df.head())
     # some useful features
-    tags_df['is_complex'] = tags_df['tag'].apply(lambda x: len(x.split(' ')) > 1)
-    tags_df['size'] = tags_df['tag'].apply(lambda x: len(x))
+    tags_df['is_complex'] = tags_df['tag'].str.contains(' ', regex=False)
+    tags_df['size'] = tags_df['tag'].str.len()
 
-    tags_df['splitted_tags'] =  tags_df['tag'].apply(lambda x: greedy_tag_split(x, tags_df))
+    # one pass over the tags with a tag -> size hash index instead of a merge against tags_df per tag
+    tag_sizes = dict(zip(tags_df['tag'], tags_df['size']))
+    tags_df['splitted_tags'] = [greedy_tag_split(tag, tag_sizes) for tag in tags_df['tag']]
     processed_tag_mapping = {i: j for i, j in tags_df[['tag', 'splitted_tags']].values}
-    artists_df['art_tags'] = artists_df['art_movement_raw_tags'].apply(lambda x: ','.join([processed_tag_mapping[i] for i in x]))
+    artists_df['art_tags'] = join_tags(raw_tags.map(processed_tag_mapping), artists_df.shape[0]).to_numpy()
 
     tags_df = (
-        pd.DataFrame(list(chain.from_iterable(artists_df['art_tags'].apply(lambda x: x.split(',')).values)), columns=['tag'])
+        pd.DataFrame({'tag': artists_df['art_tags'].str.split(',').explode().to_numpy()})
         .value_counts()
         .reset_index(name='cnt')
     )
-    tags_df = tags_df[tags_df['tag'].apply(len) > 1]
+    tags_df = tags_df[tags_df['tag'].str.len() > 1]
     # stop_words = set(stopwords.words('english')) 
     # flat_list = list(
     #     np.concatenate(
@@ -375,6 +576,8 @@ def merge_data(
     res_df.index.name = None
     #
     artists_info_df = pd.read_csv(input_artists_info_csv_path)
+    if 'ind' in artists_info_df.columns:
+        artists_info_df.set_index('ind', inplace=True)
     print(artists_info_df.shape[0], artists_info_df.columns.tolist())
     #
     content_df = pd.merge(
@@ -387,11 +590,13 @@ def merge_data(
     logger.info('Num rows %d', content_df.shape[0])
     content_df.to_csv(output_csv_path, index=False, compression="gzip")
     print('Saved to %s, num rows: %d' % (output_csv_path, content_df.shape[0]))
+    write_parquet(content_df, output_csv_path, categories=['nationality'])
     #
     tags_df = compute_tags(content_df).query('cnt > 1')
     logger.info('Num tags %d', tags_df.shape[0])
     tags_df.to_csv(output_tags_csv_path, index=False, compression="gzip")
     print('Saved to %s, num rows: %d' % (output_tags_csv_path, tags_df.shape[0]))
+    write_parquet(tags_df, output_tags_csv_path)
 
 def prepare_service_data(service_data_path: str):
     pass
@@ -0,0 +1,219 @@
+import csv
+import gzip
+import json
+import os
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set
+
+import pandas as pd
+
+from utils import logger, parquet_path
+
+
+class JsonlWriter:
+    """
+    Append-only JSON lines output with a fixed list of columns: every record is flushed as soon as it is written,
+    so a crash keeps everything written before it. Keys outside of `columns` go to `extra_column` as a JSON string.
+
+    with JsonlWriter('artists_info.jsonl', ARTIST_INFO_COLUMNS, extra_column='other_properties') as writer:
+        writer.write(artist_dict)
+    """
+    def __init__(self, path: str, columns: List[str], extra_column: str = None, overwrite: bool = False):
+        self.path = path
+        self.columns = columns
+        self.extra_column = extra_column
+        if overwrite and os.path.exists(path):
+            os.remove(path)
+        self._drop_partial_line()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _drop_partial_line(self):
+        """A crash in the middle of a write leaves an unterminated last line"""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) == b'\n':
+                return
+            f.seek(0)
+            content = f.read()
+            f.truncate(content.rfind(b'\n') + 1)
+        logger.info('Partial record dropped from %s', self.path)
+
+    def write(self, record: dict):
+        row = {column: record.get(column) for column in self.columns}
+        if self.extra_column is not None:
+            extra = {key: value for key, value in record.items() if key not in row}
+            row[self.extra_column] = json.dumps(extra, ensure_ascii=False) if len(extra) > 0 else None
+        self._file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_jsonl_column(path: str, column: str) -> Set:
+    """Values of one column, e.g. already written `ind`s to resume from"""
+    values = set()
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.endswith('\n'):
+                    values.add(json.loads(line)[column])
+    return values
+
+
+def read_jsonl(path: str) -> pd.DataFrame:
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return pd.DataFrame([])
+    return pd.read_json(path, lines=True, dtype=False)
+
+
+class CsvStreamWriter:
+    """
+    Single streaming csv output for many frames (pages of a listing, batch or per-city files): the header is
+    written once and every frame is appended to the same open file, so nothing accumulates in memory and no rows
+    are copied twice. Columns are `columns` or those of the first frame, `.gz` paths are gzip compressed.
+    The file is swapped in on a clean exit only. With `parquet_categories` frames also go to the Parquet twin
+    as strings, the listed columns dictionary encoded.
+
+    with CsvStreamWriter('exhibitions_db.csv.gz', parquet_categories=['city_name']) as writer:
+        for city_df in city_dfs:
+            writer.write(city_df)
+    """
+    def __init__(self, csv_path: str, columns: Optional[List[str]] = None, parquet_categories: Optional[Sequence[str]] = None):
+        self.csv_path = csv_path
+        self.columns = None  # type: Optional[List[str]]
+        self.num_rows = 0
+        self._tmp_path = f'{csv_path}.tmp'
+        self._parquet_categories = parquet_categories
+        self._parquet_writer = None
+        opener = gzip.open if csv_path.endswith('.gz') else open
+        self._file = opener(self._tmp_path, 'wt', encoding='utf-8', newline='')
+        if columns is not None:
+            self._start(list(columns))
+
+    def _start(self, columns: List[str]):
+        self.columns = columns
+        pd.DataFrame([], columns=columns).to_csv(self._file, index=False)
+        if self._parquet_categories is not None:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            self._parquet_schema = pa.schema([
+                (column, pa.dictionary(pa.int32(), pa.string()) if column in self._parquet_categories else pa.string())
+                for column in columns
+            ])
+            self._parquet_writer = pq.ParquetWriter(
+                f'{parquet_path(self.csv_path)}.tmp', self._parquet_schema, compression='zstd'
+            )
+
+    def write(self, df: pd.DataFrame):
+        if self.columns is None:
+            self._start(list(df.columns))
+        df = df.reindex(columns=self.columns)
+        df.to_csv(self._file, header=False, index=False)
+        if self._parquet_writer is not None:
+            import pyarrow as pa
+
+            table = pa.Table.from_pandas(df.astype('string'), preserve_index=False)
+            self._parquet_writer.write_table(table.cast(self._parquet_schema))
+        self.num_rows += df.shape[0]
+
+    def close(self):
+        if self.columns is None:
+            self._start([])
+        self._file.close()
+        os.replace(self._tmp_path, self.csv_path)
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            os.replace(f'{parquet_path(self.csv_path)}.tmp', parquet_path(self.csv_path))
+            logger.info('Saved to %s', parquet_path(self.csv_path))
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._tmp_path)
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            os.remove(f'{parquet_path(self.csv_path)}.tmp')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def jsonl_to_csv(
+    jsonl_path: str,
+    csv_path: str,
+    columns: List[str],
+    chunksize: int = 5000,
+    transform: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None
+):
+    """Chunked conversion, the csv is replaced only when it is complete; `transform` is applied to every chunk"""
+    with CsvStreamWriter(csv_path) as writer:
+        if os.path.exists(jsonl_path) and os.path.getsize(jsonl_path) > 0:
+            for chunk in pd.read_json(jsonl_path, lines=True, chunksize=chunksize, dtype=False):
+                chunk = chunk.reindex(columns=columns)
+                writer.write(transform(chunk) if transform is not None else chunk)
+        if writer.num_rows == 0:
+            writer.write(pd.DataFrame([], columns=columns))
+    logger.info('%s converted to %s: %d rows', jsonl_path, csv_path, writer.num_rows)
+
+
+def concat_frames(frames: Iterable[pd.DataFrame], columns: List[str]) -> pd.DataFrame:
+    """
+    All frames concatenated at once; growing a frame with `pd.concat` per input copies every earlier row again,
+    which is quadratic in the number of inputs. No (non empty) frames give an empty frame with `columns`
+    """
+    frames = [frame for frame in frames if frame.shape[0] > 0]
+    if len(frames) == 0:
+        return pd.DataFrame([], columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def write_parquet(df: pd.DataFrame, csv_path: str, categories: Sequence[str] = ()) -> str:
+    """
+    Typed Parquet twin of a csv artifact (`content_db.csv.gz` -> `content_db.parquet`):
+    nullable string / integer dtypes instead of objects, `categories` are dictionary encoded
+    """
+    output_path = parquet_path(csv_path)
+    typed_df = df.convert_dtypes()
+    for column in categories:
+        typed_df[column] = typed_df[column].astype('category')
+    typed_df.to_parquet(output_path, index=False, compression='zstd')
+    logger.info('Saved to %s', output_path)
+    return output_path
+
+
+def csv_to_parquet(csv_path: str, column_types: Dict[str, str] = None) -> str:
+    """
+    Streaming conversion for csv artifacts that should not be loaded at once;
+    columns missing in `column_types` are strings
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+
+    column_types = column_types or {}
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        header = next(csv.reader(f))
+    convert_options = pa_csv.ConvertOptions(
+        column_types={column: pa.type_for_alias(column_types.get(column, 'string')) for column in header}
+    )
+    output_path = parquet_path(csv_path)
+    reader = pa_csv.open_csv(csv_path, convert_options=convert_options)
+    with pq.ParquetWriter(output_path, reader.schema, compression='zstd') as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+    logger.info('Saved to %s', output_path)
+    return output_path
@@ -0,0 +1,7 @@
+import os
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+# modules of src/ import each other flat and read config.yml at import time
+sys.path.insert(0, SRC_DIR)
+os.environ.setdefault('CONFIG_PATH', os.path.join(SRC_DIR, 'config.yml'))
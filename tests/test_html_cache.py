@@ -0,0 +1,33 @@
+"""
+Shard stores of the HTML cache fold into the main store after a sharded scrape (see main.shard_merge_stages)
+"""
+from html_cache import HtmlCache, merge_segments
+
+
+def test_merge_copies_pages_and_validators(tmp_path):
+    main_store = HtmlCache(str(tmp_path / 'artists_raw_html'))
+    main_store.put('https://www.wikiart.org/en/a', '<html>old a</html>', etag='"a1"')
+    shard_store = HtmlCache(str(tmp_path / 'artists_raw_html_shard0of2'))
+    shard_store.put('https://www.wikiart.org/en/a', '<html>new a</html>', etag='"a2"')
+    shard_store.put('https://www.wikiart.org/en/b', '<html>b</html>', last_modified='Mon, 05 Oct 2026 10:00:00 GMT')
+
+    assert main_store.merge(shard_store) == 2
+    assert main_store.get('https://www.wikiart.org/en/a') == '<html>new a</html>'
+    assert main_store.get('https://www.wikiart.org/en/b') == '<html>b</html>'
+    assert main_store.conditional_headers('https://www.wikiart.org/en/a') == {'If-None-Match': '"a2"'}
+    assert main_store.conditional_headers('https://www.wikiart.org/en/b') == {
+        'If-Modified-Since': 'Mon, 05 Oct 2026 10:00:00 GMT'
+    }
+    # pages already copied (or fetched later here) are not copied again
+    assert main_store.merge(shard_store) == 0
+
+
+def test_merge_segments(tmp_path, monkeypatch):
+    monkeypatch.setenv('ROOT_DATA_DIR', str(tmp_path))
+    monkeypatch.delenv('HTML_CACHE_SEGMENT', raising=False)
+    for index in range(2):
+        HtmlCache(str(tmp_path / f'art_links_shard{index}of2')).put(f'https://www.wikiart.org/en/{index}', str(index))
+
+    assert merge_segments('art_links', ['shard0of2', 'shard1of2']) == 2
+    main_store = HtmlCache(str(tmp_path / 'art_links'))
+    assert main_store.urls() == ['https://www.wikiart.org/en/0', 'https://www.wikiart.org/en/1']
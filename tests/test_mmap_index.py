@@ -0,0 +1,28 @@
+"""
+TermVectorizer over the memory-mapped vocabulary transforms texts exactly like the fitted TfidfVectorizer
+"""
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from mmap_index import TermVectorizer
+
+CORPUS = ['internationalization of art', 'cubism and surrealism', 'art of the internationalization era']
+
+
+def fitted():
+    tfidf = TfidfVectorizer().fit(CORPUS)
+    return tfidf, TermVectorizer.from_tfidf(tfidf)
+
+
+def test_transform_matches_tfidf():
+    tfidf, vectorizer = fitted()
+    texts = ['Cubism art', 'surrealism of the era era', 'unknown words only']
+    np.testing.assert_allclose(vectorizer.transform(texts).toarray(), tfidf.transform(texts).toarray())
+
+
+def test_tokens_longer_than_every_term_are_oov():
+    tfidf, vectorizer = fitted()
+    texts = ['internationalizations', 'internationalizationism art']
+    np.testing.assert_allclose(vectorizer.transform(texts).toarray(), tfidf.transform(texts).toarray())
+    assert vectorizer.transform(['internationalizations']).nnz == 0
+    assert vectorizer.count_oov(texts) == (2, 3)
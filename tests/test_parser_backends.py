@@ -0,0 +1,41 @@
+"""
+Every html parser backend extracts exactly the golden data from the saved wikiart pages in fixtures/parser/
+(<page type>_<name>.html, expected results in fixtures/parser/expected.json)
+"""
+import json
+import os
+
+import pytest
+
+from html_parser import PARSER_BACKENDS
+from wikiart import parse_artist_page, parse_artwork_page, parse_artworks_list
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'parser')
+PARSE_FUNCTIONS = {
+    'artworks_list': parse_artworks_list,
+    'artwork': parse_artwork_page,
+    'artist': parse_artist_page,
+}
+
+with open(os.path.join(FIXTURES_DIR, 'expected.json'), encoding='utf-8') as f:
+    EXPECTED = json.load(f)
+
+
+def page_type(file_name: str) -> str:
+    return next(name for name in PARSE_FUNCTIONS if file_name.startswith(f'{name}_'))
+
+
+def test_every_fixture_has_expected_data():
+    pages = {f for f in os.listdir(FIXTURES_DIR) if f.endswith('.html')}
+    assert pages == set(EXPECTED)
+
+
+@pytest.mark.parametrize('backend', PARSER_BACKENDS)
+@pytest.mark.parametrize('file_name', sorted(EXPECTED))
+def test_backend_matches_golden(backend, file_name):
+    pytest.importorskip(backend)
+    with open(os.path.join(FIXTURES_DIR, file_name), encoding='utf-8') as f:
+        html_content = f.read()
+    parsed = PARSE_FUNCTIONS[page_type(file_name)](html_content, backend)
+    # json round trip: tuples become lists, as in the golden file
+    assert json.loads(json.dumps(parsed)) == EXPECTED[file_name]
@@ -0,0 +1,88 @@
+"""
+Freshness checks of the search index against its source artifact
+"""
+import os
+
+import pandas as pd
+import pytest
+
+import prepare_search_index
+from mmap_index import index_info
+from prepare_search_index import SOURCE_ARTIFACT, ContentDB, source_path
+from utils import artifact_path, config
+
+TEXTS = ['cubism and collage in paris', 'surrealism dreams and paris', 'abstract expressionism in new york']
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setitem(config, 'root_data_dir', str(tmp_path))
+    monkeypatch.setitem(config, 'search_index', {'vectorizer': 'tfidf'})
+    pd.DataFrame({'ind': range(3), 'artist_name': ['a', 'b', 'c'], 'wiki_text': TEXTS}).to_csv(
+        artifact_path(SOURCE_ARTIFACT), index=False
+    )
+    return tmp_path
+
+
+def no_hashing(path):
+    raise AssertionError(f'{path} hashed')
+
+
+def test_unchanged_source_is_not_hashed(data_dir, monkeypatch):
+    index_dir = artifact_path('search_index')
+    ContentDB().refresh_index(index_dir)
+    monkeypatch.setattr(prepare_search_index, 'file_digest', no_hashing)
+    ContentDB().init_db()
+
+
+def test_touched_source_is_hashed_once(data_dir, monkeypatch):
+    index_dir = artifact_path('search_index')
+    ContentDB().refresh_index(index_dir)
+    built_sha1 = index_info(index_dir)['fingerprint']['sha1']
+    path = source_path(SOURCE_ARTIFACT)
+    os.utime(path, ns=(0, 0))
+    ContentDB().refresh_index(index_dir)
+    fingerprint = index_info(index_dir)['fingerprint']
+    assert (fingerprint['sha1'], fingerprint['mtime_ns']) == (built_sha1, 0)
+    monkeypatch.setattr(prepare_search_index, 'file_digest', no_hashing)
+    ContentDB().refresh_index(index_dir)
+
+
+def test_changed_source_rebuilds_the_index(data_dir):
+    index_dir = artifact_path('search_index')
+    ContentDB().refresh_index(index_dir)
+    pd.DataFrame({'ind': range(2), 'artist_name': ['a', 'b'], 'wiki_text': TEXTS[:2]}).to_csv(
+        artifact_path(SOURCE_ARTIFACT), index=False
+    )
+    content_db = ContentDB()
+    content_db.init_db()
+    assert content_db.corpus_numpy.shape[0] == 2
+
+
+def test_index_is_served_without_the_source(data_dir):
+    index_dir = artifact_path('search_index')
+    ContentDB().refresh_index(index_dir)
+    os.remove(source_path(SOURCE_ARTIFACT))
+    content_db = ContentDB()
+    content_db.init_db()
+    assert content_db.corpus_numpy.shape[0] == 3
+
+
+def test_changed_settings_rebuild_index_and_derived_tables(data_dir):
+    config['search_index'].update(n_neighbours=1, ann=True, n_lists=1)
+    content_db = ContentDB()
+    content_db.init_db()
+    assert content_db.neighbour_ids.shape == (3, 1)
+    assert content_db.ann_index.n_lists == 1
+
+    config['search_index'].update(n_neighbours=2, n_lists=2)
+    content_db = ContentDB()
+    content_db.init_db()
+    assert content_db.neighbour_ids.shape == (3, 2)
+    assert content_db.ann_index.n_lists == 2
+
+    config['search_index'].update(vectorizer='hashing', n_features=64)
+    content_db = ContentDB()
+    content_db.init_db()
+    assert content_db.corpus_numpy.shape == (3, 64)
+    assert index_info(content_db.index_dir)['params']['vectorizer'] == 'hashing'
@@ -0,0 +1,60 @@
+"""
+Leases of the artworks work queue: tasks of dead workers come back, tasks of live ones are left alone
+"""
+import subprocess
+import sys
+import time
+
+from task_queue import DONE, FAILED, IN_PROGRESS, PENDING, TaskQueue
+
+
+def tasks(num_tasks: int):
+    return [(task_id, {'artist_name': str(task_id)}) for task_id in range(num_tasks)]
+
+
+def states(queue: TaskQueue):
+    return dict(queue._db.execute('SELECT task_id, state FROM tasks').fetchall())
+
+
+def test_restart_reclaims_unexpired_leases_of_a_dead_process(tmp_path):
+    db_path = str(tmp_path / 'tasks.sqlite')
+    crashed = TaskQueue(db_path)
+    crashed.enqueue(tasks(4))
+    crashed.claim(2)
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    crashed.worker_id = f'{crashed.hostname}:{dead.pid}:0'
+    crashed.claim(1)
+    # same pid as a previous run of the container, other instance
+    restarted = TaskQueue(db_path)
+
+    assert restarted.requeue() == 3
+    assert set(states(restarted).values()) == {PENDING}
+
+
+def test_requeue_keeps_live_leases_and_counts_them_unfinished(tmp_path):
+    db_path = str(tmp_path / 'tasks.sqlite')
+    live = TaskQueue(db_path)
+    live.enqueue(tasks(3))
+    live.worker_id = 'other-host:1:0'
+    live.claim(1)
+    live.fail(live.claim(1)[0][:1], 'timeout')
+    other = TaskQueue(db_path)
+
+    assert other.requeue() == 1  # the failed task only
+    assert states(other) == {0: IN_PROGRESS, 1: PENDING, 2: PENDING}
+    other.complete([task_id for task_id, _ in other.claim(2)])
+    assert other.num_unfinished() == 1
+    other._set_state([0], FAILED)
+    other._db.execute('UPDATE tasks SET attempts = 3 WHERE task_id = 0')
+    assert other.num_unfinished() == 0
+    assert states(other)[1] == DONE
+
+
+def test_keep_leases_extends_them_while_the_batch_runs(tmp_path):
+    queue = TaskQueue(str(tmp_path / 'tasks.sqlite'), lease_seconds=0.3)
+    queue.enqueue(tasks(1))
+    queue.claim(1)
+    with queue.keep_leases([0]):
+        time.sleep(0.5)
+        assert queue._db.execute('SELECT lease_until FROM tasks').fetchone()[0] > time.time()